@@ -19,6 +19,8 @@ __date__ = '21 Apr 2019'
 default_config = {
     'cache_dir': "{{platform_confpath}}",
     'cache_ttl': 86400,
+    'cache_max_bytes': 0,
+    'cache_pinned': [],
     'pkg2zip': "/usr/local/bin/pkg2zip",
     'tsv_urls': {
         'PSV': "",
@@ -28,7 +30,36 @@ default_config = {
         'PSV_DLC': "",
         'PSP_DLC': "",
     },
-    'install_root': "./"
+    'install_root': "./",
+    'stage_dir': "",
+    'stage_inflight': 4,
+    'pipeline': {
+        'download_workers': 1,
+        'extract_workers': 0,
+        'extract_per_device': 2,
+        'queue_depth': 4,
+        'order': "cache-hits-first",
+    },
+    'mirrors': {
+        'rules': [],
+        'tsv_urls': {},
+        'probe_interval': 86400,
+        'stall_rate': 16384,
+        'stall_time': 30,
+    },
+    'bandwidth': {
+        'max_rate': 0,
+        'hosts': {},
+        'profiles': [],
+    },
+    'metrics': {
+        'output': "",
+        'listen': "",
+    },
+    'gui': {
+        'preload': True,
+        'install_workers': 2,
+    },
 }
 
 conf_header = """\
@@ -45,9 +76,57 @@ conf_header = """\
 # * install_root - can be set to the correct path to have psvpack automatically
 #                  install packages to your Vita while it's plugged in
 #                  (for example, it might be auto-mounted to `/media/USER/xxxxx`).
-#                  By default, the current directory is used.
+#                  By default, the current directory is used. Titles already
+#                  installed there from the same pkg are skipped, unless files
+#                  were added, removed or replaced since; use `install --verify`
+#                  to also catch files that were modified in place (eg. truncated)
 # * cache_dir    - Path to where pkg files are downloaded (cache_dir/pkg)
 # * cache_ttl    - Max age (in seconds) of TSV files before they are refreshed
+# * cache_max_bytes - Max total size of cached pkg files. Least-recently-used
+#                  packages are removed to make room for new downloads (0 = unlimited)
+# * cache_pinned - List of Title IDs or Content IDs that are never removed from the cache
+# * stage_dir    - If set, pkg2zip extracts into this (fast, local) scratch directory
+#                  first, and the finished title is then copied to the install root
+#                  in one pass. Recommended when installing to a slow SD card/USB device
+# * stage_inflight - Number of files copied simultaneously from stage_dir
+# * pipeline     - Concurrency for multi-item installs (eg. --getall). Extraction
+#                  of one item overlaps with the download of the next.
+#     * download_workers - number of simultaneous downloads
+#     * extract_workers  - number of simultaneous pkg2zip extractions
+#                          (0 = one per CPU)
+#     * extract_per_device - max simultaneous extractions writing to the
+#                          same destination device
+#     * queue_depth      - max downloaded items waiting to be extracted
+#     * order            - order of items for manifest installs (install -f):
+#                          manifest, smallest-first, largest-first, cache-hits-first
+# * mirrors      - Alternate download locations. The fastest available mirror is
+#                  used, and a download that fails or stalls moves on to the next
+#     * rules          - list of rewrite rules; either `host` (swap hostname) or
+#                        `prefix` (swap URL prefix), each with a list of `mirrors`
+#     * tsv_urls       - list of alternate URLs for each TSV (keyed like tsv_urls)
+#     * probe_interval - seconds between throughput probes of each mirror; hosts
+#                        that failed are tried last for this long
+#     * stall_rate     - a download slower than this (bytes/sec) for stall_time
+#                        seconds is abandoned for the next mirror (0 = never).
+#                        Only applies when a package has more than one mirror
+#     * stall_time     - seconds
+# * bandwidth    - Download rate limits, shared by all concurrent downloads. Rates
+#                  are in bytes/sec, or a size such as `2M` (0 = unlimited)
+#     * max_rate       - total rate limit
+#     * hosts          - rate limit per host, eg. {zeus.dl.playstation.net: 4M}
+#     * profiles       - time-of-day overrides of max_rate and/or hosts; the first
+#                        matching profile applies, eg. [{window: "08:00-23:00", max_rate: 2M}]
+# * metrics      - Performance metrics (downloads, cache, TSV refreshes, extraction)
+#     * output         - file written at the end of each run; JSON if the name ends
+#                        in .json, otherwise Prometheus text format (eg. for the
+#                        node_exporter textfile collector)
+#     * listen         - serve live metrics over HTTP at HOST:PORT while running
+#                        (/metrics and /metrics.json)
+# * gui          - psvpack-gui options
+#     * preload        - load game lists that haven't been opened yet in the
+#                        background, once the GUI is otherwise idle
+#     * install_workers - number of titles from the install queue that are
+#                        downloaded/installed at the same time
 #
 ---
 """
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+# vim: set ts=4 sw=4 expandtab syntax=python:
+"""
+
+psvpack.aio
+Asyncio API for embedding psvpack in other applications
+
+@author   Jacob Hipps <jacob@ycnrg.org>
+
+Copyright (c) 2018 J. Hipps / Neo-Retro Group, Inc.
+https://ycnrg.org/
+
+"""
+
+import os
+import asyncio
+import logging
+import shutil
+from asyncio.subprocess import PIPE, STDOUT
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from time import time
+
+from psvpack import default_config
+from psvpack import metrics
+from psvpack import psfree
+from psvpack.cache import PkgCache
+from psvpack.installdb import InstallDB
+from psvpack.pipeline import make_event, make_job
+
+
+logger = logging.getLogger('psvpack')
+
+
+class EventStream(object):
+    """
+    Async iterator of progress events from an AsyncClient (see pipeline.make_event)
+    Iteration ends when the client is closed, or the stream is closed
+    """
+    def __init__(self, client):
+        self.client = client
+        self.queue = asyncio.Queue()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        event = await self.queue.get()
+        if event is None:
+            raise StopAsyncIteration
+        return event
+
+    def close(self):
+        """
+        Stop receiving events; iteration ends once queued events are consumed
+        """
+        if self in self.client.streams:
+            self.client.streams.remove(self)
+            self.queue.put_nowait(None)
+
+
+class AsyncClient(object):
+    """
+    Asyncio interface to psvpack. Must be created and used from within a running event loop
+
+        async with AsyncClient(config) as client:
+            events = client.events()
+            result = await client.install('PCSE00898', uxroot='/media/vita')
+
+    Any number of installs may run concurrently as tasks. Downloads run on a pool
+    of @download_workers threads (blocking HTTP), while pkg2zip runs as an asyncio
+    subprocess, limited to @extract_workers at once overall and @extract_per_device
+    per destination device. Defaults come from the `pipeline` config section.
+    Catalogs are loaded once per client and shared between operations
+    """
+    def __init__(self, config, download_workers=None, extract_workers=None, extract_per_device=None):
+        self.config = config
+        pconf = dict(default_config['pipeline'])
+        pconf.update(config.get('pipeline') or {})
+        self.download_workers = max(1, int(download_workers or pconf['download_workers']))
+        self.extract_workers = int(extract_workers or pconf['extract_workers']) or os.cpu_count() or 1
+        self.extract_per_device = max(1, int(extract_per_device or pconf['extract_per_device']))
+
+        self.dlpool = ThreadPoolExecutor(max_workers=self.download_workers)
+        self.exsem = asyncio.Semaphore(self.extract_workers)
+        self.devsems = {}
+        self.tsvs = {}
+        self.streams = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        self.close()
+
+    def close(self):
+        """
+        End all event streams and shut down the download pool
+        """
+        for tstream in list(self.streams):
+            tstream.close()
+        self.dlpool.shutdown(wait=False)
+
+    def events(self):
+        """
+        Return a new EventStream, which receives all events emitted from now on
+        """
+        tstream = EventStream(self)
+        self.streams.append(tstream)
+        return tstream
+
+    def _emit(self, etype, job, **kwargs):
+        event = make_event(etype, job, **kwargs)
+        for tstream in self.streams:
+            tstream.queue.put_nowait(event)
+
+    async def _run(self, func, *args):
+        """
+        Run blocking @func(*args) on the default executor
+        """
+        return await asyncio.get_running_loop().run_in_executor(None, partial(func, *args))
+
+    async def catalog(self, glist="PSV"):
+        """
+        Return the TSVManager for @glist, loading (and if needed, updating) it
+        on first use. Returns None if the catalog can't be loaded
+        """
+        glist = glist.upper()
+        if glist not in self.tsvs:
+            self.tsvs[glist] = asyncio.ensure_future(self._run(psfree.TSVManager, glist, self.config))
+        try:
+            tsv = await asyncio.shield(self.tsvs[glist])
+        except Exception as e:
+            logger.error("Failed to load %s catalog: %s", glist, str(e))
+            tsv = None
+        if tsv is None or not tsv.loaded:
+            # allow a retry on the next call
+            self.tsvs.pop(glist, None)
+            return None
+        return tsv
+
+    async def search(self, query, glist="PSV", regions=['US', 'JP', 'EU', 'ASIA']):
+        """
+        Search @glist for @query (regex on name, or exact Title ID)
+        Returns list of catalog entries, or None if the catalog can't be loaded
+        """
+        tsv = await self.catalog(glist)
+        if tsv is None:
+            return None
+        return await self._run(tsv.search, query, regions)
+
+    async def resolve(self, tid, glist="PSV"):
+        """
+        Return list of catalog entries in @glist for Title ID or Content ID @tid
+        (empty if not found), or None if the catalog can't be loaded
+        """
+        tsv = await self.catalog(glist)
+        if tsv is None:
+            return None
+        return tsv.get_title(tid) or []
+
+    async def fetch(self, tgame, glist="PSV", noverify=False):
+        """
+        Download the package for catalog entry @tgame into the pkg cache
+        Returns job dict (see pipeline.make_job) with status `downloaded` or `failed`
+        """
+        job = make_job(tgame, glist)
+        try:
+            stime = time()
+            job['path'] = await self._fetch_job(job, noverify)
+            job.update(status='downloaded' if job['path'] else 'failed', fetch_time=time() - stime)
+        except Exception as e:
+            logger.error("Unhandled error while fetching %s: %s", tgame['Content ID'], str(e))
+            job.update(status='failed', path=None)
+            self._emit('failed', job, error=str(e))
+        return job
+
+    async def install(self, item, glist="PSV", uxroot="./", install=True, noverify=False, force=False, getall=True,
+                      verify=False):
+        """
+        Download and extract @item (a Title ID, Content ID or catalog entry) into
+        @uxroot. All matching items are installed concurrently, unless @getall is False
+        Installed items are skipped unless @force is True; @verify checks all of
+        their files first (see InstallDB.is_current)
+        Returns dict with `success` and `failed` counts, `jobs` (see pipeline.make_job)
+        and `results` mapping each Content ID to its resulting path; or None if
+        @item could not be resolved
+        """
+        if isinstance(item, dict):
+            gresults = [item]
+        else:
+            gresults = await self.resolve(item, glist)
+            if not gresults:
+                logger.error("No %s match found for %s", glist, item)
+                return None
+            if len(gresults) > 1 and not getall:
+                logger.error("Multiple results found for %s. Use a Content ID to fetch a specific item", item)
+                return None
+
+        jobs = [make_job(x, glist, uxroot) for x in gresults]
+        await asyncio.gather(*[self._install_job(x, install, noverify, force, verify) for x in jobs])
+        for job in jobs:
+            metrics.INSTALLS.inc(result=job['status'])
+
+        success = len([x for x in jobs if x['status'] in ('installed', 'downloaded', 'skipped')])
+        return {'success': success, 'failed': len(jobs) - success, 'jobs': jobs,
+                'results': dict([(x['tgame']['Content ID'], x['path']) for x in jobs])}
+
+    async def _install_job(self, job, install, noverify, force, verify):
+        tgame = job['tgame']
+        pin = None
+        try:
+            if install and not force:
+                # manifest is re-read each time, as the client may be long-lived
+                idb = await self._run(InstallDB, job['uxroot'])
+                title_path = await self._run(idb.is_current, tgame, verify)
+                if title_path:
+                    logger.info("%s is already installed and up to date --> %s", tgame['Content ID'], title_path)
+                    job.update(status='skipped', path=title_path)
+                    self._emit('skipped', job, path=title_path)
+                    return job
+
+            if install:
+                # keep the package from being evicted from the cache until it has been extracted
+                pin = PkgCache(self.config).pin(tgame)
+                await self._run(pin.acquire)
+
+            stime = time()
+            local_path = await self._fetch_job(job, noverify)
+            job['fetch_time'] = time() - stime
+            if local_path is None:
+                job['status'] = 'failed'
+                return job
+            elif not install:
+                job.update(status='downloaded', path=local_path)
+                return job
+
+            stime = time()
+            title_path = await self._extract_job(job, local_path)
+            job['extract_time'] = time() - stime
+            metrics.EXTRACT_TIME.observe(job['extract_time'])
+            job.update(status='installed' if title_path else 'failed', path=title_path)
+            if title_path:
+                self._emit('extract_done', job, path=title_path)
+            else:
+                self._emit('failed', job, error="extraction failed")
+        except Exception as e:
+            logger.error("Unhandled error while installing %s: %s", tgame['Content ID'], str(e))
+            job['status'] = 'failed'
+            self._emit('failed', job, error=str(e))
+        finally:
+            if pin is not None:
+                pin.release()
+        return job
+
+    async def _fetch_job(self, job, noverify):
+        """
+        Fetch pkg for @job on the download pool, relaying progress as events
+        Returns local pkg path, or None on failure
+        """
+        loop = asyncio.get_running_loop()
+
+        def progress(curbyte, total):
+            loop.call_soon_threadsafe(partial(self._emit, 'fetch_progress', job, bytes=curbyte, total=total))
+
+        self._emit('fetch_start', job)
+        local_path = await loop.run_in_executor(self.dlpool, psfree.fetch_pkg, job['tgame'], self.config, noverify, progress)
+        if local_path is None:
+            self._emit('failed', job, error="download failed")
+        else:
+            self._emit('fetch_done', job, path=local_path)
+        return local_path
+
+    def _device_sem(self, uxroot):
+        """
+        Return the semaphore for the device that @uxroot resides on
+        """
+        try:
+            devid = os.stat(uxroot).st_dev
+        except OSError:
+            devid = os.path.realpath(uxroot)
+        if devid not in self.devsems:
+            self.devsems[devid] = asyncio.Semaphore(self.extract_per_device)
+        return self.devsems[devid]
+
+    async def _extract_job(self, job, local_path):
+        """
+        Extract @local_path into @job's uxroot (see psfree.extract_game)
+        """
+        tgame, glist, uxroot = job['tgame'], job['glist'], job['uxroot']
+        stage_dir = psfree.get_stage_dir(tgame, self.config, glist, uxroot)
+        async with self._device_sem(uxroot), self.exsem:
+            self._emit('extract_start', job)
+            if stage_dir:
+                title_path = await self._staged_pkg2zip(local_path, tgame, glist, uxroot, stage_dir)
+            else:
+                title_path = await self._pkg2zip(local_path, tgame, uxroot, glist)
+
+        return await self._run(psfree.finish_extract, tgame, title_path, glist, uxroot)
+
+    async def _pkg2zip(self, pkgfile, tgame, cwd, glist):
+        """
+        Run pkg2zip on @pkgfile in @cwd as an asyncio subprocess (see psfree.pkg2zip)
+        """
+        pz = await asyncio.create_subprocess_exec(*psfree.pkg2zip_args(pkgfile, tgame['zRIF'], cwd, self.config['pkg2zip']),
+                                                  cwd=cwd, stdout=PIPE, stderr=STDOUT)
+        pout, _ = await pz.communicate()
+        return psfree.check_pkg2zip(pz.returncode, pout, tgame['Title ID'], tgame['Content ID'], cwd, glist)
+
+    async def _staged_pkg2zip(self, pkgfile, tgame, glist, uxroot, stage_dir):
+        """
+        Extract @pkgfile under @stage_dir, then copy it into @uxroot (see psfree.staged_pkg2zip)
+        """
+        tmpdir = await self._run(psfree.make_stage_tmpdir, stage_dir)
+        if tmpdir is None:
+            return None
+
+        try:
+            spath = await self._pkg2zip(pkgfile, tgame, tmpdir, glist)
+            if spath is None:
+                return None
+            return await self._run(psfree.install_staged, spath, tmpdir, self.config, uxroot)
+        finally:
+            await self._run(shutil.rmtree, tmpdir, True)
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# vim: set ts=4 sw=4 expandtab syntax=python:
+"""
+
+psvpack.bandwidth
+Process-wide download bandwidth scheduler
+
+@author   Jacob Hipps <jacob@ycnrg.org>
+
+Copyright (c) 2018 J. Hipps / Neo-Retro Group, Inc.
+https://ycnrg.org/
+
+"""
+
+import logging
+import threading
+from time import time, sleep
+
+from psvpack import default_config
+from psvpack.util import fmtsize, parse_size, parse_window, in_window
+
+
+logger = logging.getLogger('psvpack')
+
+# how often (seconds) the active time-of-day profile is re-evaluated
+PROFILE_CHECK = 30.0
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def parse_rate(rate):
+    """
+    Parse rate (bytes/sec) from an int or size string such as `2M`
+    Returns 0 (unlimited) if @rate is empty or invalid
+    """
+    if not rate:
+        return 0
+    prate = parse_size(rate)
+    if prate is None:
+        logger.error("Invalid bandwidth rate '%s'. Ignoring.", rate)
+        return 0
+    return prate
+
+
+class TokenBucket(object):
+    """
+    Token bucket limiting throughput to @rate bytes/sec, with bursts of up
+    to @burst bytes (default: one second's worth). Tokens may go negative;
+    a caller that overdraws the bucket waits until the debt is repaid, so
+    concurrent callers are queued behind each other in proportion to what
+    they consumed
+    """
+    def __init__(self, rate, burst=None):
+        self.lock = threading.Lock()
+        self.rate = 0
+        self.burst = 0
+        self.tokens = 0.0
+        self.last = time()
+        self.set_rate(rate, burst)
+
+    def set_rate(self, rate, burst=None):
+        """
+        Change the fill rate of the bucket (0 = unlimited)
+        """
+        with self.lock:
+            self.rate = rate
+            self.burst = burst or rate
+            self.tokens = min(self.tokens, self.burst)
+
+    def reserve(self, nbytes):
+        """
+        Take @nbytes from the bucket. Returns the number of seconds the
+        caller must wait before the transfer is within the rate limit
+        """
+        with self.lock:
+            nowtime = time()
+            if not self.rate:
+                self.last = nowtime
+                return 0.0
+            self.tokens = min(self.burst, self.tokens + (nowtime - self.last) * self.rate)
+            self.last = nowtime
+            self.tokens -= nbytes
+            return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+class BandwidthScheduler(object):
+    """
+    Shares download bandwidth between all transfers in the process
+
+    Configured by the `bandwidth` config section:
+
+        bandwidth:
+          max_rate: 0                  # global cap, bytes/sec or eg. `10M` (0 = unlimited)
+          hosts:                       # per-host caps
+            zeus.dl.playstation.net: 4M
+          profiles:                    # time-of-day overrides; first match wins
+            - window: "08:00-23:00"
+              max_rate: 2M
+
+    Every transfer draws from the global bucket and from its host's bucket
+    (if capped), so adding more parallel downloads never exceeds the caps
+    """
+    def __init__(self, config=None):
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.gbucket = TokenBucket(0)
+        self.conf = None
+        self.conf_src = None
+        self.profiles = []
+        self.hrates = {}
+        self.profile = None
+        self.checked = 0
+        self.configure(config or {})
+
+    def configure(self, config):
+        """
+        (Re-)load limits from @config. Existing transfers pick up the new limits
+        """
+        bconf = dict(default_config['bandwidth'])
+        bconf.update(config.get('bandwidth') or {})
+        with self.lock:
+            self.conf = bconf
+            self.conf_src = config.get('bandwidth')
+            self.profiles = []
+            for tprof in bconf.get('profiles') or []:
+                pwindow = parse_window(tprof.get('window'))
+                if pwindow is None:
+                    logger.error("Invalid bandwidth profile window '%s'. Ignoring.", tprof.get('window'))
+                    continue
+                self.profiles.append((pwindow, tprof))
+            self.checked = 0
+        self.update_limits(force=True)
+
+    def active_limits(self):
+        """
+        Return tuple of (global rate, dict of host -> rate, active profile window)
+        for the current time
+        """
+        grate = parse_rate(self.conf.get('max_rate'))
+        hrates = dict([(k.lower(), parse_rate(v)) for k, v in (self.conf.get('hosts') or {}).items()])
+        for pwindow, tprof in self.profiles:
+            if in_window(pwindow):
+                if 'max_rate' in tprof:
+                    grate = parse_rate(tprof['max_rate'])
+                hrates.update([(k.lower(), parse_rate(v)) for k, v in (tprof.get('hosts') or {}).items()])
+                return (grate, hrates, tprof.get('window'))
+        return (grate, hrates, None)
+
+    def update_limits(self, force=False):
+        """
+        Apply the limits of the active profile, if it changed
+        """
+        with self.lock:
+            if not force and time() - self.checked < PROFILE_CHECK:
+                return
+            self.checked = time()
+            grate, hrates, profile = self.active_limits()
+            if force or profile != self.profile:
+                logger.debug("Bandwidth profile %s: global limit %s", profile or 'default',
+                             fmtsize(grate, rate=True).strip() if grate else 'none')
+            self.profile = profile
+            self.gbucket.set_rate(grate)
+            self.hrates = hrates
+            for host, tbucket in self.buckets.items():
+                tbucket.set_rate(hrates.get(host, 0))
+
+    def host_bucket(self, host):
+        """
+        Return token bucket for @host
+        """
+        host = host.lower()
+        with self.lock:
+            if host not in self.buckets:
+                self.buckets[host] = TokenBucket(self.hrates.get(host, 0))
+            return self.buckets[host]
+
+    def host_rate(self, host):
+        """
+        Return effective rate limit for transfers from @host (0 = unlimited)
+        """
+        rates = [x for x in (self.gbucket.rate, self.host_bucket(host).rate) if x]
+        return min(rates) if rates else 0
+
+    def throttle(self, host, nbytes):
+        """
+        Account for @nbytes received from @host, sleeping as long as needed
+        to keep within the global and per-host limits
+        """
+        self.update_limits()
+        wait = max(self.gbucket.reserve(nbytes), self.host_bucket(host).reserve(nbytes))
+        if wait > 0:
+            sleep(wait)
+
+    def throttler(self, host):
+        """
+        Return HostThrottle for transfers from @host
+        """
+        return HostThrottle(self, host)
+
+
+class HostThrottle(object):
+    """
+    Throttle for a single transfer from @host, for use by download_pkg
+    Called as throttle(nbytes) after each read
+    """
+    def __init__(self, scheduler, host):
+        self.scheduler = scheduler
+        self.host = host
+
+    def __call__(self, nbytes):
+        self.scheduler.throttle(self.host, nbytes)
+
+    def rate(self):
+        """
+        Return current effective rate limit (bytes/sec) of this transfer (0 = unlimited)
+        """
+        return self.scheduler.host_rate(self.host)
+
+
+def get_scheduler(config=None):
+    """
+    Return the process-wide BandwidthScheduler, so that all transfers share
+    one set of limits. If @config is given and its `bandwidth` section has
+    changed, the scheduler is reconfigured
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = BandwidthScheduler(config)
+        elif config is not None and config.get('bandwidth') != _scheduler.conf_src:
+            _scheduler.configure(config)
+        return _scheduler
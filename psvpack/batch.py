@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# vim: set ts=4 sw=4 expandtab syntax=python:
+"""
+
+psvpack.batch
+Manifest-driven batch installation
+
+@author   Jacob Hipps <jacob@ycnrg.org>
+
+Copyright (c) 2018 J. Hipps / Neo-Retro Group, Inc.
+https://ycnrg.org/
+
+"""
+
+import os
+import logging
+from time import time
+
+import yaml
+
+from psvpack import default_config
+from psvpack import psfree
+from psvpack.cache import PkgCache
+from psvpack.pipeline import InstallPipeline, make_job
+from psvpack.util import fmtsize
+
+
+logger = logging.getLogger('psvpack')
+
+ORDER_POLICIES = ['manifest', 'smallest-first', 'largest-first', 'cache-hits-first']
+
+
+def load_manifest(fpath, uxroot="./"):
+    """
+    Load batch install manifest from YAML file @fpath
+
+    A manifest lists Title IDs or Content IDs per game list, either for a
+    single install root:
+
+        uxroot: /media/user/XXXX-YYYY
+        order: smallest-first
+        lists:
+          PSV: [PCSE00898, PCSG00551]
+          PSV_DLC: [PCSG00551]
+
+    or for several install roots, as a list of `targets`, each with its own
+    `uxroot` and `lists`. Install roots default to @uxroot if not specified.
+    Returns dict with `order` and `targets`, or None if the manifest is invalid
+    """
+    try:
+        with open(os.path.expanduser(fpath)) as f:
+            mdata = yaml.load(f, Loader=yaml.SafeLoader)
+    except Exception as e:
+        logger.error("Failed to load manifest %s: %s", fpath, str(e))
+        return None
+
+    if not isinstance(mdata, dict):
+        logger.error("Invalid manifest %s: expected a mapping", fpath)
+        return None
+
+    targets = mdata.get('targets') or [{'uxroot': mdata.get('uxroot'), 'lists': mdata.get('lists')}]
+    for ttarget in targets:
+        if not isinstance(ttarget, dict) or not isinstance(ttarget.get('lists'), dict):
+            logger.error("Invalid manifest %s: each target requires a `lists` mapping", fpath)
+            return None
+        ttarget['uxroot'] = ttarget.get('uxroot') or mdata.get('uxroot') or uxroot
+
+    return {'order': mdata.get('order'), 'targets': targets}
+
+def resolve_jobs(manifest, config):
+    """
+    Resolve all IDs in @manifest against the catalogs, loading each list once
+    Returns tuple of (jobs, unresolved IDs)
+    """
+    tsvs = {}
+    jobs = []
+    seen = set()
+    unresolved = []
+    for ttarget in manifest['targets']:
+        for glist, idlist in ttarget['lists'].items():
+            glist = glist.upper()
+            if glist not in tsvs:
+                tsvs[glist] = psfree.TSVManager(glist, config)
+            for tid in idlist or []:
+                gresults = tsvs[glist].get_title(str(tid))
+                if gresults is None:
+                    logger.error("No %s match found for %s", glist, tid)
+                    unresolved.append((glist, str(tid)))
+                    continue
+                for tgame in gresults:
+                    jkey = (os.path.realpath(ttarget['uxroot']), tgame['Content ID'])
+                    if jkey not in seen:
+                        seen.add(jkey)
+                        jobs.append(make_job(tgame, glist, ttarget['uxroot']))
+    return (jobs, unresolved)
+
+def job_size(job):
+    """
+    Return reported package size of @job, or 0 if unknown
+    """
+    try:
+        return int(job['tgame']['File Size'])
+    except (KeyError, TypeError, ValueError):
+        return 0
+
+def order_jobs(jobs, policy, pcache):
+    """
+    Return @jobs sorted according to order @policy (see ORDER_POLICIES)
+    cache-hits-first starts with packages that are already cached, so that
+    extraction has work to do while the first downloads are running
+    """
+    if policy == 'smallest-first':
+        return sorted(jobs, key=job_size)
+    elif policy == 'largest-first':
+        return sorted(jobs, key=job_size, reverse=True)
+    elif policy == 'cache-hits-first':
+        return sorted(jobs, key=lambda x: not pcache.is_cached(x['tgame']))
+    return list(jobs)
+
+def print_report(jobs, unresolved, wall_time):
+    """
+    Print summary report of a batch run, with per-item timings
+    """
+    print('{:10} {:8} {:40} {:>10} {:>8} {:>8}'.format("Status", "List", "ID", "Size", "Fetch", "Extract"))
+    print('=' * 90)
+    for job in jobs:
+        print('{:10} {:8} {:40} {:>10} {:>7.1f}s {:>7.1f}s'.format(job['status'], job['glist'], job['tgame']['Content ID'],
+                                                                   fmtsize(job_size(job)), job['fetch_time'], job['extract_time']))
+    for glist, tid in unresolved:
+        print('{:10} {:8} {}'.format("notfound", glist, tid))
+
+    counts = {}
+    for job in jobs:
+        counts[job['status']] = counts.get(job['status'], 0) + 1
+    processed = sum([job_size(x) for x in jobs if x['status'] in ('installed', 'downloaded')])
+    print('=' * 90)
+    print("%d items in %.1fs: %s; %d not found. %s processed" %
+          (len(jobs), wall_time, ', '.join(['%d %s' % (v, k) for k, v in sorted(counts.items())]) or 'none',
+           len(unresolved), fmtsize(processed).strip()))
+
+def batch_install(fpath, config, uxroot="./", install=True, noverify=False, force=False, order=None,
+                  on_event=None, report=True, verify=False):
+    """
+    Install everything listed in manifest @fpath in a single pipelined run
+    Concurrency is set by the `pipeline` config section: download_workers
+    (network), extract_workers (CPU) and extract_per_device (disk)
+    @on_event = progress event callback (see pipeline.make_event)
+    @report = print summary report at the end
+    @verify = check all installed files before skipping (see InstallDB.is_current)
+    Returns pipeline result dict (see InstallPipeline.run_jobs), or None on error
+    """
+    manifest = load_manifest(fpath, uxroot)
+    if manifest is None:
+        return None
+
+    policy = order or manifest['order'] or (config.get('pipeline') or {}).get('order') or default_config['pipeline']['order']
+    if policy not in ORDER_POLICIES:
+        logger.error("Unknown order policy '%s'. Available: %s", policy, ', '.join(ORDER_POLICIES))
+        return None
+
+    stime = time()
+    jobs, unresolved = resolve_jobs(manifest, config)
+    jobs = order_jobs(jobs, policy, PkgCache(config))
+    logger.info("Resolved %d items from manifest (%d not found). Order: %s", len(jobs), len(unresolved), policy)
+
+    pipe = InstallPipeline(config, install=install, noverify=noverify, force=force, on_event=on_event, verify=verify)
+    bres = pipe.run_jobs(jobs)
+    bres['failed'] += len(unresolved)
+    bres['unresolved'] = unresolved
+
+    if report:
+        print_report(jobs, unresolved, time() - stime)
+    return bres
@@ -0,0 +1,13 @@
+#!/usr/bin/env python3
+# vim: set ts=4 sw=4 expandtab syntax=python:
+"""
+
+psvpack.bench
+Performance benchmarks. Run with `python -m psvpack.bench`
+
+@author   Jacob Hipps <jacob@ycnrg.org>
+
+Copyright (c) 2018 J. Hipps / Neo-Retro Group, Inc.
+https://ycnrg.org/
+
+"""
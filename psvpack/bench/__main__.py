@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# vim: set ts=4 sw=4 expandtab syntax=python:
+"""
+
+psvpack.bench.__main__
+Benchmark runner CLI
+
+@author   Jacob Hipps <jacob@ycnrg.org>
+
+Copyright (c) 2018 J. Hipps / Neo-Retro Group, Inc.
+https://ycnrg.org/
+
+"""
+
+import sys
+import json
+import logging
+from time import sleep
+from argparse import ArgumentParser
+
+from psvpack.util import parse_size
+from psvpack.bandwidth import parse_rate
+from psvpack.bench import catalog, install, report
+from psvpack.bench.fakerepo import FakeRepo
+
+
+def _main():
+    aparser = ArgumentParser(description="psvpack benchmarks")
+    aparser.add_argument("suite", nargs="?", default="catalog", choices=["catalog", "install", "serve"],
+                         help="benchmark to run, or `serve` to only run the fake repository [default: %(default)s]")
+    aparser.add_argument("--lists", "-g", metavar="LIST,..", help="game lists to benchmark [default: all (catalog), PSV (install)]")
+    aparser.add_argument("--rows", "-n", metavar="N,..", help="catalog sizes [default: %s]" % (','.join([str(x) for x in catalog.DEFAULT_ROWS])))
+    aparser.add_argument("--repeat", type=int, default=5, help="repetitions per measurement [default: %(default)s]")
+    aparser.add_argument("--seed", type=int, default=0, help="random seed for generated catalogs [default: %(default)s]")
+    aparser.add_argument("--workdir", metavar="PATH", help="keep generated files in PATH")
+    aparser.add_argument("--out", "-o", metavar="PATH", help="write results to PATH as JSON")
+    aparser.add_argument("--baseline", "-b", metavar="PATH", help="compare against results stored in PATH")
+    aparser.add_argument("--threshold", type=float, default=0.2, help="regression threshold, as a fraction [default: %(default)s]")
+    aparser.add_argument("--items", type=int, default=8, help="packages per install run [default: %(default)s]")
+    aparser.add_argument("--size", default="64M", help="size of each package [default: %(default)s]")
+    aparser.add_argument("--download-workers", type=int, default=1, help="concurrent downloads [default: %(default)s]")
+    aparser.add_argument("--extract-workers", type=int, default=0, help="concurrent extractions [default: auto]")
+    aparser.add_argument("--port", type=int, default=0, help="fake repository port [default: any free port]")
+    aparser.add_argument("--rate", default="0", help="fake repository bandwidth per connection, eg. 10M [default: unlimited]")
+    aparser.add_argument("--total-rate", default="0", help="fake repository total bandwidth [default: unlimited]")
+    aparser.add_argument("--latency", type=float, default=0.0, help="fake repository response latency, seconds [default: %(default)s]")
+    aparser.add_argument("--no-ranges", dest="ranges", action="store_false", help="fake repository ignores Range requests")
+    aparser.add_argument("--no-etags", dest="etags", action="store_false", help="fake repository sends no ETag/Last-Modified")
+    aparser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of requests failed with 503 [default: %(default)s]")
+    aparser.add_argument("--drop-rate", type=float, default=0.0, help="fraction of responses cut off mid-transfer [default: %(default)s]")
+    opts = aparser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    lists = opts.lists.upper().split(',') if opts.lists else None
+
+    if opts.suite == 'catalog':
+        bres = catalog.run(lists=lists, rows=[int(x) for x in opts.rows.split(',')] if opts.rows else None,
+                           repeat=opts.repeat, workdir=opts.workdir, seed=opts.seed)
+    else:
+        repo_opts = dict(port=opts.port, rate=parse_rate(opts.rate), total_rate=parse_rate(opts.total_rate),
+                         latency=opts.latency, ranges=opts.ranges, etags=opts.etags, fail_rate=opts.fail_rate,
+                         drop_rate=opts.drop_rate)
+        if opts.suite == 'serve':
+            with FakeRepo(seed=opts.seed, **repo_opts) as repo:
+                for glist in lists or ['PSV']:
+                    repo.add_catalog(glist, opts.items, parse_size(opts.size), opts.seed)
+                    print("%s: %s" % (glist, repo.url('/%s.tsv' % (glist))))
+                try:
+                    while True:
+                        sleep(60)
+                except KeyboardInterrupt:
+                    return
+        bres = install.run(lists=lists, items=opts.items, size=parse_size(opts.size), workdir=opts.workdir, seed=opts.seed,
+                           download_workers=opts.download_workers, extract_workers=opts.extract_workers, **repo_opts)
+    report.print_results(bres)
+
+    if opts.out:
+        with open(opts.out, 'w') as f:
+            json.dump(bres, f, indent=1)
+
+    if opts.baseline:
+        with open(opts.baseline) as f:
+            crows = report.compare(bres, json.load(f), opts.threshold)
+        print()
+        report.print_comparison(crows)
+        if any([x[4] for x in crows]):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    _main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# vim: set ts=4 sw=4 expandtab syntax=python:
+"""
+
+psvpack.bench.catalog
+Catalog load, search & lookup benchmarks
+
+@author   Jacob Hipps <jacob@ycnrg.org>
+
+Copyright (c) 2018 J. Hipps / Neo-Retro Group, Inc.
+https://ycnrg.org/
+
+"""
+
+import os
+import gc
+import sys
+import random
+import tempfile
+import tracemalloc
+from time import perf_counter
+
+from psvpack import psfree
+from psvpack.bench.report import run_meta
+from psvpack.bench.tsvgen import SCHEMAS, write_tsv
+
+# the GUI model is benchmarked only if PyQt5 is installed
+try:
+    from psvpack.gui import GameListModel, GameListFilter
+except ImportError:
+    GameListModel = None
+
+
+# search queries per kind. `fuzzy` queries are subsequence patterns, which is
+# how a fuzzy match is expressed with the regex search TSVManager provides
+QUERIES = {
+    'literal': ['dragon', 'Neptunia', '伝説', 'zzzz-no-match'],
+    'regex': [r'^Super.*[0-9]$', r'(Tales|Legend) of', r'ク.*ト'],
+    'fuzzy': ['d.*r.*g.*n', 'p.*r.*s.*n.*a', '勇.*語'],
+}
+
+DEFAULT_ROWS = [1000, 10000, 100000]
+
+
+def percentile(values, pct):
+    """
+    Return the @pct percentile of @values
+    """
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))]
+
+def timeit(func, repeat):
+    """
+    Call @func @repeat times. Returns list of durations (seconds)
+    """
+    times = []
+    for _ in range(repeat):
+        stime = perf_counter()
+        func()
+        times.append(perf_counter() - stime)
+    return times
+
+def load_catalog(tsvdir, glist, fname):
+    """
+    Load cached catalog @fname from @tsvdir through TSVManager (no network access)
+    """
+    config = {'cache_dir': tsvdir, 'cache_ttl': 10 ** 9, 'tsv_urls': {glist: 'http://localhost/' + fname}}
+    return psfree.TSVManager(glist, config)
+
+def bench_list(glist, rows, workdir, repeat=5, seed=0):
+    """
+    Run all benchmarks for a synthetic @glist catalog of @rows rows
+    Returns list of result dicts
+    """
+    results = []
+
+    def add(metric, value, unit):
+        results.append({'list': glist, 'rows': rows, 'metric': metric, 'value': value, 'unit': unit})
+
+    fname = '%s_%d.tsv' % (glist, rows)
+    os.makedirs(os.path.join(workdir, 'tsv'), exist_ok=True)
+    fpath = os.path.join(workdir, 'tsv', fname)
+    if not os.path.exists(fpath):
+        write_tsv(fpath, glist, rows, seed)
+    add('file_size', os.path.getsize(fpath), 'bytes')
+
+    tsv = load_catalog(workdir, glist, fname)
+    if not tsv.loaded:
+        raise RuntimeError("failed to load generated catalog %s" % (fpath))
+
+    # parse time & peak memory are measured separately, as tracing slows parsing down
+    gc.collect()
+    add('parse_time', min(timeit(tsv.load_tsv, repeat)), 's')
+    gc.collect()
+    tracemalloc.start()
+    tsv.glist = []
+    tsv.load_tsv()
+    add('parse_peak_mem', tracemalloc.get_traced_memory()[1], 'bytes')
+    tracemalloc.stop()
+
+    for kind, queries in QUERIES.items():
+        times = []
+        for query in queries:
+            times += timeit(lambda: tsv.search(query), repeat)
+        add('search_%s_p50' % (kind), percentile(times, 50), 's')
+        add('search_%s_max' % (kind), max(times), 's')
+
+    if GameListModel is not None:
+        model = GameListModel()
+        proxy = GameListFilter()
+        proxy.setSourceModel(model)
+        add('model_load', min(timeit(lambda: (model.setGames(tsv.glist), proxy.rowCount()), repeat)), 's')
+
+    rng = random.Random(seed)
+    sample = rng.sample(tsv.glist, min(1000, len(tsv.glist)))
+    for kind, key in (('title_id', 'Title ID'), ('content_id', 'Content ID')):
+        times = []
+        for trow in sample:
+            stime = perf_counter()
+            tsv.get_title(trow[key])
+            times.append(perf_counter() - stime)
+        add('lookup_%s_p50' % (kind), percentile(times, 50), 's')
+        add('lookup_%s_p99' % (kind), percentile(times, 99), 's')
+
+    return results
+
+def run(lists=None, rows=None, repeat=5, workdir=None, seed=0):
+    """
+    Run benchmarks for each of @lists at each size in @rows
+    Returns dict with run `meta` data and `results`
+    """
+    lists = lists or sorted(SCHEMAS)
+    rows = rows or DEFAULT_ROWS
+    tmpdir = None
+    if workdir is None:
+        tmpdir = tempfile.TemporaryDirectory(prefix='psvpack-bench-')
+        workdir = tmpdir.name
+
+    results = []
+    try:
+        for glist in lists:
+            for nrows in rows:
+                sys.stderr.write("Benchmarking %s with %d rows...\n" % (glist, nrows))
+                results += bench_list(glist, nrows, workdir, repeat, seed)
+    finally:
+        if tmpdir is not None:
+            tmpdir.cleanup()
+
+    return {'meta': run_meta(repeat=repeat, seed=seed), 'results': results}
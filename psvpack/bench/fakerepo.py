@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+# vim: set ts=4 sw=4 expandtab syntax=python:
+"""
+
+psvpack.bench.fakerepo
+Local fake package repository & stub pkg2zip, for offline benchmarks
+
+@author   Jacob Hipps <jacob@ycnrg.org>
+
+Copyright (c) 2018 J. Hipps / Neo-Retro Group, Inc.
+https://ycnrg.org/
+
+"""
+
+import os
+import io
+import re
+import csv
+import sys
+import json
+import random
+import hashlib
+import logging
+import threading
+import multiprocessing
+from time import time, sleep
+from email.utils import formatdate, parsedate_tz, mktime_tz
+from socketserver import ThreadingMixIn
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import requests
+
+from psvpack.bandwidth import TokenBucket
+from psvpack.bench.tsvgen import SCHEMAS, generate_rows
+
+
+logger = logging.getLogger('psvpack')
+
+# generated packages repeat a block of random data, so that GB-sized packages
+# can be served without being stored anywhere
+BLOCK_SIZE = 1024 * 1024
+SEND_CHUNK = 64 * 1024
+
+# like a real PKG file, the header holds the Content ID at offset 0x30
+PKG_MAGIC = b'\x7fPKG'
+PKG_CID_OFFSET = 0x30
+PKG_HEADER_SIZE = 0x100
+
+STUB_PKG2ZIP = """\
+#!{python}
+# stub pkg2zip generated by psvpack.bench.fakerepo. Reads the Content ID from
+# a fake package and 'extracts' it by copying the package to the file that
+# pkg2zip would produce for it
+import os, sys
+args = [x for x in sys.argv[1:] if not x.startswith('-')]
+with open(args[0], 'rb') as f:
+    header = f.read({header_size})
+    if header[:4] != {magic!r}:
+        print("pkg2zip: invalid pkg file " + args[0])
+        sys.exit(1)
+    content_id = header[{cid_offset}:{cid_offset} + 36].decode('ascii')
+    title_id, label = content_id[7:16], content_id[20:]
+    if label.strip('0'):
+        outpath = os.path.join('addcont', title_id, label)
+        outfile = os.path.join(outpath, '_data', 'addoninfo.dat')
+    else:
+        outpath = os.path.join('app', title_id)
+        outfile = os.path.join(outpath, 'eboot.bin')
+    print("[*] unpacking " + content_id + " --> " + outpath)
+    os.makedirs(os.path.dirname(outfile), exist_ok=True)
+    f.seek(0)
+    with open(outfile, 'wb') as o:
+        while True:
+            buf = f.read({block_size})
+            if not buf:
+                break
+            o.write(buf)
+print("[*] done!")
+"""
+
+
+def write_stub_pkg2zip(fpath):
+    """
+    Write stub pkg2zip script to @fpath, which extracts packages generated
+    by Blob into the same layout as pkg2zip (eg. `app/<TITLE>/eboot.bin`)
+    """
+    with open(fpath, 'w') as f:
+        f.write(STUB_PKG2ZIP.format(python=sys.executable, header_size=PKG_HEADER_SIZE, magic=PKG_MAGIC,
+                                    cid_offset=PKG_CID_OFFSET, block_size=BLOCK_SIZE))
+    os.chmod(fpath, 0o755)
+    return fpath
+
+
+class Blob(object):
+    """
+    Fake package of @size bytes for @content_id. Content is deterministic,
+    and generated on the fly as it is read
+    """
+    def __init__(self, content_id, size, mtime=None):
+        self.content_id = content_id
+        self.size = max(size, PKG_HEADER_SIZE)
+        self.mtime = mtime or time()
+        rng = random.Random(content_id)
+        block = bytearray(rng.getrandbits(8) for _ in range(4096)) * (BLOCK_SIZE // 4096)
+        block[:PKG_HEADER_SIZE] = (PKG_MAGIC + b'\0' * (PKG_CID_OFFSET - len(PKG_MAGIC)) +
+                                   content_id.encode('ascii')).ljust(PKG_HEADER_SIZE, b'\0')
+        self.block = bytes(block)
+        self._sha256 = None
+
+    def read(self, offset, length):
+        """
+        Return @length bytes at @offset
+        """
+        length = max(0, min(length, self.size - offset))
+        out = bytearray()
+        while len(out) < length:
+            boff = (offset + len(out)) % BLOCK_SIZE
+            out += self.block[boff:boff + length - len(out)]
+        return bytes(out)
+
+    def sha256(self):
+        """
+        Return SHA256 hex digest of the blob
+        """
+        if self._sha256 is None:
+            hasher = hashlib.sha256()
+            for toff in range(0, self.size, BLOCK_SIZE):
+                hasher.update(self.read(toff, BLOCK_SIZE))
+            self._sha256 = hasher.hexdigest()
+        return self._sha256
+
+    @property
+    def etag(self):
+        return '"%s"' % (self.sha256()[:16])
+
+
+class FileBlob(Blob):
+    """
+    Static content (eg. a TSV catalog) served by FakeRepo
+    """
+    def __init__(self, data, mtime=None):
+        self.data = data
+        self.size = len(data)
+        self.mtime = mtime or time()
+        self._sha256 = hashlib.sha256(data).hexdigest()
+
+    def read(self, offset, length):
+        return self.data[offset:offset + length]
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeRepo(object):
+    """
+    Local HTTP server standing in for a package repository
+
+    @rate = per-connection bandwidth limit, bytes/sec (0 = unlimited)
+    @total_rate = bandwidth limit shared by all connections (0 = unlimited)
+    @latency = delay (seconds) before each response is sent
+    @ranges = honour Range requests; if False, the full file is always sent
+    @etags = send ETag & Last-Modified headers, and answer conditional requests with 304
+    @fail_rate = fraction of requests answered with 503
+    @drop_rate = fraction of responses cut off part-way through the body
+    """
+    def __init__(self, host='127.0.0.1', port=0, rate=0, total_rate=0, latency=0.0, ranges=True, etags=True,
+                 fail_rate=0.0, drop_rate=0.0, seed=0):
+        self.files = {}
+        self.rate = rate
+        self.tbucket = TokenBucket(total_rate)
+        self.latency = latency
+        self.ranges = ranges
+        self.etags = etags
+        self.fail_rate = fail_rate
+        self.drop_rate = drop_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = dict.fromkeys(['requests', 'bytes_sent', 'not_modified', 'partial', 'failed', 'dropped'], 0)
+        self.server = _Server((host, port), self._make_handler())
+        self.thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        logger.debug("Fake repository listening on %s", self.url('/'))
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def url(self, path):
+        """
+        Return URL of @path on the server
+        """
+        return 'http://%s:%d/%s' % (self.server.server_address[0], self.server.server_address[1], path.lstrip('/'))
+
+    def add(self, path, blob):
+        """
+        Serve @blob (Blob or FileBlob) at @path. Returns its URL
+        """
+        self.files['/' + path.lstrip('/')] = blob
+        return self.url(path)
+
+    def add_catalog(self, glist, items, size, seed=0):
+        """
+        Generate a catalog of @items packages of @size bytes for @glist, and
+        serve the packages & catalog (at `/<glist>.tsv`). Returns list of catalog rows
+        """
+        rows = []
+        for trow in generate_rows(glist, items, seed, missing_rate=0.0):
+            blob = Blob(trow['Content ID'], size)
+            trow['PKG direct link'] = self.add('/pkg/%s.pkg' % (trow['Content ID']), blob)
+            trow['File Size'] = str(blob.size)
+            trow['SHA256'] = blob.sha256()
+            rows.append(trow)
+
+        tbuf = io.StringIO()
+        writer = csv.DictWriter(tbuf, SCHEMAS[glist], dialect='excel-tab', lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(rows)
+        self.add('/%s.tsv' % (glist), FileBlob(tbuf.getvalue().encode('utf-8')))
+        return rows
+
+    def _count(self, **kwargs):
+        with self.lock:
+            for tkey, tval in kwargs.items():
+                self.stats[tkey] += tval
+
+    def _roll(self, chance):
+        with self.lock:
+            return self.rng.random() < chance
+
+    def _make_handler(self):
+        repo = self
+
+        class RepoHandler(BaseHTTPRequestHandler):
+            def do_HEAD(self):
+                self.handle_get(body=False)
+
+            def do_GET(self):
+                self.handle_get(body=True)
+
+            def handle_get(self, body):
+                if self.path == '/_stats':
+                    with repo.lock:
+                        data = json.dumps(repo.stats).encode('utf-8')
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(data)))
+                    self.end_headers()
+                    if body:
+                        self.wfile.write(data)
+                    return
+                repo._count(requests=1)
+                if repo.latency:
+                    sleep(repo.latency)
+                blob = repo.files.get(self.path.split('?')[0])
+                if blob is None:
+                    self.send_error(404)
+                    return
+                if repo._roll(repo.fail_rate):
+                    repo._count(failed=1)
+                    self.send_error(503, "Injected failure")
+                    return
+
+                if repo.etags:
+                    inm = self.headers.get('If-None-Match')
+                    ims = parsedate_tz(self.headers.get('If-Modified-Since') or '')
+                    if (inm and inm == blob.etag) or (not inm and ims and mktime_tz(ims) >= int(blob.mtime)):
+                        repo._count(not_modified=1)
+                        self.send_response(304)
+                        self.send_header('ETag', blob.etag)
+                        self.end_headers()
+                        return
+
+                start, end = 0, blob.size - 1
+                rmatch = re.match(r'bytes=(\d*)-(\d*)$', self.headers.get('Range') or '')
+                if repo.ranges and rmatch and (rmatch.group(1) or rmatch.group(2)):
+                    if not rmatch.group(1):
+                        start = max(0, blob.size - int(rmatch.group(2)))
+                    else:
+                        start = int(rmatch.group(1))
+                        end = min(end, int(rmatch.group(2))) if rmatch.group(2) else end
+                    if start >= blob.size or start > end:
+                        self.send_response(416)
+                        self.send_header('Content-Range', 'bytes */%d' % (blob.size))
+                        self.send_header('Content-Length', '0')
+                        self.end_headers()
+                        return
+                    repo._count(partial=1)
+                    self.send_response(206)
+                    self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, end, blob.size))
+                else:
+                    self.send_response(200)
+                    if repo.ranges:
+                        self.send_header('Accept-Ranges', 'bytes')
+                self.send_header('Content-Length', str(end - start + 1))
+                self.send_header('Content-Type', 'application/octet-stream')
+                if repo.etags:
+                    self.send_header('ETag', blob.etag)
+                    self.send_header('Last-Modified', formatdate(blob.mtime, usegmt=True))
+                self.end_headers()
+                if body:
+                    self.send_body(blob, start, end + 1)
+
+            def send_body(self, blob, start, end):
+                # dropped responses are cut off at a random point in the body
+                cutoff = end
+                if repo._roll(repo.drop_rate):
+                    with repo.lock:
+                        cutoff = repo.rng.randint(start, end - 1)
+                bucket = TokenBucket(repo.rate)
+                offset = start
+                try:
+                    while offset < cutoff:
+                        data = blob.read(offset, min(SEND_CHUNK, cutoff - offset))
+                        delay = max(bucket.reserve(len(data)), repo.tbucket.reserve(len(data)))
+                        if delay:
+                            sleep(delay)
+                        self.wfile.write(data)
+                        offset += len(data)
+                        repo._count(bytes_sent=len(data))
+                except (ConnectionError, OSError):
+                    return
+                if cutoff < end:
+                    repo._count(dropped=1)
+                    self.close_connection = True
+
+            def log_message(self, *args):
+                pass
+
+        return RepoHandler
+
+
+def _serve_repo(repo_opts, catalogs, conn):
+    repo = FakeRepo(**repo_opts)
+    for glist, items, size, seed in catalogs:
+        repo.add_catalog(glist, items, size, seed)
+    conn.send(repo.server.server_address)
+    conn.close()
+    repo.server.serve_forever()
+
+
+class RepoProcess(object):
+    """
+    FakeRepo serving @catalogs (list of add_catalog() argument tuples), run
+    in a child process so that the server's CPU time is kept apart from the
+    client's. @repo_opts are passed to FakeRepo
+    """
+    def __init__(self, catalogs, **repo_opts):
+        self.catalogs = catalogs
+        self.opts = repo_opts
+        self.address = None
+        self.proc = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        pconn, cconn = multiprocessing.Pipe()
+        self.proc = multiprocessing.Process(target=_serve_repo, args=(self.opts, self.catalogs, cconn), daemon=True)
+        self.proc.start()
+        self.address = pconn.recv()
+        pconn.close()
+
+    def stop(self):
+        self.proc.terminate()
+        self.proc.join()
+
+    def url(self, path):
+        """
+        Return URL of @path on the server
+        """
+        return 'http://%s:%d/%s' % (self.address[0], self.address[1], path.lstrip('/'))
+
+    def stats(self):
+        """
+        Return request & transfer counters of the server
+        """
+        return requests.get(self.url('/_stats')).json()
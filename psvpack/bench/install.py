@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# vim: set ts=4 sw=4 expandtab syntax=python:
+"""
+
+psvpack.bench.install
+End-to-end download & install benchmarks against a local fake repository
+
+@author   Jacob Hipps <jacob@ycnrg.org>
+
+Copyright (c) 2018 J. Hipps / Neo-Retro Group, Inc.
+https://ycnrg.org/
+
+"""
+
+import os
+import sys
+import copy
+import shutil
+import tempfile
+from time import perf_counter
+
+from psvpack import default_config
+from psvpack import psfree
+from psvpack.cache import PkgCache
+from psvpack.pipeline import InstallPipeline
+from psvpack.bench.report import run_meta
+from psvpack.bench.fakerepo import RepoProcess, write_stub_pkg2zip
+
+
+def make_config(workdir, repo, glist, download_workers=1, extract_workers=0):
+    """
+    Return config using @repo for game list @glist, with the cache, install
+    root and stub pkg2zip kept in @workdir
+    """
+    os.makedirs(workdir, exist_ok=True)
+    config = copy.deepcopy(default_config)
+    config.update(cache_dir=os.path.join(workdir, 'cache'), install_root=os.path.join(workdir, 'ux0'),
+                  pkg2zip=write_stub_pkg2zip(os.path.join(workdir, 'pkg2zip')))
+    config['tsv_urls'][glist] = repo.url('/%s.tsv' % (glist))
+    config['pipeline'].update(download_workers=download_workers, extract_workers=extract_workers)
+    config['mirrors']['stall_time'] = 10
+    return config
+
+def measure(func, *args, **kwargs):
+    """
+    Call @func, measuring wall time and CPU time (including child processes)
+    Returns tuple of (result, wall time, cpu time)
+    """
+    stimes = os.times()
+    stime = perf_counter()
+    result = func(*args, **kwargs)
+    wall = perf_counter() - stime
+    etimes = os.times()
+    return (result, wall, sum(etimes[:4]) - sum(stimes[:4]))
+
+def reset_dirs(config):
+    """
+    Remove all downloaded packages and installed titles
+    """
+    for tdir in (config['cache_dir'], config['install_root']):
+        shutil.rmtree(tdir, ignore_errors=True)
+    os.makedirs(config['install_root'])
+
+def run_pipeline(config, glist, items, install):
+    """
+    Run all @items through an InstallPipeline. Returns number of failed items
+    """
+    # events are discarded, but keep the pipeline from drawing progress bars
+    pipeline = InstallPipeline(config, glist, config['install_root'], install=install, on_event=lambda x: None)
+    return pipeline.run(items)['failed']
+
+def bench_install(repo, glist="PSV", workdir=None, download_workers=1, extract_workers=0):
+    """
+    Run download, verify, extract and end-to-end install benchmarks for the
+    catalog of @glist served by @repo (see FakeRepo.add_catalog)
+    Returns list of result dicts
+    """
+    results = []
+    tmpdir = None
+    if workdir is None:
+        tmpdir = tempfile.TemporaryDirectory(prefix='psvpack-bench-')
+        workdir = tmpdir.name
+
+    try:
+        config = make_config(workdir, repo, glist, download_workers, extract_workers)
+        reset_dirs(config)
+        tsv, wall, _ = measure(psfree.TSVManager, glist, config)
+        if not tsv.loaded:
+            raise RuntimeError("failed to fetch catalog from %s" % (config['tsv_urls'][glist]))
+        items = tsv.glist
+        nbytes = sum([int(x['File Size']) for x in items])
+
+        def add(metric, value, unit):
+            results.append({'list': glist, 'rows': len(items), 'metric': metric, 'value': value, 'unit': unit})
+
+        def add_phase(phase, failed, wall, cpu):
+            add('%s_failed' % (phase), failed, 'items')
+            add('%s_time' % (phase), wall, 's')
+            add('%s_rate' % (phase), nbytes / max(wall, 1e-6) / 1048576.0, 'MB/s')
+            add('%s_cpu_per_gb' % (phase), cpu / (nbytes / 1073741824.0), 's/GB')
+
+        add('catalog_fetch_time', wall, 's')
+
+        # download only
+        failed, wall, cpu = measure(run_pipeline, config, glist, items, False)
+        add_phase('download', failed, wall, cpu)
+
+        # checksum verification of the downloaded packages
+        pcache = PkgCache(config)
+        res, wall, cpu = measure(lambda: [psfree.check_cached(pcache.name_path(x['Content ID']), x['SHA256']) for x in items])
+        add_phase('verify', res.count(False), wall, cpu)
+
+        # extraction of the downloaded packages
+        failed, wall, cpu = measure(run_pipeline, config, glist, items, True)
+        add_phase('extract', failed, wall, cpu)
+
+        # download & install from scratch
+        reset_dirs(config)
+        failed, wall, cpu = measure(run_pipeline, config, glist, items, True)
+        add_phase('install', failed, wall, cpu)
+    finally:
+        if tmpdir is not None:
+            tmpdir.cleanup()
+
+    return results
+
+def run(lists=None, items=8, size=64 * 1024 * 1024, workdir=None, seed=0, download_workers=1, extract_workers=0,
+        **repo_opts):
+    """
+    Run install benchmarks of @items packages of @size bytes for each of
+    @lists, served by a FakeRepo created with @repo_opts
+    Returns dict with run `meta` data and `results`
+    """
+    lists = lists or ['PSV']
+    results = []
+    with RepoProcess([(x, items, size, seed) for x in lists], seed=seed, **repo_opts) as repo:
+        for glist in lists:
+            sys.stderr.write("Benchmarking %s installs of %d x %d bytes...\n" % (glist, items, size))
+            results += bench_install(repo, glist, workdir and os.path.join(workdir, glist), download_workers, extract_workers)
+        server = repo.stats()
+
+    meta = run_meta(items=items, size=size, seed=seed, download_workers=download_workers,
+                    extract_workers=extract_workers, server=server, **repo_opts)
+    return {'meta': meta, 'results': results}
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# vim: set ts=4 sw=4 expandtab syntax=python:
+"""
+
+psvpack.bench.report
+Benchmark result reporting & baseline comparison
+
+@author   Jacob Hipps <jacob@ycnrg.org>
+
+Copyright (c) 2018 J. Hipps / Neo-Retro Group, Inc.
+https://ycnrg.org/
+
+"""
+
+import sys
+import platform
+from time import time
+
+from psvpack import __version__
+
+
+# units of metrics where a larger value is better
+HIGHER_BETTER = ['MB/s']
+
+
+def run_meta(**kwargs):
+    """
+    Return dict describing the benchmark run, plus any @kwargs
+    """
+    meta = {'time': time(), 'psvpack': __version__, 'python': platform.python_version(),
+            'platform': platform.platform()}
+    meta.update(kwargs)
+    return meta
+
+def compare(current, baseline, threshold=0.2):
+    """
+    Compare @current results against @baseline results. Metrics that are more
+    than @threshold (fraction) worse than the baseline are regressions
+    Returns list of (key, baseline value, current value, ratio, regressed)
+    """
+    base = dict([((x['list'], x['rows'], x['metric']), x['value']) for x in baseline['results']])
+    rows = []
+    for tres in current['results']:
+        key = (tres['list'], tres['rows'], tres['metric'])
+        if key not in base or not base[key] or tres['metric'] == 'file_size':
+            continue
+        ratio = float(tres['value']) / base[key]
+        if tres['unit'] in HIGHER_BETTER:
+            regressed = ratio < 1.0 - threshold
+        else:
+            regressed = ratio > 1.0 + threshold
+        rows.append((key, base[key], tres['value'], ratio, regressed))
+    return rows
+
+def print_results(bres, stream=None):
+    """
+    Print human-readable table of benchmark results
+    """
+    stream = stream or sys.stdout
+    stream.write('{:8} {:>8} {:24} {:>14}\n'.format("List", "Rows", "Metric", "Value"))
+    stream.write('=' * 57 + '\n')
+    for tres in bres['results']:
+        if tres['unit'] == 's':
+            value = '%.3f ms' % (tres['value'] * 1000)
+        elif isinstance(tres['value'], float):
+            value = '%.2f %s' % (tres['value'], tres['unit'])
+        else:
+            value = '%d %s' % (tres['value'], tres['unit'])
+        stream.write('{:8} {:>8} {:24} {:>14}\n'.format(tres['list'], tres['rows'], tres['metric'], value))
+
+def print_comparison(crows, stream=None):
+    """
+    Print comparison table from compare()
+    """
+    stream = stream or sys.stdout
+    stream.write('{:8} {:>8} {:24} {:>8}\n'.format("List", "Rows", "Metric", "Change"))
+    stream.write('=' * 60 + '\n')
+    for (glist, nrows, metric), _, _, ratio, regressed in crows:
+        stream.write('{:8} {:>8} {:24} {:>+7.1f}% {}\n'.format(glist, nrows, metric, (ratio - 1.0) * 100.0,
+                                                              "REGRESSION" if regressed else ""))
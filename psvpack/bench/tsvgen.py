@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# vim: set ts=4 sw=4 expandtab syntax=python:
+"""
+
+psvpack.bench.tsvgen
+Synthetic catalog (TSV) generator
+
+@author   Jacob Hipps <jacob@ycnrg.org>
+
+Copyright (c) 2018 J. Hipps / Neo-Retro Group, Inc.
+https://ycnrg.org/
+
+"""
+
+import csv
+import random
+import hashlib
+from argparse import ArgumentParser
+
+
+# column layout of each game list
+SCHEMAS = {
+    'PSV': ['Title ID', 'Region', 'Name', 'PKG direct link', 'zRIF', 'Content ID', 'Last Modification Date',
+            'Original Name', 'File Size', 'SHA256', 'Required FW', 'App Version'],
+    'PSV_DLC': ['Title ID', 'Region', 'Name', 'PKG direct link', 'zRIF', 'Content ID', 'Last Modification Date',
+                'File Size', 'SHA256'],
+    'PSM': ['Title ID', 'Region', 'Name', 'PKG direct link', 'zRIF', 'Content ID', 'Last Modification Date',
+            'File Size', 'SHA256'],
+    'PSX': ['Title ID', 'Region', 'Name', 'PKG direct link', 'Content ID', 'Last Modification Date',
+            'Original Name', 'File Size', 'SHA256'],
+    'PSP': ['Title ID', 'Region', 'Type', 'Name', 'PKG direct link', 'Content ID', 'Last Modification Date',
+            'RAP', 'Download .RAP file', 'File Size', 'SHA256'],
+    'PSP_DLC': ['Title ID', 'Region', 'Name', 'PKG direct link', 'Content ID', 'Last Modification Date',
+                'RAP', 'Download .RAP file', 'File Size', 'SHA256'],
+}
+
+# Title ID prefixes per list & region
+TID_PREFIX = {
+    'PSV': {'US': 'PCSE', 'EU': 'PCSB', 'JP': 'PCSG', 'ASIA': 'PCSH'},
+    'PSM': {'US': 'NPNA', 'EU': 'NPOA', 'JP': 'NPPA', 'ASIA': 'NPQA'},
+    'PSX': {'US': 'NPUJ', 'EU': 'NPEF', 'JP': 'NPJJ', 'ASIA': 'NPHJ'},
+    'PSP': {'US': 'ULUS', 'EU': 'ULES', 'JP': 'ULJM', 'ASIA': 'ULAS'},
+}
+TID_PREFIX['PSV_DLC'] = TID_PREFIX['PSV']
+TID_PREFIX['PSP_DLC'] = TID_PREFIX['PSP']
+
+CID_PREFIX = {'US': 'UP', 'EU': 'EP', 'JP': 'JP', 'ASIA': 'HP'}
+REGIONS = ['US', 'EU', 'JP', 'ASIA']
+
+WORDS_EN = ['Dragon', 'Quest', 'Legend', 'Final', 'Fantasy', 'Super', 'Racing', 'Tales', 'of', 'the', 'Hyper',
+            'Dimension', 'Neptunia', 'Persona', 'Golden', 'Ninja', 'Gaiden', 'Sword', 'Art', 'Online', 'Hot',
+            'Shots', 'Golf', 'Gravity', 'Rush', 'Soul', 'Sacrifice', 'Killzone', 'Mercenary', 'Uncharted',
+            'Abyss', 'Freedom', 'Wars', 'Danganronpa', 'Trigger', 'Happy', 'Havoc', 'Ys', 'Memories', 'Celceta']
+WORDS_JP = ['伝説', 'ドラゴン', 'クエスト', '勇者', '物語', 'ファイナル', '幻想', '太鼓', '達人', '戦記', '魔法',
+            '少女', '学園', '忍', '剣', '無双', 'ネプテューヌ', 'ペルソナ', '冒険', '英雄', '天空', '迷宮', '侍']
+DLC_WORDS = ['Costume', 'Pack', 'Song', 'Expansion', 'Character', 'Set', 'Bonus', 'Stage', 'Weapon', 'Episode']
+
+MISSING = "MISSING"
+
+
+def random_name(rng, japanese=False):
+    """
+    Return a random game name, in Japanese if @japanese, otherwise English
+    (sometimes with a sequel number or subtitle)
+    """
+    if japanese:
+        name = ''.join(rng.sample(WORDS_JP, rng.randint(2, 4)))
+    else:
+        name = ' '.join(rng.sample(WORDS_EN, rng.randint(1, 4)))
+    if rng.random() < 0.2:
+        name += ' %d' % (rng.randint(2, 5))
+    if rng.random() < 0.1:
+        name += ': ' + ' '.join(rng.sample(WORDS_EN, 2))
+    return name
+
+def generate_rows(glist, rows, seed=0, missing_rate=0.05, dlc_per_title=4):
+    """
+    Yield @rows synthetic catalog rows (dicts) for list @glist. Output is
+    deterministic for a given @seed. About @missing_rate of the rows have a
+    MISSING key or link. DLC lists have ~@dlc_per_title items per Title ID
+    """
+    rng = random.Random(seed)
+    schema = SCHEMAS[glist]
+    is_dlc = glist.endswith('_DLC')
+    tnum = 0
+    count = 0
+    while count < rows:
+        tnum += 1
+        region = rng.choice(REGIONS)
+        japanese = region in ('JP', 'ASIA') and rng.random() < 0.7
+        title_id = '%s%05d' % (TID_PREFIX[glist][region], tnum % 100000)
+        base_name = random_name(rng, japanese)
+        for dnum in range(rng.randint(1, dlc_per_title * 2 - 1) if is_dlc else 1):
+            if count >= rows:
+                break
+            count += 1
+            label = ('%s%02d' % (rng.choice(DLC_WORDS).upper()[:6], dnum)).ljust(16, '0') if is_dlc else '0000000000000000'
+            content_id = '%s%04d-%s_00-%s' % (CID_PREFIX[region], rng.randint(0, 9999), title_id, label)
+            size = rng.randint(1, 4096) * 1024 * 1024 if not is_dlc else rng.randint(1, 512) * 1024
+            row = {
+                'Title ID': title_id,
+                'Region': region,
+                'Type': rng.choice(['PSP', 'Minis', 'PC Engine', 'NeoGeo']),
+                'Name': '%s %s' % (base_name, rng.choice(DLC_WORDS)) if is_dlc else base_name,
+                'PKG direct link': 'http://zeus.dl.playstation.net/cdn/%s/%s/%s.pkg' % (CID_PREFIX[region], title_id, content_id),
+                'zRIF': 'KO5ifR1dQ+eHBlOi' + hashlib.md5(content_id.encode('utf-8')).hexdigest(),
+                'Content ID': content_id,
+                'Last Modification Date': '20%02d-%02d-%02d %02d:%02d:%02d' % (rng.randint(12, 19), rng.randint(1, 12), rng.randint(1, 28),
+                                                                               rng.randint(0, 23), rng.randint(0, 59), rng.randint(0, 59)),
+                'Original Name': random_name(rng, True) if region == 'JP' and not japanese else '',
+                'File Size': str(size),
+                'SHA256': hashlib.sha256(content_id.encode('utf-8')).hexdigest(),
+                'Required FW': rng.choice(['3.60', '3.61', '3.65', '3.68']),
+                'App Version': '01.%02d' % (rng.randint(0, 10)),
+                'RAP': hashlib.md5(title_id.encode('utf-8')).hexdigest().upper(),
+                'Download .RAP file': 'https://nopaystation.com/tools/rap2file/%s/%s' % (content_id, title_id),
+            }
+            if rng.random() < missing_rate:
+                row[rng.choice([x for x in ('zRIF', 'PKG direct link', 'RAP', 'SHA256') if x in schema])] = MISSING
+                if rng.random() < 0.5:
+                    row['File Size'] = ''
+            yield dict([(x, row[x]) for x in schema])
+
+def write_tsv(fpath, glist, rows, seed=0, missing_rate=0.05):
+    """
+    Write synthetic catalog of @rows rows for @glist to @fpath
+    """
+    with open(fpath, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, SCHEMAS[glist], dialect='excel-tab', lineterminator='\n')
+        writer.writeheader()
+        for trow in generate_rows(glist, rows, seed, missing_rate):
+            writer.writerow(trow)
+    return fpath
+
+
+def _main():
+    aparser = ArgumentParser(description="Generate a synthetic psvpack catalog (TSV)")
+    aparser.add_argument("output", metavar="PATH", help="output TSV path")
+    aparser.add_argument("--list", "-g", dest="glist", default="PSV", choices=sorted(SCHEMAS), help="game list schema [default: %(default)s]")
+    aparser.add_argument("--rows", "-n", type=int, default=10000, help="number of rows [default: %(default)s]")
+    aparser.add_argument("--seed", type=int, default=0, help="random seed [default: %(default)s]")
+    aparser.add_argument("--missing-rate", type=float, default=0.05, help="fraction of rows with MISSING fields [default: %(default)s]")
+    opts = aparser.parse_args()
+    write_tsv(opts.output, opts.glist, opts.rows, opts.seed, opts.missing_rate)
+
+if __name__ == '__main__':
+    _main()
@@ -0,0 +1,444 @@
+#!/usr/bin/env python3
+# vim: set ts=4 sw=4 expandtab syntax=python:
+"""
+
+psvpack.cache
+Content-addressed PKG cache
+
+@author   Jacob Hipps <jacob@ycnrg.org>
+
+Copyright (c) 2018 J. Hipps / Neo-Retro Group, Inc.
+https://ycnrg.org/
+
+"""
+
+import os
+import re
+import json
+import logging
+from time import sleep, time
+
+from psvpack import default_config
+from psvpack import metrics
+from psvpack.util import FileLock, fmtsize, sha256sum
+
+
+logger = logging.getLogger('psvpack')
+
+# seconds make_room() waits without progress for packages in use (see
+# PkgCache.pin) or being downloaded to be released, when evicting them would
+# free enough space
+ROOM_WAIT = 600
+
+
+class PkgCache(object):
+    """
+    Manages the local pkg cache (cache_dir/pkg)
+
+    Package data is stored once per SHA256 under cache_dir/pkg/sha256/, and
+    each `<Content ID>.pkg` name is a hardlink (or symlink, where hardlinks
+    are not supported) to its object. Identical packages listed under
+    different Content IDs or lists therefore only take up space once.
+    Objects are only added to the store once their checksum has been verified
+
+    If `cache_max_bytes` is set, least-recently-used packages are evicted to
+    stay within budget. Packages matching a Title ID or Content ID listed in
+    `cache_pinned` are never evicted. Last access is tracked via each file's
+    atime, which is set explicitly on every cache hit
+
+    Several psvpack processes may share one cache; package downloads, stats
+    updates and eviction are serialized with lock files in cache_dir/pkg/.locks
+    Packages that are being downloaded, or are pinned (see pin()) until they
+    have been extracted, are skipped by eviction. Downloads in progress reserve
+    their size (see make_room), so that concurrent downloads stay within budget
+    """
+    def __init__(self, config):
+        self.root = os.path.realpath(os.path.join(os.path.expanduser(config['cache_dir']), 'pkg'))
+        self.store = os.path.join(self.root, 'sha256')
+        self.statfile = os.path.join(self.root, 'cache_stats.json')
+        self.lockdir = os.path.join(self.root, '.locks')
+        try:
+            self.max_bytes = int(config.get('cache_max_bytes', default_config['cache_max_bytes']) or 0)
+        except (TypeError, ValueError):
+            logger.error("Invalid `cache_max_bytes` specified in config file. Cache size is unbounded.")
+            self.max_bytes = 0
+        self.pinned = set([x.upper() for x in config.get('cache_pinned') or []])
+
+    def setup(self):
+        """
+        Create cache directories, if needed
+        """
+        if not os.path.exists(self.store):
+            try:
+                os.makedirs(self.store, 0o775, exist_ok=True)
+                logger.info("Created local pkg cache: %s", self.root)
+            except Exception as e:
+                logger.error("Failed to create pkg cache path [%s]: %s", self.root, str(e))
+                return False
+        return True
+
+    @staticmethod
+    def norm_digest(chksum):
+        """
+        Return normalized SHA256 hex digest, or None if @chksum is not valid
+        """
+        chksum = (chksum or '').strip().lower()
+        return chksum if re.match(r'^[0-9a-f]{64}$', chksum) else None
+
+    def name_path(self, content_id):
+        """
+        Return path of the named pkg file for @content_id
+        """
+        return os.path.join(self.root, content_id + '.pkg')
+
+    def object_path(self, chksum):
+        """
+        Return path of the store object for SHA256 @chksum
+        """
+        return os.path.join(self.store, chksum[:2], chksum + '.pkg')
+
+    def lock_key(self, tgame):
+        """
+        Return the key of @tgame's lock files. SHA256 where available, so that
+        identical packages listed under different Content IDs share locks
+        """
+        return self.norm_digest(tgame.get('SHA256')) or tgame['Content ID']
+
+    def lock(self, tgame):
+        """
+        Return a FileLock for downloading the package of @tgame, so that
+        identical packages are only fetched once
+        """
+        return FileLock(os.path.join(self.lockdir, self.lock_key(tgame) + '.lock'))
+
+    def pin(self, tgame):
+        """
+        Return a shared FileLock which keeps the package of @tgame from being
+        evicted while held, eg. from download until it has been extracted
+        """
+        return FileLock(os.path.join(self.lockdir, self.lock_key(tgame) + '.pin'), shared=True)
+
+    def _lock_entry(self, entry):
+        """
+        Try to take the download & pin locks of every name of cache @entry,
+        without blocking. Returns list of held locks, or None if any of them
+        is held elsewhere (ie. the package is in use)
+        """
+        keys = set([os.path.basename(x)[:-4] for x in entry['names'] + [entry['path']]])
+        locks = []
+        for key in sorted(keys):
+            for ext in ('.lock', '.pin'):
+                tlock = FileLock(os.path.join(self.lockdir, key + ext))
+                if not tlock.acquire(blocking=False):
+                    for held in locks:
+                        held.release()
+                    return None
+                locks.append(tlock)
+        return locks
+
+    def _link(self, objpath, path):
+        """
+        Point @path at store object @objpath, replacing whatever is there
+        """
+        tmppath = path + '.link'
+        if os.path.lexists(tmppath):
+            os.unlink(tmppath)
+        try:
+            os.link(objpath, tmppath)
+        except OSError:
+            os.symlink(objpath, tmppath)
+        os.replace(tmppath, path)
+
+    def lookup(self, tgame):
+        """
+        Check if the package for @tgame is already in the store. If so, ensure
+        its Content ID name links to it, and return the path. Otherwise None
+        """
+        chksum = self.norm_digest(tgame.get('SHA256'))
+        if chksum is None:
+            return None
+        objpath = self.object_path(chksum)
+        if not os.path.exists(objpath):
+            return None
+
+        path = self.name_path(tgame['Content ID'])
+        try:
+            if not os.path.exists(path) or not os.path.samefile(path, objpath):
+                self._link(objpath, path)
+                logger.info("Linked %s to existing package in store (%s)", tgame['Content ID'], chksum)
+        except OSError as e:
+            logger.warning("Failed to link %s to store object %s: %s", path, objpath, str(e))
+            return None
+        return path
+
+    def is_cached(self, tgame):
+        """
+        Quick check (without hashing) of whether the package for @tgame is cached
+        """
+        chksum = self.norm_digest(tgame.get('SHA256'))
+        if chksum and os.path.exists(self.object_path(chksum)):
+            return True
+        return os.path.exists(self.name_path(tgame['Content ID']))
+
+    def ingest(self, path, chksum):
+        """
+        Move verified pkg file @path into the store under SHA256 @chksum,
+        and replace @path with a link to it. If the object is already
+        present, @path is simply re-linked and its data discarded
+        Returns number of bytes freed by deduplication
+        """
+        chksum = self.norm_digest(chksum)
+        if chksum is None:
+            return 0
+        objpath = self.object_path(chksum)
+        try:
+            if os.path.exists(objpath):
+                if os.path.samefile(path, objpath):
+                    return 0
+                freed = os.stat(path).st_size if os.stat(path).st_nlink == 1 else 0
+                self._link(objpath, path)
+                return freed
+            os.makedirs(os.path.dirname(objpath), 0o775, exist_ok=True)
+            os.rename(path, objpath)
+            self._link(objpath, path)
+        except OSError as e:
+            logger.warning("Failed to add %s to pkg store: %s", path, str(e))
+        return 0
+
+    def dedupe(self):
+        """
+        Migrate existing pkg files into the store, deduplicating identical
+        packages. Returns tuple of (files migrated, bytes freed)
+        """
+        if not self.setup():
+            return (0, 0)
+
+        migrated = 0
+        freed = 0
+        for fname in sorted(os.listdir(self.root)):
+            path = os.path.join(self.root, fname)
+            if not fname.endswith('.pkg') or os.path.islink(path) or not os.path.isfile(path):
+                continue
+            if os.stat(path).st_nlink > 1:
+                # already hardlinked into the store
+                continue
+            logger.info("Hashing %s...", fname)
+            chksum = sha256sum(path)
+            if chksum is None:
+                logger.warning("Failed to hash %s. Skipping.", path)
+                continue
+            freed += self.ingest(path, chksum)
+            migrated += 1
+
+        logger.info("Migrated %d packages into store; %s freed by deduplication", migrated, fmtsize(freed))
+        return (migrated, freed)
+
+    def _update_stats(self, **kwargs):
+        """
+        Increment persistent cache counters by @kwargs
+        """
+        with FileLock(os.path.join(self.lockdir, 'stats.lock')):
+            stats = self.load_stats()
+            for tkey, tval in kwargs.items():
+                stats[tkey] = stats.get(tkey, 0) + tval
+            try:
+                with open(self.statfile + '.tmp', 'w') as f:
+                    json.dump(stats, f)
+                os.replace(self.statfile + '.tmp', self.statfile)
+            except Exception as e:
+                logger.debug("Failed to write cache stats: %s", str(e))
+
+    def load_stats(self):
+        """
+        Return persistent cache counters
+        """
+        try:
+            with open(self.statfile) as f:
+                return json.load(f)
+        except Exception:
+            return {}
+
+    def hit(self, path):
+        """
+        Record a cache hit for @path, marking it as most-recently used
+        """
+        try:
+            os.utime(path, (time(), os.stat(path).st_mtime))
+        except OSError as e:
+            logger.debug("Failed to update access time for %s: %s", path, str(e))
+        metrics.PKG_CACHE.inc(result='hit')
+        self._update_stats(hits=1)
+
+    def miss(self, size=0):
+        """
+        Record a cache miss, where @size bytes were downloaded
+        """
+        metrics.PKG_CACHE.inc(result='miss')
+        self._update_stats(misses=1, downloaded_bytes=max(0, size))
+
+    def is_pinned(self, content_id):
+        """
+        Check if @content_id (or its Title ID) is pinned
+        """
+        content_id = content_id.upper()
+        title_id = content_id.split('-')[1][:9] if content_id.count('-') >= 2 else content_id
+        return content_id in self.pinned or title_id in self.pinned
+
+    def entries(self):
+        """
+        Return list of cache entries, one per unique file, as dicts with keys
+        `path`, `size`, `atime`, and `names` (all Content ID names linked to it)
+        """
+        entries = {}
+        for tdir, _, tfiles in os.walk(self.store):
+            for tfile in tfiles:
+                path = os.path.join(tdir, tfile)
+                st = os.stat(path)
+                entries[(st.st_dev, st.st_ino)] = {'path': path, 'size': st.st_size, 'atime': st.st_atime, 'names': []}
+
+        for fname in os.listdir(self.root) if os.path.isdir(self.root) else []:
+            path = os.path.join(self.root, fname)
+            if not fname.endswith('.pkg') or not os.path.isfile(path):
+                continue
+            st = os.stat(path)
+            entry = entries.setdefault((st.st_dev, st.st_ino), {'path': path, 'size': st.st_size, 'atime': st.st_atime, 'names': []})
+            entry['names'].append(path)
+        return list(entries.values())
+
+    def evict(self, entry):
+        """
+        Remove cache @entry, along with all names linked to it
+        """
+        for path in entry['names'] + [entry['path']]:
+            try:
+                if os.path.lexists(path):
+                    os.unlink(path)
+            except OSError as e:
+                logger.warning("Failed to remove %s from cache: %s", path, str(e))
+        self._update_stats(evictions=1, evicted_bytes=entry['size'])
+
+    def make_room(self, size, tgame=None, wait=ROOM_WAIT):
+        """
+        Evict least-recently-used, unpinned packages until @size bytes can be
+        added without exceeding `cache_max_bytes`, counting the space reserved
+        by downloads in progress. If that is only possible once packages in
+        use or being downloaded are released, waits for them for as long as
+        the space held changes at least every @wait seconds
+        If @tgame is given, @size bytes are reserved for downloading its
+        package, while its download lock (see lock) is held or until
+        release_room is called. Returns False if not enough space could be freed
+        """
+        if not self.max_bytes:
+            return True
+
+        key = self.lock_key(tgame) if tgame is not None else None
+        deadline = time() + wait
+        last = None
+        while True:
+            with FileLock(os.path.join(self.lockdir, 'evict.lock')):
+                need, busy = self._make_room(size, key)
+                if need <= 0:
+                    if key is not None:
+                        self._reserve(key, size)
+                    return True
+            if need > busy or time() >= deadline:
+                logger.warning("Unable to free enough space in pkg cache; %s over budget", fmtsize(need))
+                return False
+            if last is None:
+                logger.info("Waiting for packages in use to be released from pkg cache (%s needed)...", fmtsize(need).strip())
+            if (need, busy) != last:
+                deadline = time() + wait
+                last = (need, busy)
+            sleep(1.0)
+
+    def _reserve(self, key, size):
+        try:
+            with open(os.path.join(self.lockdir, key + '.resv'), 'w') as f:
+                f.write('%d' % (size))
+        except OSError as e:
+            logger.warning("Failed to reserve space in pkg cache: %s", str(e))
+
+    def release_room(self, tgame):
+        """
+        Release the space reserved for downloading the package of @tgame
+        """
+        try:
+            os.unlink(os.path.join(self.lockdir, self.lock_key(tgame) + '.resv'))
+        except OSError:
+            pass
+
+    def reserved(self, exclude=None):
+        """
+        Return bytes reserved by downloads in progress, other than @exclude (a
+        lock key). Reservations whose download lock is no longer held (eg. the
+        process was killed) are removed
+        """
+        total = 0
+        for fname in os.listdir(self.lockdir) if os.path.isdir(self.lockdir) else []:
+            key = fname[:-5]
+            if not fname.endswith('.resv') or key == exclude:
+                continue
+            tlock = FileLock(os.path.join(self.lockdir, key + '.lock'))
+            if tlock.acquire(blocking=False):
+                tlock.release()
+                self.release_room({'SHA256': key, 'Content ID': key})
+                continue
+            try:
+                with open(os.path.join(self.lockdir, fname)) as f:
+                    total += int(f.read().strip() or 0)
+            except (OSError, ValueError):
+                pass
+        return total
+
+    def _make_room(self, size, key=None):
+        """
+        Evict packages (see make_room). Returns tuple of (bytes still needed,
+        bytes held by downloads in progress and by packages that were skipped
+        because they are in use)
+        """
+        entries = self.entries()
+        busy = self.reserved(key)
+        need = sum([x['size'] for x in entries]) + busy + max(0, size) - self.max_bytes
+        if need <= 0:
+            return (need, busy)
+
+        candidates = [x for x in entries
+                      if not any([self.is_pinned(os.path.basename(n)[:-4]) for n in x['names']])]
+        for entry in sorted(candidates, key=lambda x: x['atime']):
+            ename = os.path.basename(entry['names'][0] if entry['names'] else entry['path'])
+            locks = self._lock_entry(entry)
+            if locks is None:
+                logger.debug("Not evicting %s from pkg cache: in use", ename)
+                busy += entry['size']
+                continue
+            try:
+                logger.info("Evicting %s from pkg cache (%s)", ename, fmtsize(entry['size']))
+                self.evict(entry)
+            finally:
+                for tlock in locks:
+                    tlock.release()
+            need -= entry['size']
+            if need <= 0:
+                break
+        return (need, busy)
+
+    def stats(self):
+        """
+        Return dict of cache occupancy & hit ratio statistics
+        """
+        entries = self.entries()
+        stats = self.load_stats()
+        lookups = stats.get('hits', 0) + stats.get('misses', 0)
+        return {
+            'packages': len(entries),
+            'names': sum([len(x['names']) for x in entries]),
+            'pinned': len([x for x in entries if any([self.is_pinned(os.path.basename(n)[:-4]) for n in x['names']])]),
+            'used_bytes': sum([x['size'] for x in entries]),
+            'max_bytes': self.max_bytes,
+            'hits': stats.get('hits', 0),
+            'misses': stats.get('misses', 0),
+            'hit_ratio': float(stats.get('hits', 0)) / lookups if lookups else 0.0,
+            'downloaded_bytes': stats.get('downloaded_bytes', 0),
+            'evictions': stats.get('evictions', 0),
+            'evicted_bytes': stats.get('evicted_bytes', 0),
+        }
@@ -18,8 +18,14 @@ import sys
 import logging
 from argparse import ArgumentParser
 
-from psvpack import __version__, __date__
+from psvpack import __version__, __date__, default_config
 from psvpack import psfree
+from psvpack import batch
+from psvpack import prefetch
+from psvpack import output
+from psvpack import metrics
+from psvpack.profiler import profiler
+from psvpack.status import STATUSES, parse_statuses
 from psvpack.util import *
 
 logger = logging.getLogger('psvpack')
@@ -47,13 +53,13 @@ def setup_logging(clevel=logging.INFO, flevel=logging.DEBUG, logfile=None):
 
 def parse_cli(show_help=False):
     """parse CLI options with argparse"""
-    aparser = ArgumentParser(description="PSVita pkg helper", usage="psvpack [-d] [-V|-h] [-c PATH] [-r PATH] [-g <PSV|PSV_DLC|...>]\n               [-N] [-X] [-a|-e|-U|-J|-A] [--getall] COMMAND GAME_OR_ID")
+    aparser = ArgumentParser(description="PSVita pkg helper", usage="psvpack [-d] [-V|-h] [-c PATH] [-r PATH] [-g <PSV|PSV_DLC|...>]\n               [-N] [-X] [-F] [--verify] [-S PATH] [-f MANIFEST] [-j N] [--max-rate RATE]\n               [-o FORMAT] [--fields F1,F2,..] [--limit N] [--status S1,..]\n               [--profile [--profile-phase PHASE] [--profile-out PATH]]\n               [--metrics-out PATH] [--metrics-listen HOST:PORT] [-a|-e|-U|-J|-A] [--getall] COMMAND GAME_OR_ID")
 
     # use defaults stored in __init__
-    aparser.set_defaults(loglevel=logging.INFO, command=None, uxroot='./', install=True, noverify=False,
+    aparser.set_defaults(loglevel=logging.INFO, command=None, uxroot='./', install=True, noverify=False, format='text',
                          glist="PSV", regions=['US', 'JP'], config=get_platform_confpath('config.yaml'))
 
-    aparser.add_argument("command", action="store", nargs="?", metavar="COMMAND", help="Command [search, install]")
+    aparser.add_argument("command", action="store", nargs="?", metavar="COMMAND", help="Command [search, install, prefetch, rescan, cache]")
     aparser.add_argument("game", action="store", nargs="?", metavar="GAME", help="Search term, Title ID, or package filename")
     aparser.add_argument("--uxroot", "-r", action="store", metavar="PATH", help="path to ux0 root (connected Vita or mounted SD card)")
     aparser.add_argument("--glist", "-g", action="store", metavar="LIST", help="game list [PSV*,PSM,PSX,PSP,PSV_DLC,PSP_DLC]")
@@ -61,12 +67,31 @@ def parse_cli(show_help=False):
     aparser.add_argument("--noinstall", "-N", dest="install", action="store_false", help="download pkg only; do NOT install")
     aparser.add_argument("--noverify", "-X", action="store_true", help="skip existing PKG checksum verification")
     aparser.add_argument("--getall", action="store_true", help="fetch all related items (eg. for DLC)")
-    aparser.add_argument("--allregions", "-a", action="store_const", const=['US', 'JP', 'EU', 'ASIA'], help="show all regions (default: only show US and JP)")
-    aparser.add_argument("--english", "-e", action="store_const", const=['US', 'EU'], help="show English games only (US and EU)")
-    aparser.add_argument("--us", "-U", action="store_const", const=['US'], help="show US region only")
-    aparser.add_argument("--eu", "-E", action="store_const", const=['EU'], help="show EU region only")
-    aparser.add_argument("--jp", "-J", action="store_const", const=['JP'], help="show JP region only")
-    aparser.add_argument("--asia", "-A", action="store_const", const=['ASIA'], help="show ASIA region only")
+    aparser.add_argument("--manifest", "-f", action="store", metavar="PATH", help="install all items listed in YAML manifest PATH")
+    aparser.add_argument("--order", action="store", choices=batch.ORDER_POLICIES, help="item order for manifest installs")
+    aparser.add_argument("--jobs", "-j", action="store", type=int, metavar="N", help="prefetch: number of concurrent downloads")
+    aparser.add_argument("--since", action="store", type=int, metavar="DAYS", help="prefetch: only items updated in the last DAYS days")
+    aparser.add_argument("--max-bytes", action="store", metavar="SIZE", help="prefetch: stop after downloading SIZE (eg. 200G)")
+    aparser.add_argument("--window", action="store", metavar="HH:MM-HH:MM", help="prefetch: only download during this time window")
+    aparser.add_argument("--format", "-o", action="store", choices=output.FORMATS, help="output format for search & install results")
+    aparser.add_argument("--fields", action="store", metavar="F1,F2,..", help="only output these fields (json, ndjson & tsv formats)")
+    aparser.add_argument("--limit", action="store", type=int, metavar="N", help="search: stop after N results")
+    aparser.add_argument("--status", action="store", metavar="S1,..", help="search: only show items with all of these statuses (%s)" % (', '.join(STATUSES)))
+    aparser.add_argument("--profile", action="store_true", help="print a breakdown of time spent in each phase")
+    aparser.add_argument("--profile-phase", action="store", metavar="PHASE", help="run PHASE (eg. download) under cProfile")
+    aparser.add_argument("--profile-out", action="store", metavar="PATH", default="psvpack.prof", help="cProfile output path [default: %(default)s]")
+    aparser.add_argument("--metrics-out", action="store", metavar="PATH", help="write metrics to PATH (.json for JSON, else Prometheus format)")
+    aparser.add_argument("--metrics-listen", action="store", metavar="HOST:PORT", help="serve live metrics over HTTP while running")
+    aparser.add_argument("--max-rate", action="store", metavar="RATE", help="limit total download rate (eg. 2M)")
+    aparser.add_argument("--force", "-F", action="store_true", help="re-install items even if already installed")
+    aparser.add_argument("--verify", action="store_true", help="check all files of installed items before skipping them (otherwise only added, removed or replaced files are noticed, not ones modified in place)")
+    aparser.add_argument("--stage", "-S", action="store", metavar="PATH", help="extract to local scratch PATH first, then copy to uxroot")
+    aparser.add_argument("--allregions", "-a", dest="regions", action="store_const", const=['US', 'JP', 'EU', 'ASIA'], help="show all regions (default: only show US and JP)")
+    aparser.add_argument("--english", "-e", dest="regions", action="store_const", const=['US', 'EU'], help="show English games only (US and EU)")
+    aparser.add_argument("--us", "-U", dest="regions", action="store_const", const=['US'], help="show US region only")
+    aparser.add_argument("--eu", "-E", dest="regions", action="store_const", const=['EU'], help="show EU region only")
+    aparser.add_argument("--jp", "-J", dest="regions", action="store_const", const=['JP'], help="show JP region only")
+    aparser.add_argument("--asia", "-A", dest="regions", action="store_const", const=['ASIA'], help="show ASIA region only")
 
     aparser.add_argument("--debug", "-d", dest="loglevel", action="store_const", const=logging.DEBUG,
                          help="Enable debug logging")
@@ -84,15 +109,61 @@ def _main():
     """
     opts = parse_cli()
     setup_logging(clevel=opts.loglevel)
+    if opts.profile:
+        profiler.enable(opts.profile_phase, opts.profile_out)
     uconfig = load_config(opts.config)
 
     if opts.command is None:
         parse_cli(show_help=True)
 
+    if opts.stage:
+        uconfig['stage_dir'] = opts.stage
+
+    mconf = dict(default_config['metrics'])
+    mconf.update(uconfig.get('metrics') or {})
+    metrics_listen = opts.metrics_listen or mconf['listen']
+    if metrics_listen:
+        metrics.registry.listen(metrics_listen)
+
+    if opts.max_rate:
+        # overrides the configured limit, including any time-of-day profiles
+        uconfig['bandwidth'] = dict(uconfig.get('bandwidth') or {}, max_rate=opts.max_rate, profiles=[])
+
+    # with machine-readable output, progress is reported as NDJSON events on stdout
+    fields = output.parse_fields(opts.fields)
+    on_event = output.EventWriter() if opts.format == 'ndjson' else None
+
     if opts.command[0] == 's':
-        psfree.do_search(opts.game, uconfig, glist=opts.glist, regions=opts.regions)
+        statuses = parse_statuses(opts.status)
+        if statuses is None:
+            sys.exit(1)
+        psfree.do_search(opts.game, uconfig, glist=opts.glist, regions=opts.regions, fmt=opts.format, fields=fields, limit=opts.limit,
+                         uxroot=opts.uxroot, statuses=statuses)
     elif opts.command[0] == 'i':
-        psfree.get_game(opts.game, uconfig, glist=opts.glist, uxroot=opts.uxroot, install=opts.install, noverify=opts.noverify, getall=opts.getall)
+        if opts.manifest:
+            ires = batch.batch_install(opts.manifest, uconfig, uxroot=opts.uxroot, install=opts.install, noverify=opts.noverify,
+                                       force=opts.force, order=opts.order, on_event=on_event, report=opts.format == 'text',
+                                       verify=opts.verify)
+        else:
+            ires = psfree.get_game(opts.game, uconfig, glist=opts.glist, uxroot=opts.uxroot, install=opts.install, noverify=opts.noverify,
+                                   getall=opts.getall, force=opts.force, on_event=on_event, verify=opts.verify)
+        if ires is not None and opts.format != 'text':
+            output.write_results(ires, opts.format, fields)
+    elif opts.command[0] == 'p':
+        max_bytes = prefetch.parse_size(opts.max_bytes) if opts.max_bytes else 0
+        if max_bytes is None:
+            logger.error("Invalid size for --max-bytes: %s", opts.max_bytes)
+            sys.exit(1)
+        prefetch.prefetch(opts.game or '', uconfig, glist=opts.glist, regions=opts.regions, since=opts.since,
+                          max_bytes=max_bytes, window=opts.window, jobs=opts.jobs, noverify=opts.noverify)
+    elif opts.command[0] == 'r':
+        psfree.rescan_installed(uconfig, uxroot=opts.uxroot)
+    elif opts.command[0] == 'c':
+        psfree.cache_command(opts.game, uconfig)
+
+    profiler.finish()
+    if opts.metrics_out or mconf['output']:
+        metrics.registry.write(opts.metrics_out or mconf['output'])
 
 if __name__ == '__main__':
     _main()
@@ -15,23 +15,52 @@ https://ycnrg.org/
 # pylint: disable=E0602,W0201,C0111
 
 import os
+import re
 import sys
+import copy
+import calendar
 import logging
+import threading
 import time
 
-from PyQt5.QtCore import QThread, QRegExp, QSortFilterProxyModel, Qt, QDate, QDateTime, QTime, qVersion, QT_VERSION_STR, PYQT_VERSION_STR, pyqtSignal
+from PyQt5.QtCore import QAbstractProxyModel, QAbstractTableModel, QModelIndex, QThread, QTimer, Qt, QDateTime, qVersion, QT_VERSION_STR, PYQT_VERSION_STR, pyqtSignal
 from PyQt5.QtWidgets import *
 from PyQt5.QtGui import QIcon, QStandardItemModel, QStandardItem
 from PyQt5.Qt import Qt, QPixmap
 
 from psvpack import __version__, __date__
 from psvpack.cli import setup_logging
+from psvpack import metrics
 from psvpack import psfree
+from psvpack.pipeline import ExtractPool, InstallPipeline
+from psvpack.status import StatusIndex
 from psvpack.util import *
 
 logger = logging.getLogger('psvpack')
 gconf = get_default_config()
 
+# rows per batch handed from the update thread to the game list model
+LOAD_BATCH = 2000
+
+# delay (ms) after the last keystroke before the filter is applied, and list
+# size above which the filter is evaluated in a background thread
+FILTER_DELAY = 200
+FILTER_THREAD_ROWS = 20000
+
+# idle time (ms) after a game list has loaded before the next one is preloaded
+PRELOAD_DELAY = 2000
+
+# weight of the latest sample in the smoothed download rate of queued installs
+RATE_SMOOTHING = 0.3
+
+# interval (ms) between checks of the pkg cache and install root for changes
+STATUS_REFRESH = 5000
+
+# status filter choices (see status.STATUSES)
+STATUS_FILTERS = [("Any status", []), ("Installed", ['installed']), ("Not installed", ['missing']),
+                  ("Outdated", ['outdated']), ("Cached", ['cached']), ("Not cached", ['uncached']),
+                  ("Cached, not installed", ['cached', 'missing'])]
+
 
 class App(QMainWindow):
 
@@ -48,29 +77,31 @@ class App(QMainWindow):
         self.setWindowTitle(self.title)
         self.setGeometry(*self.geo)
 
+        # Setup install queue (docked below the game lists)
+        self.installQueue = InstallQueueModel(self)
+        self.queuePanel = InstallQueuePanel(self.installQueue)
+        self.installQueue.itemFinished.connect(self.refreshStatus)
+        self.queueDock = QDockWidget("Install Queue", self)
+        self.queueDock.setWidget(self.queuePanel)
+        self.addDockWidget(Qt.BottomDockWidgetArea, self.queueDock)
+
         # Create menu items
         self.createMenus()
 
-        # Setup proxy model
-        self.proxyModel = GameListFilter(self)
-        self.proxyModel.setDynamicSortFilter(True)
-
-        # Setup source view (gameList)
-        self.gameList = QTreeView()
-        self.gameList.setRootIsDecorated(False)
-        self.gameList.setAlternatingRowColors(True)
-        self.gameList.setSortingEnabled(True)
-        self.gameList.sortByColumn(3, Qt.DescendingOrder)
-
-        self.glistModel = self.createGlistModel(self)
-        self.gameList.setModel(self.proxyModel)
-        self.proxyModel.setSourceModel(self.glistModel)
-
-        self.gameList.setColumnWidth(0, 80)
-        self.gameList.setColumnWidth(1, 50)
-        self.gameList.setColumnWidth(2, 450)
-        self.gameList.setColumnWidth(3, 120)
-        self.gameList.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        # Setup game list tabs (see loadGameData)
+        self.tabs = QTabWidget()
+        self.tabs.currentChanged.connect(self.tabChanged)
+        self.preload = False
+        self.preloadTimer = QTimer(self)
+        self.preloadTimer.setSingleShot(True)
+        self.preloadTimer.setInterval(PRELOAD_DELAY)
+        self.preloadTimer.timeout.connect(self.preloadNext)
+        self.statusIndex = None
+        self.statusTimer = QTimer(self)
+        self.statusTimer.setInterval(STATUS_REFRESH)
+        self.statusTimer.timeout.connect(self.refreshStatus)
+        self.metricsServer = None
+        self.metricsListen = None
 
         # Setup searchBox / filter
         flayout = QVBoxLayout()
@@ -78,6 +109,10 @@ class App(QMainWindow):
 
         self.searchBox = QLineEdit()
         self.searchBox.textChanged.connect(self.searchBoxChanged)
+        self.filterTimer = QTimer(self)
+        self.filterTimer.setSingleShot(True)
+        self.filterTimer.setInterval(FILTER_DELAY)
+        self.filterTimer.timeout.connect(self.applyFilter)
 
         imgpath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'img')
         self.regionChkUS = QCheckBox()
@@ -96,10 +131,14 @@ class App(QMainWindow):
         self.regionChkEULabel.setPixmap(QPixmap(os.path.join(imgpath, "flag_eu32.png")))
         self.regionChkASIALabel = QLabel("ASIA")
         self.regionChkASIALabel.setPixmap(QPixmap(os.path.join(imgpath, "flag_asia32.png")))
-        self.regionChkUS.stateChanged.connect(self.searchBoxChanged)
-        self.regionChkJP.stateChanged.connect(self.searchBoxChanged)
-        self.regionChkEU.stateChanged.connect(self.searchBoxChanged)
-        self.regionChkASIA.stateChanged.connect(self.searchBoxChanged)
+        self.regionChkUS.stateChanged.connect(self.applyFilter)
+        self.regionChkJP.stateChanged.connect(self.applyFilter)
+        self.regionChkEU.stateChanged.connect(self.applyFilter)
+        self.regionChkASIA.stateChanged.connect(self.applyFilter)
+        self.statusFilter = QComboBox()
+        for tlabel, tstatuses in STATUS_FILTERS:
+            self.statusFilter.addItem(tlabel, tstatuses)
+        self.statusFilter.currentIndexChanged.connect(self.applyFilter)
 
         rlayout.addWidget(self.regionChkUS)
         rlayout.addWidget(self.regionChkUSLabel)
@@ -110,6 +149,7 @@ class App(QMainWindow):
         rlayout.addWidget(self.regionChkASIA)
         rlayout.addWidget(self.regionChkASIALabel)
         rlayout.addStretch()
+        rlayout.addWidget(self.statusFilter)
 
         self.regionGroup = QGroupBox()
         self.regionGroup.setFlat(True)
@@ -123,7 +163,7 @@ class App(QMainWindow):
 
         # Setup main layout
         layout = QVBoxLayout()
-        layout.addWidget(self.gameList)
+        layout.addWidget(self.tabs)
         layout.addWidget(self.searchBoxGroup)
         self.dataGroupBox = QGroupBox("Game List")
         self.dataGroupBox.setLayout(layout)
@@ -135,6 +175,17 @@ class App(QMainWindow):
         mainLayout.addWidget(self.dataGroupBox)
         self.mainWidget.setLayout(mainLayout)
 
+        # Setup loading progress & cancel button
+        self.loadProgress = QProgressBar()
+        self.loadProgress.setRange(0, 100)
+        self.loadProgress.setMaximumWidth(200)
+        self.loadCancel = QPushButton("Cancel")
+        self.loadCancel.clicked.connect(self.cancelLoad)
+        self.statusBar().addPermanentWidget(self.loadProgress)
+        self.statusBar().addPermanentWidget(self.loadCancel)
+        self.loadProgress.hide()
+        self.loadCancel.hide()
+
         # Show main app window
         self.resize(1000, 700)
         self.show()
@@ -148,26 +199,171 @@ class App(QMainWindow):
             return
 
         gconf = self.uconfig
-
-        self.statusBar().showMessage("Refreshing game list...")
-
-        logger.debug("Launching update thread...")
-        upThread = UpdateThread(self)
-        upThread.signal.connect(self.loadGameDataComplete)
-        upThread.start()
-        logger.debug("Update thread launched")
-
-    def loadGameDataComplete(self, resp):
-        logger.debug("Finished loading game data. resp=%s", resp)
-        if resp is True:
-            self.statusBar().showMessage("Ready. Loaded %d games" % (self.glistModel.rowCount()))
-            self.searchBoxChanged()
-        else:
-            self.statusBar().showMessage("Failed to load game list. Check config.")
+        guiconf = dict(default_config['gui'])
+        guiconf.update(gconf.get('gui') or {})
+        self.preload = guiconf['preload']
+        self.queuePanel.workerSpin.setValue(int(guiconf['install_workers']))
+        self.serveMetrics()
+
+        # loads still in progress (eg. after changing settings) are abandoned
+        current = self.currentTab()
+        current = current.glist if current is not None else None
+        self.clearTabs()
+
+        # cached & installed status of the games in every list
+        self.statusIndex = StatusIndex(gconf, gconf['install_root'])
+        self.statusTimer.start()
+
+        # lists are only loaded once their tab is opened (or preloaded, see preloadNext)
+        self.tabs.blockSignals(True)
+        for glist, turl in self.uconfig['tsv_urls'].items():
+            if not turl:
+                continue
+            tab = GameListTab(glist, self.statusIndex, self)
+            tab.changed.connect(self.tabUpdated)
+            tab.loadFinished.connect(self.tabLoadFinished)
+            tab.gameList.doubleClicked.connect(self.installSelected)
+            tab.gameList.addAction(self.installAction)
+            self.tabs.addTab(tab, tab.title())
+            if glist == current:
+                self.tabs.setCurrentWidget(tab)
+        self.tabs.blockSignals(False)
+
+        if not self.tabs.count():
+            self.statusBar().showMessage("No game lists configured")
             self.showConfigWarning()
+            return
+        self.tabChanged()
+
+    def clearTabs(self):
+        """
+        Cancel any loads in progress and remove all game list tabs
+        """
+        self.preloadTimer.stop()
+        tabs = [self.tabs.widget(x) for x in range(self.tabs.count())]
+        for tab in tabs:
+            tab.cancelLoad()
+        for tab in tabs:
+            tab.wait()
+        self.tabs.clear()
+        for tab in tabs:
+            tab.deleteLater()
+
+    def currentTab(self):
+        return self.tabs.currentWidget()
+
+    def tabChanged(self):
+        tab = self.currentTab()
+        if tab is None:
+            return
+        gfilter = self.makeFilter()
+        if tab.state is None:
+            tab.load(gfilter)
+        elif not gfilter.same(tab.gfilter):
+            tab.applyFilter(gfilter)
+        self.showTabStatus()
+
+    def tabUpdated(self):
+        tab = self.sender()
+        self.tabs.setTabText(self.tabs.indexOf(tab), tab.title())
+        if tab is self.currentTab():
+            self.showTabStatus()
+
+    def tabLoadFinished(self, ok):
+        if not ok and self.sender() is self.currentTab():
+            self.showConfigWarning()
+        self.preloadTimer.start()
+
+    def showTabStatus(self):
+        tab = self.currentTab()
+        self.statusBar().showMessage(tab.message)
+        self.loadProgress.setValue(tab.progress)
+        self.loadProgress.setVisible(tab.state == 'loading')
+        self.loadCancel.setVisible(tab.state == 'loading')
+
+    def preloadNext(self):
+        """
+        Load the next list that hasn't been opened yet, if no other list is
+        currently loading. Called in idle time, once a load has finished
+        """
+        tabs = [self.tabs.widget(x) for x in range(self.tabs.count())]
+        if not self.preload or any([x.state == 'loading' for x in tabs]):
+            return
+        for tab in tabs:
+            if tab.state is None:
+                logger.debug("Preloading game list %s", tab.glist)
+                tab.load(self.makeFilter())
+                return
+
+    def refreshList(self):
+        tab = self.currentTab()
+        if tab is not None:
+            tab.load(self.makeFilter(), force=True)
+
+    def cancelLoad(self):
+        tab = self.currentTab()
+        if tab is not None:
+            tab.cancelLoad()
+
+    def refreshStatus(self):
+        """
+        Update status badges (and status filters) if the pkg cache or install
+        root have changed
+        """
+        if self.statusIndex is None or not self.statusIndex.refresh():
+            return
+        for tab in [self.tabs.widget(x) for x in range(self.tabs.count())]:
+            tab.glistModel.statusChanged()
+            if tab.gfilter is not None and tab.gfilter.statuses and tab.state is not None:
+                tab.applyFilter(copy.copy(tab.gfilter))
+
+    def installSelected(self):
+        tab = self.currentTab()
+        if tab is None or tab.state is None:
+            return
+        games = tab.selectedGames()
+        added = self.installQueue.enqueue(games, tab.glist, gconf['install_root'])
+        self.statusBar().showMessage("Queued %d of %d selected items for install" % (added, len(games)))
+
+    def closeEvent(self, event):
+        if self.installQueue.activeCount():
+            if QMessageBox.question(self, "Quit", "Installs are still in progress. Quit anyway?") != QMessageBox.Yes:
+                event.ignore()
+                return
+            self.installQueue.stopAll()
+        self.clearTabs()
+        if self.metricsConfig()['output']:
+            metrics.registry.write(self.metricsConfig()['output'])
+        super().closeEvent(event)
+
+    def metricsConfig(self):
+        mconf = dict(default_config['metrics'])
+        mconf.update(gconf.get('metrics') or {})
+        return mconf
+
+    def serveMetrics(self):
+        """
+        Serve live metrics at the configured `metrics.listen` address, if any,
+        restarting the server if the address has changed
+        """
+        listen = self.metricsConfig()['listen'] or None
+        if listen == self.metricsListen:
+            return
+        if self.metricsServer is not None:
+            self.metricsServer.shutdown()
+            self.metricsServer.server_close()
+            self.metricsServer = None
+        self.metricsListen = listen
+        if listen:
+            self.metricsServer = metrics.registry.listen(listen)
 
     def createMenus(self):
         self.fileMenu = self.menuBar().addMenu("&File")
+        self.fileMenu.addAction(QAction("&Refresh list", self, shortcut="F5", statusTip="Fetch the current game list again", triggered=self.refreshList))
+        self.installAction = QAction("&Install selected", self, shortcut="Ctrl+I", statusTip="Add the selected items to the install queue", triggered=self.installSelected)
+        self.fileMenu.addAction(self.installAction)
+        self.fileMenu.addAction(self.queueDock.toggleViewAction())
+        self.fileMenu.addSeparator()
         self.fileMenu.addAction(QAction("Preferences...", self, statusTip="Show Settings dialog", triggered=self.launchSettings))
         self.fileMenu.addSeparator()
         self.fileMenu.addAction(QAction("Export config...", self, statusTip="Export configuration file", triggered=self.configExport))
@@ -271,87 +467,361 @@ class App(QMainWindow):
             logger.debug("Config import aborted. target_path='%s'", target_path)
 
     def searchBoxChanged(self):
-        regex = QRegExp(self.searchBox.text(), False, QRegExp.PatternSyntax(QRegExp.Wildcard))
-        self.proxyModel.plainText = self.searchBox.text()
-        self.proxyModel.regionList = ['']
-        if self.regionChkUS.isChecked(): self.proxyModel.regionList += ['US']
-        if self.regionChkJP.isChecked(): self.proxyModel.regionList += ['JP']
-        if self.regionChkEU.isChecked(): self.proxyModel.regionList += ['EU']
-        if self.regionChkASIA.isChecked(): self.proxyModel.regionList += ['ASIA']
-
-        # setFilterRegExp() must be called last, as it triggers a re-sort of the proxyModel
-        self.proxyModel.setFilterRegExp(regex)
-        self.statusBar().showMessage("Displaying %d / %d" % (self.proxyModel.rowCount(), self.glistModel.rowCount()))
-        #logger.debug("searchBoxChanged: regionList=%s / plainText=%s / matched rows=%d", self.proxyModel.regionList, self.proxyModel.plainText, self.proxyModel.rowCount())
-
-    def createGlistModel(self, parent):
-        model = QStandardItemModel(0, 6, parent)
-        model.setHeaderData(0, Qt.Horizontal, "ID")
-        model.setHeaderData(1, Qt.Horizontal, "Region")
-        model.setHeaderData(2, Qt.Horizontal, "Title/Version")
-        model.setHeaderData(3, Qt.Horizontal, "Updated")
-        model.setHeaderData(4, Qt.Horizontal, "Size")
-        model.setHeaderData(5, Qt.Horizontal, "Content ID")
-        return model
-
-    def addGame(self, idx, region, title, updated, size, cid):
-        self.glistModel.insertRow(0)
-        self.glistModel.setData(self.glistModel.index(0, 0), idx)
-        self.glistModel.setData(self.glistModel.index(0, 1), region)
-        self.glistModel.setData(self.glistModel.index(0, 2), title)
-        self.glistModel.setData(self.glistModel.index(0, 3), updated)
-        self.glistModel.setData(self.glistModel.index(0, 4), size)
-        self.glistModel.setData(self.glistModel.index(0, 5), cid)
+        # wait for typing to pause before filtering
+        self.filterTimer.start()
+
+    def makeFilter(self):
+        regions = ['']
+        if self.regionChkUS.isChecked(): regions += ['US']
+        if self.regionChkJP.isChecked(): regions += ['JP']
+        if self.regionChkEU.isChecked(): regions += ['EU']
+        if self.regionChkASIA.isChecked(): regions += ['ASIA']
+        return GameFilter(self.searchBox.text(), regions, self.statusFilter.currentData())
+
+    def applyFilter(self):
+        self.filterTimer.stop()
+        tab = self.currentTab()
+        if tab is not None:
+            tab.applyFilter(self.makeFilter())
+
+
+class GameListTab(QWidget):
+    """
+    View of game list @glist (eg. PSV, PSP_DLC), with status badges from
+    StatusIndex @sindex. Nothing is loaded until load() is called; each tab
+    loads on its own UpdateThread, so several lists can load at once.
+    `changed` is emitted whenever the status message,
+    progress or state (None until loaded, then loading, ready, cancelled or
+    failed) changes, and `loadFinished` with True/False once a load is done
+    """
+    changed = pyqtSignal()
+    loadFinished = pyqtSignal(bool)
+
+    def __init__(self, glist, sindex=None, parent=None):
+        super().__init__(parent)
+        self.glist = glist
+        self.state = None
+        self.message = "Not loaded"
+        self.progress = 0
+        self.upThread = None
+        self.gfilter = None
+        self.filterThread = None
+        self.filterPending = False
+
+        # Setup proxy model
+        self.proxyModel = GameListFilter(self)
+
+        # Setup source view (gameList)
+        self.gameList = QTreeView()
+        self.gameList.setRootIsDecorated(False)
+        self.gameList.setAlternatingRowColors(True)
+        self.gameList.setSortingEnabled(True)
+        self.gameList.sortByColumn(3, Qt.DescendingOrder)
+
+        self.glistModel = GameListModel(self)
+        self.glistModel.setStatusIndex(sindex, glist)
+        self.gameList.setModel(self.proxyModel)
+        self.proxyModel.setSourceModel(self.glistModel)
+
+        self.gameList.setColumnWidth(0, 80)
+        self.gameList.setColumnWidth(1, 50)
+        self.gameList.setColumnWidth(2, 450)
+        self.gameList.setColumnWidth(3, 120)
+        self.gameList.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.gameList.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.gameList.setContextMenuPolicy(Qt.ActionsContextMenu)
+
+        layout = QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.gameList)
+        self.setLayout(layout)
+
+    def title(self):
+        if self.state is None:
+            return self.glist
+        elif self.state == 'loading':
+            return "%s (%d%%)" % (self.glist, self.progress)
+        elif self.state == 'failed':
+            return "%s (failed)" % (self.glist)
+        return "%s (%d)" % (self.glist, self.glistModel.rowCount())
+
+    def setMessage(self, msg):
+        self.message = msg
+        self.changed.emit()
+
+    def selectedGames(self):
+        """
+        Return list of selected games, in display order
+        """
+        rows = sorted([x.row() for x in self.gameList.selectionModel().selectedRows()])
+        return [self.glistModel.game(self.proxyModel.mapToSource(self.proxyModel.index(x, 0)).row()) for x in rows]
+
+    def load(self, gfilter, force=False):
+        """
+        Load the list in the background, replacing any rows already loaded,
+        and filter it by @gfilter. If @force is True, the list is fetched
+        again even if the cached copy is still fresh
+        """
+        self.cancelLoad()
+        self.wait()
+
+        self.state = 'loading'
+        self.progress = 0
+        self.glistModel.setGames([])
+        self.gfilter = gfilter
+        self.filterPending = False
+        self.proxyModel.setGameFilter(gfilter)
+
+        logger.debug("Launching update thread for %s...", self.glist)
+        self.upThread = UpdateThread(self, self.glist, force)
+        self.upThread.batch.connect(self.loadBatch)
+        self.upThread.progress.connect(self.loadProgress)
+        self.upThread.signal.connect(self.loadComplete)
+        self.upThread.start()
+        self.setMessage("Refreshing game list...")
+
+    def loadBatch(self, rows):
+        # ignore anything still queued from a cancelled load
+        if self.sender() is not self.upThread or self.upThread.cancelled:
+            return
+        self.glistModel.appendGames(rows)
+        self.setMessage("Loading game list... (%d games)" % (self.glistModel.rowCount()))
+        self.upThread.batchTaken()
+
+    def loadProgress(self, msg, value):
+        if self.sender() is not self.upThread:
+            return
+        if value >= 0:
+            self.progress = value
+        elif not self.glistModel.rowCount():
+            self.message = msg
+        self.changed.emit()
+
+    def loadComplete(self, resp):
+        logger.debug("Finished loading game list %s. resp=%s", self.glist, resp)
+        if self.sender() is not self.upThread:
+            return
+        if resp is None or self.upThread.cancelled:
+            self.state = 'cancelled'
+            self.setMessage("Loading cancelled. Loaded %d games" % (self.glistModel.rowCount()))
+        elif resp is not False:
+            self.state = 'ready'
+            self.setMessage("Ready. Loaded %d games" % (self.glistModel.rowCount()))
+        else:
+            self.state = 'failed'
+            self.setMessage("Failed to load game list. Check config.")
+        self.loadFinished.emit(self.state != 'failed')
+
+    def cancelLoad(self):
+        if self.upThread is not None and self.upThread.isRunning():
+            logger.info("Cancelling game list load (%s)", self.glist)
+            self.upThread.cancel()
+
+    def wait(self):
+        """
+        Wait for the update and filter threads to finish
+        """
+        for tthread in (self.upThread, self.filterThread):
+            if tthread is not None:
+                tthread.wait()
+        self.filterThread = None
+
+    def applyFilter(self, gfilter):
+        self.gfilter = gfilter
+        if self.filterThread is not None and self.filterThread.isRunning():
+            # applied again with the latest filter once the running one finishes
+            self.filterPending = True
+            return
+
+        if self.glistModel.rowCount() > FILTER_THREAD_ROWS:
+            self.filterThread = FilterThread(self, gfilter, self.glistModel, self.proxyModel.gameFilter)
+            self.filterThread.signal.connect(self.filterThreadComplete)
+            self.filterThread.start()
+        else:
+            self.applyFilterComplete(gfilter.run(self.glistModel, self.proxyModel.gameFilter))
+
+    def filterThreadComplete(self, gfilter):
+        # ignore results for rows that have since been replaced (see load)
+        if self.sender() is self.filterThread:
+            self.applyFilterComplete(gfilter)
+
+    def applyFilterComplete(self, gfilter):
+        self.proxyModel.setGameFilter(gfilter)
+        self.setMessage("Displaying %d / %d" % (self.proxyModel.rowCount(), self.glistModel.rowCount()))
+        if self.filterPending:
+            self.filterPending = False
+            self.applyFilter(self.gfilter)
+
+
+class InstallQueuePanel(QWidget):
+    """
+    Install queue view, with controls for the selected items and for the
+    number of concurrent installs
+    """
+    def __init__(self, queue, parent=None):
+        super().__init__(parent)
+        self.queue = queue
+
+        self.queueList = QTreeView()
+        self.queueList.setRootIsDecorated(False)
+        self.queueList.setAlternatingRowColors(True)
+        self.queueList.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.queueList.setModel(queue)
+        self.queueList.setColumnWidth(0, 260)
+        self.queueList.setColumnWidth(1, 260)
+        self.queueList.setColumnWidth(2, 140)
+        self.queueList.setColumnWidth(3, 200)
+
+        self.pauseButton = QPushButton("Pause")
+        self.pauseButton.clicked.connect(lambda: self.queue.pause(self.selectedRows()))
+        self.resumeButton = QPushButton("Resume")
+        self.resumeButton.clicked.connect(lambda: self.queue.resume(self.selectedRows()))
+        self.cancelButton = QPushButton("Cancel")
+        self.cancelButton.clicked.connect(lambda: self.queue.cancel(self.selectedRows()))
+        self.retryButton = QPushButton("Retry")
+        self.retryButton.clicked.connect(lambda: self.queue.retry(self.selectedRows()))
+        self.clearButton = QPushButton("Clear finished")
+        self.clearButton.clicked.connect(self.queue.clearFinished)
+
+        self.workerSpin = QSpinBox()
+        self.workerSpin.setRange(1, 16)
+        self.workerSpin.valueChanged.connect(self.queue.setWorkers)
+        self.summaryLabel = QLabel()
+        self.queue.summaryChanged.connect(self.summaryLabel.setText)
+
+        blayout = QHBoxLayout()
+        blayout.addWidget(self.pauseButton)
+        blayout.addWidget(self.resumeButton)
+        blayout.addWidget(self.cancelButton)
+        blayout.addWidget(self.retryButton)
+        blayout.addWidget(self.clearButton)
+        blayout.addStretch()
+        blayout.addWidget(self.summaryLabel)
+        blayout.addWidget(QLabel("Concurrent installs"))
+        blayout.addWidget(self.workerSpin)
+
+        layout = QVBoxLayout()
+        layout.addWidget(self.queueList)
+        layout.addLayout(blayout)
+        self.setLayout(layout)
+
+    def selectedRows(self):
+        return [x.row() for x in self.queueList.selectionModel().selectedRows()]
 
 
 class UpdateThread(QThread):
+    """
+    Fetches (if needed) and parses a game list, handing parsed rows to the
+    GUI thread in batches through the `batch` signal. Once finished, `signal`
+    is emitted with the TSVManager, False on failure, or None if cancelled.
+    A new batch is only sent once the previous one has been taken (see
+    batchTaken), so the GUI thread gets to handle input in between
+    Also stands in as TSVManager's progress dialog, forwarding updates
+    through the `progress` signal as (label, value); value is -1 when only
+    the label changed
+    """
     signal = pyqtSignal('PyQt_PyObject')
+    batch = pyqtSignal('PyQt_PyObject')
+    progress = pyqtSignal(str, int)
 
-    def __init__(self, mainapp):
-        super().__init__(mainapp)
-        self.mainapp = mainapp
+    def __init__(self, parent, glist="PSV", force=False):
+        super().__init__(parent)
+        self.glist = glist
+        self.force = force
+        self.tsv = None
+        self.cancelled = False
+        self.label = ""
+        self.taken = threading.Event()
 
-    def run(self):
-        # Setup progress dialog
-        #logger.debug("Launching QProgressDialog for UpdateThread...")
-        #progressDiag = QProgressDialog("Checking TSV cache...", "", 0, 100)
-        #logger.debug(sys._getframe().f_lineno)
-        #progressDiag.setWindowTitle("psvpack - Loading")
-        #logger.debug(sys._getframe().f_lineno)
-        #progressDiag.setValue(0)
-        #logger.debug(sys._getframe().f_lineno)
-        #progressDiag.setWindowModality(Qt.WindowModal)
-        #logger.debug(sys._getframe().f_lineno)
-        #progressDiag.show()
+    def setLabelText(self, msg):
+        self.label = msg
+        self.progress.emit(msg, -1)
+
+    def setValue(self, value):
+        self.progress.emit(self.label, value)
+
+    def cancel(self):
+        self.cancelled = True
+        if self.tsv is not None:
+            self.tsv.cancel()
+
+    def batchTaken(self):
+        self.taken.set()
 
+    def run(self):
         # Load the TSV file (as well as download updates if necessary)
         logger.debug("Checking TSV cache...")
-        #tsv = psfree.TSVManager('PSV', gconf, pd=progressDiag)
-        tsv = psfree.TSVManager('PSV', gconf)
+        try:
+            self.tsv = psfree.TSVManager(self.glist, gconf, pd=self, load=False)
+            if self.cancelled:
+                self.tsv.cancel()
+            self.tsv.check_for_update(self.force)
+            self.taken.set()
+            for rows in self.tsv.iter_load(LOAD_BATCH):
+                while not self.taken.wait(0.1) and not self.cancelled:
+                    pass
+                if self.cancelled:
+                    break
+                self.taken.clear()
+                self.batch.emit(rows)
+        except Exception as e:
+            logger.error("Failed to load TSV: %s", str(e))
+            self.signal.emit(False)
+            return
 
-        if tsv.loaded is False:
+        if self.tsv.cancelled:
+            self.signal.emit(None)
+        elif self.tsv.loaded is False:
             logger.error("Failed to load TSV")
-            #progressDiag.close()
-            #self.mainapp.showConfigWarning()
             self.signal.emit(False)
-            return
+        else:
+            logger.debug("Loaded %d games", len(self.tsv.glist))
+            self.signal.emit(self.tsv)
+
+class FilterThread(QThread):
+    """
+    Evaluates GameFilter @gfilter over @model in the background, narrowing
+    from the previous filter @prev where possible. Emits `signal` with the
+    filter once done
+    """
+    signal = pyqtSignal('PyQt_PyObject')
+
+    def __init__(self, parent, gfilter, model, prev=None):
+        super().__init__(parent)
+        self.gfilter = gfilter
+        self.model = model
+        self.prev = prev
 
-        logger.debug("Clearing existing glistModel data...")
-        self.mainapp.glistModel.removeRows(0, self.mainapp.glistModel.rowCount())
+    def run(self):
+        self.signal.emit(self.gfilter.run(self.model, self.prev))
 
-        #progressDiag.setLabelText("Loading game list...")
-        logger.debug("Loading game list into glistModel")
-        for tgame in tsv.glist:
-            tdate = QDateTime.fromString(tgame['Last Modification Date'], "yyyy-MM-dd hh:mm:ss")
-            self.mainapp.addGame(str(tgame['Title ID']), str(tgame['Region']), str(tgame['Name']), tdate, fmtsize(tgame['File Size']), str(tgame['Content ID']))
+class InstallThread(QThread):
+    """
+    Installs a single InstallItem through an InstallPipeline, sharing
+    ExtractPool @expool with other installs, and forwards the pipeline's
+    progress events through `event` (download progress is already throttled
+    by download_pkg). The download is aborted once the item's `abort` is set
+    """
+    event = pyqtSignal('PyQt_PyObject')
 
-        gcount = self.mainapp.glistModel.rowCount()
-        logger.debug("Loaded %d games", gcount)
+    def __init__(self, parent, item, expool):
+        super().__init__(parent)
+        self.item = item
+        self.expool = expool
 
-        #progressDiag.setValue(100)
-        #progressDiag.close()
-        self.mainapp.gameList.setDisabled(False)
-        self.signal.emit(True)
+    def onEvent(self, event):
+        if event['type'] == 'fetch_progress' and self.item.abort:
+            raise psfree.DownloadCancelled(self.item.abort)
+        self.event.emit(event)
+
+    def run(self):
+        item = self.item
+        try:
+            pipe = InstallPipeline(gconf, item.glist, item.uxroot, download_workers=1, expool=self.expool,
+                                   on_event=self.onEvent)
+            pipe.run([item.tgame])
+        except Exception as e:
+            logger.error("Failed to install %s: %s", item.tgame['Content ID'], str(e))
 
 class SettingsDialog(QDialog):
     def __init__(self, parent=None):
@@ -396,13 +866,15 @@ class SettingsDialog(QDialog):
 
         logger.info("tsv items update: %s", tsv_urls)
 
-        gconf = {
+        # keep any options that aren't exposed in the settings dialog
+        gconf = dict(gconf)
+        gconf.update({
             'cache_dir': self.generalTab.cacheDirEdit.text(),
             'cache_ttl': cache_ttl,
             'pkg2zip': self.generalTab.p2zPathEdit.text(),
             'install_root': self.generalTab.installRootEdit.text(),
             'tsv_urls': tsv_urls
-        }
+        })
 
         save_rez = save_config(gconf)
         if save_rez is not True:
@@ -533,51 +1005,651 @@ class SourcesItemView(QTreeView):
             return super().edit(index, trigger, event)
 
 
-class GameListFilter(QSortFilterProxyModel):
-    regionList = ['US', 'JP', 'EU', 'ASIA', '']
-    plainText = ""
+class GameListModel(QAbstractTableModel):
+    """
+    Read-only table model serving rows straight from a loaded game list.
+    Values are only formatted when requested by the view, so the cost of
+    loading a list doesn't grow with per-cell work. Qt.UserRole returns the
+    precomputed sort key of the cell (see sortKeys). The Status column shows
+    each game's status badges from a StatusIndex, if one is set
+    """
+    columns = [("ID", 'Title ID'), ("Region", 'Region'), ("Title/Version", 'Name'),
+               ("Updated", 'Last Modification Date'), ("Size", 'File Size'), ("Content ID", 'Content ID'),
+               ("Status", None)]
 
     def __init__(self, parent=None):
         super().__init__(parent)
-
-    def filterAcceptsRow(self, sourceRow, sourceParent):
-        i_idx = self.sourceModel().index(sourceRow, 0, sourceParent)
-        i_region = self.sourceModel().index(sourceRow, 1, sourceParent)
-        i_title = self.sourceModel().index(sourceRow, 2, sourceParent)
-        i_cid = self.sourceModel().index(sourceRow, 4, sourceParent)
-
+        self.sindex = None
+        self.glist = None
+        self.status_keys = None
+        self.status_gen = None
+        self.setGames([])
+
+    def setStatusIndex(self, sindex, glist):
+        """
+        Use StatusIndex @sindex for the Status column, for rows of list @glist
+        """
+        self.sindex = sindex
+        self.glist = glist
+        self.statusChanged()
+
+    def statusChanged(self):
+        """
+        Update views after the status index has been refreshed
+        """
+        self.status_keys = None
+        if self.games:
+            tcol = len(self.columns) - 1
+            self.dataChanged.emit(self.index(0, tcol), self.index(len(self.games) - 1, tcol))
+
+    def statusText(self, row):
+        if self.sindex is None:
+            return ''
+        if self.status_keys is not None and self.status_gen == self.sindex.generation:
+            return self.status_keys[row]
+        return ', '.join(self.sindex.status(self.games[row], self.glist))
+
+    def statusKeys(self):
+        """
+        Return list of status texts, indexed by row. Computed once per
+        generation of the status index, as statuses change while games are
+        downloaded & installed
+        """
+        if self.sindex is None:
+            return [''] * len(self.games)
+        if self.status_keys is None or self.status_gen != self.sindex.generation:
+            self.status_keys = [', '.join(self.sindex.status(x, self.glist)) for x in self.games]
+            # read after the scan, which the first lookup may have triggered
+            self.status_gen = self.sindex.generation
+        return self.status_keys
+
+    def matchesStatus(self, row, statuses):
+        """
+        Check that game at @row has all @statuses (see status.STATUSES)
+        """
+        return self.sindex is None or self.sindex.matches(self.games[row], self.glist, statuses)
+
+    def setGames(self, glist):
+        self.beginResetModel()
+        self.games = []
+        self.titles = []
+        self.regions = []
+        self.id_index = {}
+        self.sort_keys = [[] for x in self.columns]
+        self.status_keys = None
+        self.day_epochs = {}
+        self.addGames(glist)
+        self.endResetModel()
+
+    def appendGames(self, glist):
+        if not glist:
+            return
+        self.beginInsertRows(QModelIndex(), len(self.games), len(self.games) + len(glist) - 1)
+        self.addGames(glist)
+        self.endInsertRows()
+
+    def addGames(self, glist):
+        """
+        Add @glist to the model, along with the normalized columns used for
+        filtering: casefolded titles, regions, and a Title ID/Content ID index,
+        and the sort key of each cell
+        """
+        for trow, tgame in enumerate(glist, len(self.games)):
+            self.titles.append(('%s\t%s' % (tgame.get('Name') or '', tgame.get('Original Name') or '')).casefold())
+            self.regions.append((tgame.get('Region') or '').strip())
+            for tkey in ('Title ID', 'Content ID'):
+                self.id_index.setdefault((tgame.get(tkey) or '').upper(), []).append(trow)
+        self.games += glist
+
+        # sort keys: titles are casefolded, dates are Unix epoch ints, sizes are ints (bytes)
+        tvals = [[x.get(tkey) or '' for x in glist] for _, tkey in self.columns if tkey]
+        for tcol in (0, 1, 5):
+            self.sort_keys[tcol] += tvals[tcol]
+        self.sort_keys[2] += [x.casefold() for x in tvals[2]]
+        self.sort_keys[3] += [self.dateKey(x) for x in tvals[3]]
+        self.sort_keys[4] += [int(x) if x.isdigit() else 0 for x in tvals[4]]
+        if self.status_keys is not None:
+            self.status_keys += [', '.join(self.sindex.status(x, self.glist)) for x in glist]
+
+    def dateKey(self, tval):
+        """
+        Return @tval ("YYYY-MM-DD hh:mm:ss") as Unix epoch int, or 0 if invalid
+        """
         try:
-            match_region = self.sourceModel().data(i_region).strip() in self.regionList
-        except:
-            match_region = True
-
-        match_title = self.filterRegExp().indexIn(self.sourceModel().data(i_title)) >= 0
-        match_idx = self.sourceModel().data(i_idx) == self.plainText.upper().strip()
-        match_cid = self.sourceModel().data(i_cid) == self.plainText.upper().strip()
-
-        return match_idx or match_cid or (match_title and match_region)
-
-    def lessThan(self, left, right):
-        leftData = self.sourceModel().data(left)
-        rightData = self.sourceModel().data(right)
+            day = self.day_epochs[tval[:10]]
+        except KeyError:
+            try:
+                day = calendar.timegm((int(tval[0:4]), int(tval[5:7]), int(tval[8:10]), 0, 0, 0))
+            except ValueError:
+                day = None
+            self.day_epochs[tval[:10]] = day
+        try:
+            return day + int(tval[11:13]) * 3600 + int(tval[14:16]) * 60 + int(tval[17:19])
+        except (TypeError, ValueError):
+            return 0
+
+    def sortKeys(self, column):
+        """
+        Return list of sort keys of @column, indexed by row
+        """
+        if self.columns[column][1] is None:
+            return self.statusKeys()
+        return self.sort_keys[column]
+
+    def game(self, row):
+        return self.games[row]
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.games)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.columns)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.columns[section][0]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role not in (Qt.DisplayRole, Qt.UserRole):
+            return None
+        if self.columns[index.column()][1] is None:
+            return self.statusText(index.row())
+        elif role == Qt.UserRole:
+            return self.sort_keys[index.column()][index.row()]
+        tval = self.games[index.row()].get(self.columns[index.column()][1]) or ''
+        if index.column() == 3:
+            return QDateTime.fromString(tval, "yyyy-MM-dd hh:mm:ss")
+        elif index.column() == 4:
+            return fmtsize(tval)
+        return tval
+
+
+class GameFilter(object):
+    """
+    Filter over the normalized columns of a GameListModel. Rows match if
+    their title or original title contains @query (case-insensitive, with `*`
+    and `?` wildcards) and their region is in @regions, or if their Title ID
+    or Content ID is @query. If @statuses are given, rows must also have all
+    of them (see status.STATUSES). A new filter starts out evaluated over no
+    rows; run() evaluates it over all rows of the model
+    """
+    def __init__(self, query, regions, statuses=None):
+        self.norm = query.strip().casefold()
+        self.idkey = query.strip().upper()
+        self.regions = set(regions)
+        self.statuses = statuses or []
+        self.search = None
+        if '*' in self.norm or '?' in self.norm:
+            self.search = re.compile(''.join(['.*' if x == '*' else '.' if x == '?' else re.escape(x) for x in self.norm]), re.S).search
+        self.count = 0
+        self.title_rows = []
+        self.rows = set()
+
+    def same(self, other):
+        """
+        Return True if @other filters by the same query, regions and statuses
+        """
+        return other is not None and (self.norm, self.regions, self.statuses) == (other.norm, other.regions, other.statuses)
+
+    def match_title(self, title):
+        if self.search is not None:
+            return self.search(title) is not None
+        return self.norm in title
+
+    def narrows(self, prev):
+        """
+        Return True if every title matching this filter also matches @prev
+        (ie. the query extends @prev's query)
+        """
+        return prev is not None and self.norm.startswith(prev.norm)
+
+    def run(self, model, prev=None):
+        """
+        Evaluate filter over all rows of @model. If the query extends that of
+        @prev, only @prev's title matches (and rows added since) are checked
+        Returns self
+        """
+        # regions are added after titles, so every row counted here is complete,
+        # even if rows are being added on the GUI thread at the same time
+        count = len(model.regions)
+        if self.narrows(prev):
+            candidates = prev.title_rows + list(range(prev.count, count))
+        else:
+            candidates = range(count)
 
-        if leftData is None:
-            logger.debug("leftData is None!")
+        titles = model.titles
+        if not self.norm:
+            title_rows = list(candidates)
+        elif self.search is not None:
+            title_rows = [x for x in candidates if self.search(titles[x])]
+        else:
+            norm = self.norm
+            title_rows = [x for x in candidates if norm in titles[x]]
+
+        regions = model.regions
+        rows = set([x for x in title_rows if regions[x] in self.regions])
+        rows.update([x for x in model.id_index.get(self.idkey, []) if x < count])
+        if self.statuses:
+            rows = set([x for x in rows if model.matchesStatus(x, self.statuses)])
+        self.title_rows, self.rows, self.count = title_rows, rows, count
+        return self
+
+    def accepts(self, model, row):
+        """
+        Check a single @row of @model, eg. one added after run()
+        """
+        if self.statuses and not model.matchesStatus(row, self.statuses):
             return False
-        elif rightData is None:
-            logger.debug("rightData is None!")
+        if self.match_title(model.titles[row]) and model.regions[row] in self.regions:
             return True
+        return row in model.id_index.get(self.idkey, [])
 
-        if not isinstance(leftData, QDate):
-            emailPattern = QRegExp("([\\w\\.]*@[\\w\\.]*)")
 
-            if left.column() == 1 and emailPattern.indexIn(leftData) != -1:
-                leftData = emailPattern.cap(1)
+class GameListFilter(QAbstractProxyModel):
+    """
+    Sorting & filtering proxy for a GameListModel. Rows are sorted on the
+    model's precomputed sort keys, and the resulting order of source rows is
+    cached per column, so re-filtering, or sorting again by a column that was
+    sorted before, doesn't sort at all. Filtering is done by a GameFilter
+    """
+    gameFilter = None
 
-            if right.column() == 1 and emailPattern.indexIn(rightData) != -1:
-                rightData = emailPattern.cap(1)
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.sort_column = -1
+        self.sort_order = Qt.AscendingOrder
+        self.orders = {}
+        self.rows = []
+        self.row_map = None
+
+    def setSourceModel(self, model):
+        self.beginResetModel()
+        super().setSourceModel(model)
+        model.modelAboutToBeReset.connect(self.beginResetModel)
+        model.modelReset.connect(self.sourceReset)
+        model.rowsInserted.connect(self.sourceRowsInserted)
+        model.dataChanged.connect(self.sourceDataChanged)
+        self.sourceReset()
+
+    def sourceReset(self):
+        self.orders = {}
+        self.rows = self.visibleRows()
+        self.row_map = None
+        self.endResetModel()
+
+    def sourceRowsInserted(self, parent, first, last):
+        # extend the filter over the new rows, rather than checking rows one by
+        # one on every insert (the filter may be in use by a FilterThread)
+        if self.gameFilter is not None:
+            self.gameFilter = copy.copy(self.gameFilter).run(self.sourceModel(), self.gameFilter)
+        self.setRows(self.visibleRows())
+
+    def sourceDataChanged(self, topLeft, bottomRight, roles=[]):
+        # orders cached for the changed columns are stale
+        columns = range(topLeft.column(), bottomRight.column() + 1)
+        for tcol in columns:
+            self.orders.pop(tcol, None)
+        if self.sort_column in columns:
+            self.setRows(self.visibleRows())
+        elif self.rows:
+            # rows may have moved anywhere, so just update the affected columns
+            self.dataChanged.emit(self.index(0, topLeft.column()),
+                                  self.index(len(self.rows) - 1, bottomRight.column()), roles)
+
+    def setGameFilter(self, gfilter):
+        self.gameFilter = gfilter
+        self.setRows(self.visibleRows())
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        self.sort_column = column
+        self.sort_order = order
+        self.setRows(self.visibleRows())
+
+    def sortOrder(self, column):
+        """
+        Return list of all source rows, ascending by @column. The order is
+        cached; rows appended to the model since it was computed are merged in
+        """
+        model = self.sourceModel()
+        keys = model.sortKeys(column)
+        order = self.orders.get(column, [])
+        if len(order) < len(keys):
+            # sorted() finds the existing run, so this is a merge of the new rows
+            order = sorted(order + sorted(range(len(order), len(keys)), key=keys.__getitem__), key=keys.__getitem__)
+            self.orders[column] = order
+        return order
+
+    def visibleRows(self):
+        """
+        Return list of source rows accepted by the game filter, in sort order
+        """
+        model = self.sourceModel()
+        if model is None:
+            return []
+        if self.sort_column < 0:
+            order = range(model.rowCount())
+        elif self.sort_order == Qt.DescendingOrder:
+            order = reversed(self.sortOrder(self.sort_column))
+        else:
+            order = self.sortOrder(self.sort_column)
+
+        gfilter = self.gameFilter
+        if gfilter is None:
+            return list(order)
+        rows = gfilter.rows
+        count = gfilter.count
+        return [x for x in order if (x in rows if x < count else gfilter.accepts(model, x))]
+
+    def setRows(self, rows):
+        """
+        Replace visible rows with @rows (source rows), keeping selection and
+        other persistent indexes on the same games
+        """
+        self.layoutAboutToBeChanged.emit()
+        pindexes = self.persistentIndexList()
+        srows = [self.rows[x.row()] for x in pindexes]
+        self.rows = rows
+        self.row_map = None
+        self.changePersistentIndexList(pindexes, [self.mapFromSource(self.sourceModel().index(trow, x.column()))
+                                                  for trow, x in zip(srows, pindexes)])
+        self.layoutChanged.emit()
+
+    def index(self, row, column, parent=QModelIndex()):
+        if parent.isValid() or not 0 <= row < len(self.rows) or not 0 <= column < self.columnCount():
+            return QModelIndex()
+        return self.createIndex(row, column)
+
+    def parent(self, index=None):
+        if index is None:
+            return super().parent()
+        return QModelIndex()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        model = self.sourceModel()
+        return 0 if parent.isValid() or model is None else model.columnCount()
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        return self.sourceModel().headerData(section, orientation, role)
+
+    def mapToSource(self, proxyIndex):
+        if not proxyIndex.isValid():
+            return QModelIndex()
+        return self.sourceModel().index(self.rows[proxyIndex.row()], proxyIndex.column())
+
+    def mapFromSource(self, sourceIndex):
+        if not sourceIndex.isValid():
+            return QModelIndex()
+        if self.row_map is None:
+            self.row_map = dict([(x, i) for i, x in enumerate(self.rows)])
+        trow = self.row_map.get(sourceIndex.row())
+        if trow is None:
+            return QModelIndex()
+        return self.createIndex(trow, sourceIndex.column())
+
+class InstallItem(object):
+    """
+    Queued install of @tgame from list @glist into @uxroot. `state` is one of
+    queued, paused, downloading, extracting, installed, skipped, failed or
+    cancelled. Setting `abort` to paused or cancelled stops a running download
+    (the partial download is kept, so it resumes when started again)
+    """
+    def __init__(self, tgame, glist, uxroot):
+        self.tgame = tgame
+        self.glist = glist
+        self.uxroot = uxroot
+        self.state = 'queued'
+        self.error = None
+        self.abort = None
+        self.thread = None
+        self.total = int(tgame['File Size']) if str(tgame.get('File Size')).isdigit() else 0
+        self.bytes = 0
+        self.rate = 0.0
+        self.sample = None
+
+    def active(self):
+        return self.state in ('downloading', 'extracting')
+
+    def finished(self):
+        return self.state in ('installed', 'skipped', 'failed', 'cancelled')
+
+    def update(self, curbyte, total, etime):
+        """
+        Record download progress of @curbyte / @total bytes at time @etime,
+        and update the smoothed download rate
+        """
+        if self.sample is not None and etime > self.sample[0]:
+            rate = (curbyte - self.sample[1]) / (etime - self.sample[0])
+            self.rate = rate if not self.rate else self.rate * (1.0 - RATE_SMOOTHING) + rate * RATE_SMOOTHING
+        self.sample = (etime, curbyte)
+        self.bytes = curbyte
+        self.total = total or self.total
+
+    def eta(self):
+        """
+        Return estimated seconds until the download completes, or None
+        """
+        if self.state != 'downloading' or not self.rate or not self.total:
+            return None
+        return max(0, (self.total - self.bytes) / self.rate)
+
+
+class InstallQueueModel(QAbstractTableModel):
+    """
+    Queue of InstallItems. Up to `workers` items are installed at once, each
+    on its own InstallThread; extractions are also limited by a shared
+    ExtractPool. `summaryChanged` is emitted with a one-line summary of the
+    queue whenever an item changes state, and `itemFinished` with the item
+    once its install thread is done
+    """
+    columns = ["Content ID", "Title", "Status", "Progress", "Speed", "ETA"]
+    summaryChanged = pyqtSignal(str)
+    itemFinished = pyqtSignal('PyQt_PyObject')
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.items = []
+        self.workers = 1
+        self.expool = None
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.items)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.columns)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.columns[section]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role != Qt.DisplayRole:
+            return None
+        item = self.items[index.row()]
+        tcol = index.column()
+        if tcol == 0:
+            return item.tgame['Content ID']
+        elif tcol == 1:
+            return item.tgame.get('Name')
+        elif tcol == 2:
+            if item.state == 'failed' and item.error:
+                return "Failed (%s)" % (item.error)
+            return item.state.capitalize()
+        elif tcol == 3:
+            if item.state in ('installed', 'skipped'):
+                return "100%"
+            elif not item.total:
+                return fmtsize(item.bytes).strip()
+            return "%d%% (%s / %s)" % (item.bytes * 100 // item.total, fmtsize(item.bytes).strip(), fmtsize(item.total).strip())
+        elif tcol == 4:
+            return fmtsize(item.rate, rate=True).strip() if item.state == 'downloading' and item.rate else ""
+        elif tcol == 5:
+            eta = item.eta()
+            return "%d:%02d:%02d" % (eta // 3600, eta % 3600 // 60, eta % 60) if eta is not None else ""
+        return None
+
+    def itemChanged(self, item):
+        row = self.items.index(item)
+        self.dataChanged.emit(self.index(row, 0), self.index(row, len(self.columns) - 1))
+
+    def activeCount(self):
+        return len([x for x in self.items if x.thread is not None])
+
+    def enqueue(self, games, glist, uxroot):
+        """
+        Add @games from list @glist to the queue, for install into @uxroot.
+        Items already waiting or in progress are not added again
+        Returns number of items added
+        """
+        pending = set([x.tgame['Content ID'] for x in self.items if not x.finished()])
+        items = [InstallItem(x, glist, uxroot) for x in games if x['Content ID'] not in pending]
+        if items:
+            self.beginInsertRows(QModelIndex(), len(self.items), len(self.items) + len(items) - 1)
+            self.items += items
+            self.endInsertRows()
+            self.schedule()
+        return len(items)
+
+    def setWorkers(self, workers):
+        self.workers = max(1, workers)
+        self.schedule()
+
+    def schedule(self):
+        """
+        Start queued items, up to the worker limit
+        """
+        if self.expool is None:
+            pconf = dict(default_config['pipeline'])
+            pconf.update(gconf.get('pipeline') or {})
+            self.expool = ExtractPool(pconf['extract_workers'], pconf['extract_per_device'])
+
+        running = self.activeCount()
+        for item in self.items:
+            if running >= self.workers:
+                break
+            elif item.state == 'queued' and item.thread is None:
+                item.state = 'downloading'
+                item.abort = None
+                item.error = None
+                item.rate = 0.0
+                item.sample = None
+                item.thread = InstallThread(self, item, self.expool)
+                item.thread.event.connect(self.installEvent)
+                item.thread.finished.connect(self.installFinished)
+                item.thread.start()
+                running += 1
+                self.itemChanged(item)
+        self.updateSummary()
+
+    def installEvent(self, event):
+        item = self.sender().item
+        etype = event['type']
+        if etype == 'fetch_start':
+            item.state = 'downloading'
+        elif etype == 'fetch_progress':
+            item.update(event['bytes'], event['total'], event['time'])
+        elif etype == 'fetch_done':
+            item.bytes = item.total
+            item.rate = 0.0
+        elif etype == 'extract_start':
+            item.state = 'extracting'
+        elif etype == 'extract_done':
+            item.state = 'installed'
+        elif etype == 'skipped':
+            item.state = 'skipped'
+        elif etype == 'cancelled':
+            item.state = item.abort or 'cancelled'
+        elif etype == 'failed':
+            item.state = 'failed'
+            item.error = event.get('error')
+        else:
+            return
+        self.itemChanged(item)
+        self.updateSummary()
+
+    def installFinished(self):
+        item = self.sender().item
+        item.thread = None
+        if item.active():
+            # the pipeline gave up without reporting why (see the log)
+            item.state = 'failed'
+        self.itemChanged(item)
+        self.itemFinished.emit(item)
+        self.schedule()
+
+    def pause(self, rows):
+        """
+        Hold queued items at @rows, and stop their download if already started.
+        Items being extracted can't be paused
+        """
+        for item in [self.items[x] for x in rows]:
+            if item.state == 'queued':
+                item.state = 'paused'
+            elif item.state == 'downloading':
+                item.abort = 'paused'
+            self.itemChanged(item)
+        self.updateSummary()
+
+    def resume(self, rows):
+        for item in [self.items[x] for x in rows]:
+            if item.state == 'paused' and item.thread is None:
+                item.state = 'queued'
+                self.itemChanged(item)
+        self.schedule()
+
+    def cancel(self, rows):
+        """
+        Cancel items at @rows that haven't been extracted yet
+        """
+        for item in [self.items[x] for x in rows]:
+            if item.state in ('queued', 'paused') and item.thread is None:
+                item.state = 'cancelled'
+            elif item.state == 'downloading':
+                item.abort = 'cancelled'
+            self.itemChanged(item)
+        self.updateSummary()
+
+    def retry(self, rows):
+        for item in [self.items[x] for x in rows]:
+            if item.state in ('failed', 'cancelled') and item.thread is None:
+                item.state = 'queued'
+                item.bytes = 0
+                self.itemChanged(item)
+        self.schedule()
+
+    def clearFinished(self):
+        self.beginResetModel()
+        self.items = [x for x in self.items if not x.finished() or x.thread is not None]
+        self.endResetModel()
+        self.updateSummary()
+
+    def stopAll(self):
+        """
+        Pause every item and wait for running installs to stop. Downloads stop
+        right away, but an extraction in progress is allowed to finish
+        """
+        threads = [x.thread for x in self.items if x.thread is not None]
+        for item in self.items:
+            item.abort = 'paused'
+            if item.state == 'queued':
+                item.state = 'paused'
+        for tthread in threads:
+            tthread.wait()
+
+    def updateSummary(self):
+        states = [x.state for x in self.items]
+        rate = sum([x.rate for x in self.items if x.state == 'downloading'])
+        msg = "%d installing, %d queued" % (states.count('downloading') + states.count('extracting'), states.count('queued'))
+        if states.count('failed'):
+            msg += ", %d failed" % (states.count('failed'))
+        if rate:
+            msg += " (%s)" % (fmtsize(rate, rate=True).strip())
+        self.summaryChanged.emit(msg)
 
-        return leftData < rightData
 
 def _gmain():
     """
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+# vim: set ts=4 sw=4 expandtab syntax=python:
+"""
+
+psvpack.installdb
+Per-uxroot install manifest, used to skip redundant extraction
+
+@author   Jacob Hipps <jacob@ycnrg.org>
+
+Copyright (c) 2018 J. Hipps / Neo-Retro Group, Inc.
+https://ycnrg.org/
+
+"""
+
+import os
+import json
+import struct
+import hashlib
+import logging
+import threading
+
+import arrow
+
+
+logger = logging.getLogger('psvpack')
+
+# manifest filename, stored in the root of each uxroot
+MANIFEST_NAME = '.psvpack_installed.json'
+
+
+def tree_fingerprint(path):
+    """
+    Compute a fingerprint of the tree at @path from the relative
+    path and size of every file. Only stat() is used, so this is fast
+    even for large titles, and stays stable when the tree is copied
+    """
+    flist = []
+    for tdir, _, tfiles in os.walk(path):
+        for tfile in tfiles:
+            fpath = os.path.join(tdir, tfile)
+            flist.append('%s\0%d' % (os.path.relpath(fpath, path), os.stat(fpath).st_size))
+    flist.sort()
+    return hashlib.sha1('\n'.join(flist).encode('utf-8', errors='surrogateescape')).hexdigest()
+
+def tree_stamp(path):
+    """
+    Compute a cheap stamp of the tree at @path from the mtime of @path and of
+    every directory below it, the size & mtime of its top-level files and its
+    param.sfo, if any. Used to spot changes to an installed title without
+    stat()ing all of its files. Adding, removing or replacing (renaming over)
+    a file changes the mtime of its directory; files modified in place deeper
+    in the tree are only caught by tree_fingerprint
+    """
+    slist = []
+    dstack = [path]
+    while dstack:
+        tdir = dstack.pop()
+        slist.append('%s/\0%d' % (os.path.relpath(tdir, path), os.stat(tdir).st_mtime_ns))
+        with os.scandir(tdir) as dents:
+            for dent in dents:
+                if dent.is_dir(follow_symlinks=False):
+                    dstack.append(dent.path)
+                elif tdir == path:
+                    st = dent.stat(follow_symlinks=False)
+                    slist.append('%s\0%d\0%d' % (dent.name, st.st_size, st.st_mtime_ns))
+    slist.sort()
+    try:
+        slist.append('%d' % (os.stat(os.path.join(path, 'sce_sys', 'param.sfo')).st_mtime_ns))
+    except OSError:
+        pass
+    return hashlib.sha1('\n'.join(slist).encode('utf-8', errors='surrogateescape')).hexdigest()
+
+def read_sfo(fpath):
+    """
+    Parse a param.sfo file, returning a dict of its keys & values
+    Returns None if the file is missing or invalid
+    """
+    try:
+        with open(fpath, 'rb') as f:
+            sfo = f.read()
+        magic, _, key_start, data_start, count = struct.unpack('<4sIIII', sfo[:20])
+        if magic != b'\0PSF':
+            return None
+        sdata = {}
+        for i in range(count):
+            key_off, fmt, dlen, _, data_off = struct.unpack('<HHIII', sfo[20 + i * 16:36 + i * 16])
+            kpos = key_start + key_off
+            key = sfo[kpos:sfo.index(b'\0', kpos)].decode('utf-8', errors='ignore')
+            dpos = data_start + data_off
+            if fmt == 0x0404:
+                sdata[key] = struct.unpack('<I', sfo[dpos:dpos + 4])[0]
+            else:
+                sdata[key] = sfo[dpos:dpos + dlen].rstrip(b'\0').decode('utf-8', errors='ignore')
+        return sdata
+    except Exception as e:
+        logger.debug("Failed to parse SFO file %s: %s", fpath, str(e))
+        return None
+
+
+class InstallDB(object):
+    """
+    Tracks which Content IDs have been extracted into a uxroot, keyed by
+    Content ID and recording the pkg SHA256, app version, and a stamp and
+    fingerprint of the extracted tree. Stored as JSON in the root of the uxroot
+    """
+    _lock = threading.Lock()
+
+    def __init__(self, uxroot):
+        self.uxroot = os.path.realpath(os.path.expanduser(uxroot))
+        self.filename = os.path.join(self.uxroot, MANIFEST_NAME)
+        self.items = {}
+        self.load()
+
+    def load(self):
+        """
+        Load manifest from disk
+        """
+        try:
+            with open(self.filename) as f:
+                self.items = json.load(f).get('items', {})
+        except FileNotFoundError:
+            self.items = {}
+        except Exception as e:
+            logger.warning("Failed to load install manifest %s: %s", self.filename, str(e))
+            self.items = {}
+
+    def save(self):
+        """
+        Write manifest to disk (atomically)
+        """
+        tmpname = self.filename + '.tmp'
+        try:
+            with open(tmpname, 'w') as f:
+                json.dump({'version': 1, 'items': self.items}, f, indent=1, sort_keys=True)
+            os.replace(tmpname, self.filename)
+            return True
+        except Exception as e:
+            logger.error("Failed to write install manifest %s: %s", self.filename, str(e))
+            return False
+
+    def record(self, tgame, glist, title_path):
+        """
+        Record successful installation of @tgame at @title_path
+        """
+        entry = {
+            'title_id': tgame['Title ID'],
+            'glist': glist,
+            'sha256': tgame.get('SHA256', ''),
+            'app_version': tgame.get('App Version', ''),
+            'path': os.path.relpath(os.path.realpath(title_path), self.uxroot),
+            'fingerprint': tree_fingerprint(title_path),
+            'stamp': tree_stamp(title_path),
+            'installed': arrow.now().isoformat(),
+        }
+        with self._lock:
+            self.load()
+            self.items[tgame['Content ID']] = entry
+            self.save()
+
+    def is_current(self, tgame, verify=False):
+        """
+        Check if @tgame is already installed with the same package, and its
+        extracted files are still intact. Returns the installed path if so,
+        otherwise None
+
+        The files are only walked & compared to the recorded fingerprint if
+        the tree's stamp has changed, or if @verify is True
+        """
+        entry = self.items.get(tgame['Content ID'])
+        if entry is None:
+            return None
+
+        if entry.get('sha256'):
+            if entry['sha256'] != tgame.get('SHA256'):
+                return None
+        elif not entry.get('app_version') or entry['app_version'] != tgame.get('App Version'):
+            return None
+
+        title_path = os.path.join(self.uxroot, entry['path'])
+        if not os.path.isdir(title_path):
+            return None
+        stamp = tree_stamp(title_path)
+        if stamp == entry.get('stamp') and not verify:
+            return title_path
+
+        if tree_fingerprint(title_path) != entry['fingerprint']:
+            logger.debug("Installed files for %s have changed since last install", tgame['Content ID'])
+            return None
+
+        # files are intact (eg. the tree was copied), so the walk can be skipped next time
+        if stamp != entry.get('stamp'):
+            with self._lock:
+                self.load()
+                if tgame['Content ID'] in self.items:
+                    self.items[tgame['Content ID']]['stamp'] = stamp
+                    self.save()
+        return title_path
+
+    def rebuild(self, catalogs=None):
+        """
+        Rebuild the manifest by scanning the app/ and addcont/ trees of the uxroot.
+        Content ID and version for apps are read from param.sfo. If @catalogs
+        (a dict of list name -> list of TSV rows) is given, it is used to resolve
+        DLC Content IDs and fill in the pkg SHA256 where the version matches
+        Returns the number of items found
+        """
+        catalogs = catalogs or {}
+        by_cid = {}
+        by_dlc = {}
+        for glist, rows in catalogs.items():
+            for trow in rows:
+                by_cid[trow['Content ID']] = (glist, trow)
+                if 'DLC' in glist:
+                    by_dlc[(trow['Title ID'], trow['Content ID'].split('-')[-1])] = (glist, trow)
+
+        old_by_path = {x['path']: (cid, x) for cid, x in self.items.items()}
+        items = {}
+        appdir = os.path.join(self.uxroot, 'app')
+        for title_id in sorted(os.listdir(appdir)) if os.path.isdir(appdir) else []:
+            title_path = os.path.join(appdir, title_id)
+            sfo = read_sfo(os.path.join(title_path, 'sce_sys', 'param.sfo'))
+            if not sfo or not sfo.get('CONTENT_ID'):
+                logger.debug("Skipping %s: no usable param.sfo", title_path)
+                continue
+            glist, trow = by_cid.get(sfo['CONTENT_ID'], ('PSV', {}))
+            app_ver = sfo.get('APP_VER', '')
+            items[sfo['CONTENT_ID']] = {
+                'title_id': title_id,
+                'glist': glist,
+                'sha256': trow.get('SHA256', '') if trow.get('App Version') == app_ver else '',
+                'app_version': app_ver,
+                'path': os.path.relpath(title_path, self.uxroot),
+                'fingerprint': tree_fingerprint(title_path),
+                'stamp': tree_stamp(title_path),
+                'installed': arrow.get(os.stat(title_path).st_mtime).isoformat(),
+            }
+
+        acdir = os.path.join(self.uxroot, 'addcont')
+        for title_id in sorted(os.listdir(acdir)) if os.path.isdir(acdir) else []:
+            if not os.path.isdir(os.path.join(acdir, title_id)):
+                continue
+            for dlc_id in sorted(os.listdir(os.path.join(acdir, title_id))):
+                title_path = os.path.join(acdir, title_id, dlc_id)
+                if (title_id, dlc_id) not in by_dlc:
+                    # keep the previous entry, if any, when the catalog can't resolve it
+                    relpath = os.path.relpath(title_path, self.uxroot)
+                    if relpath in old_by_path:
+                        items[old_by_path[relpath][0]] = old_by_path[relpath][1]
+                    else:
+                        logger.debug("Skipping %s: not found in DLC catalog", title_path)
+                    continue
+                glist, trow = by_dlc[(title_id, dlc_id)]
+                items[trow['Content ID']] = {
+                    'title_id': title_id,
+                    'glist': glist,
+                    'sha256': trow.get('SHA256', ''),
+                    'app_version': '',
+                    'path': os.path.relpath(title_path, self.uxroot),
+                    'fingerprint': tree_fingerprint(title_path),
+                    'stamp': tree_stamp(title_path),
+                    'installed': arrow.get(os.stat(title_path).st_mtime).isoformat(),
+                }
+
+        with self._lock:
+            self.items = items
+            self.save()
+        logger.info("Rebuilt install manifest for %s: %d items", self.uxroot, len(items))
+        return len(items)
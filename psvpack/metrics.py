@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# vim: set ts=4 sw=4 expandtab syntax=python:
+"""
+
+psvpack.metrics
+Performance counters & histograms, exported as Prometheus text or JSON
+
+@author   Jacob Hipps <jacob@ycnrg.org>
+
+Copyright (c) 2018 J. Hipps / Neo-Retro Group, Inc.
+https://ycnrg.org/
+
+"""
+
+import os
+import json
+import logging
+import threading
+from bisect import bisect_left
+from time import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+
+logger = logging.getLogger('psvpack')
+
+
+def _label_str(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(['%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels]) + '}'
+
+
+class Counter(object):
+    """
+    Monotonic counter, optionally split by labels
+    """
+    mtype = 'counter'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def prometheus(self):
+        with self.lock:
+            return ['%s%s %s' % (self.name, _label_str(k), v) for k, v in sorted(self.values.items())]
+
+    def snapshot(self):
+        with self.lock:
+            return [{'labels': dict(k), 'value': v} for k, v in sorted(self.values.items())]
+
+
+class Histogram(object):
+    """
+    Histogram of observed values over fixed upper-bound @buckets, optionally split by labels
+    """
+    mtype = 'histogram'
+
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = sorted(buckets)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            if key not in self.values:
+                self.values[key] = {'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0}
+            hval = self.values[key]
+            hval['counts'][bisect_left(self.buckets, value)] += 1
+            hval['sum'] += value
+            hval['count'] += 1
+
+    def prometheus(self):
+        lines = []
+        with self.lock:
+            for key, hval in sorted(self.values.items()):
+                cum = 0
+                for bound, count in zip(self.buckets + ['+Inf'], hval['counts']):
+                    cum += count
+                    lines.append('%s_bucket%s %d' % (self.name, _label_str(key + (('le', bound),)), cum))
+                lines.append('%s_sum%s %s' % (self.name, _label_str(key), hval['sum']))
+                lines.append('%s_count%s %d' % (self.name, _label_str(key), hval['count']))
+        return lines
+
+    def snapshot(self):
+        with self.lock:
+            return [{'labels': dict(k), 'buckets': dict(zip([str(x) for x in self.buckets] + ['+Inf'], v['counts'])),
+                     'sum': v['sum'], 'count': v['count']} for k, v in sorted(self.values.items())]
+
+
+class Registry(object):
+    """
+    Collection of all metrics of the process
+    """
+    def __init__(self):
+        self.metrics = []
+        self.started = time()
+
+    def counter(self, name, help):
+        tmetric = Counter(name, help)
+        self.metrics.append(tmetric)
+        return tmetric
+
+    def histogram(self, name, help, buckets):
+        tmetric = Histogram(name, help, buckets)
+        self.metrics.append(tmetric)
+        return tmetric
+
+    def prometheus(self):
+        """
+        Return all metrics in Prometheus text exposition format
+        """
+        lines = []
+        for tmetric in self.metrics:
+            lines.append('# HELP %s %s' % (tmetric.name, tmetric.help))
+            lines.append('# TYPE %s %s' % (tmetric.name, tmetric.mtype))
+            lines += tmetric.prometheus()
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        """
+        Return dict snapshot of all metrics. Unlike the Prometheus format,
+        histogram bucket counts are per-bucket rather than cumulative
+        """
+        return {'started': self.started, 'time': time(),
+                'metrics': dict([(x.name, {'type': x.mtype, 'help': x.help, 'values': x.snapshot()}) for x in self.metrics])}
+
+    def write(self, fpath):
+        """
+        Write metrics to @fpath (atomically). JSON if @fpath ends with .json,
+        otherwise Prometheus text format (eg. for node_exporter's textfile collector)
+        """
+        fpath = os.path.expanduser(fpath)
+        try:
+            with open(fpath + '.tmp', 'w') as f:
+                if fpath.endswith('.json'):
+                    json.dump(self.snapshot(), f, indent=1)
+                else:
+                    f.write(self.prometheus())
+            os.replace(fpath + '.tmp', fpath)
+            logger.debug("Wrote metrics to %s", fpath)
+            return True
+        except Exception as e:
+            logger.error("Failed to write metrics to %s: %s", fpath, str(e))
+            return False
+
+    def serve(self, host='127.0.0.1', port=9180):
+        """
+        Serve metrics over HTTP from a background thread, for the lifetime of
+        the process: /metrics in Prometheus format, /metrics.json as JSON
+        Returns the HTTPServer, or None if it could not be started
+        """
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.startswith('/metrics.json'):
+                    body, ctype = json.dumps(registry.snapshot()).encode('utf-8'), 'application/json'
+                elif self.path.startswith('/metrics'):
+                    body, ctype = registry.prometheus().encode('utf-8'), 'text/plain; version=0.0.4'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', ctype)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        try:
+            server = HTTPServer((host, port), MetricsHandler)
+        except Exception as e:
+            logger.error("Failed to start metrics server on %s:%d: %s", host, port, str(e))
+            return None
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        logger.info("Serving metrics on http://%s:%d/metrics", host, port)
+        return server
+
+    def listen(self, address):
+        """
+        Serve metrics (see serve) at @address, given as HOST:PORT
+        Returns the HTTPServer, or None if it could not be started
+        """
+        host, _, port = address.rpartition(':')
+        try:
+            port = int(port)
+        except ValueError:
+            logger.error("Invalid metrics listen address '%s'. Expected HOST:PORT", address)
+            return None
+        return self.serve(host or '127.0.0.1', port)
+
+
+# process-wide registry
+registry = Registry()
+
+TSV_REFRESH = registry.counter('psvpack_tsv_refresh_total', "TSV refreshes, by list and result (full, not_modified, failed)")
+PKG_CACHE = registry.counter('psvpack_pkg_cache_lookups_total', "Package cache lookups, by result (hit, miss)")
+DOWNLOAD_BYTES = registry.counter('psvpack_download_bytes_total', "Bytes downloaded")
+DOWNLOADS = registry.counter('psvpack_downloads_total', "Package downloads, by result (ok, cancelled, failed)")
+DOWNLOAD_RATE = registry.histogram('psvpack_download_throughput_bytes_per_second', "Throughput of each package download",
+                                   [2 ** x for x in range(16, 31, 2)])
+DOWNLOAD_TTFB = registry.histogram('psvpack_download_ttfb_seconds', "Time to first byte of each package download",
+                                   [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10])
+HASH_TIME = registry.histogram('psvpack_hash_seconds', "Duration of package checksum verification",
+                               [0.1, 0.5, 1, 5, 10, 30, 60, 300])
+EXTRACT_TIME = registry.histogram('psvpack_extract_seconds', "Duration of package extraction, including staged copy",
+                                  [1, 5, 10, 30, 60, 120, 300, 600, 1800])
+INSTALLS = registry.counter('psvpack_installs_total', "Install items, by result (installed, skipped, downloaded, deferred, cancelled, failed)")
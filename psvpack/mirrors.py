@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# vim: set ts=4 sw=4 expandtab syntax=python:
+"""
+
+psvpack.mirrors
+Mirror rewrite rules, ranking & probing
+
+@author   Jacob Hipps <jacob@ycnrg.org>
+
+Copyright (c) 2018 J. Hipps / Neo-Retro Group, Inc.
+https://ycnrg.org/
+
+"""
+
+import os
+import json
+import logging
+from time import time
+from urllib.parse import urlsplit, urlunsplit
+
+import requests
+
+from psvpack import default_config
+from psvpack.util import FileLock, fmtsize
+
+
+logger = logging.getLogger('psvpack')
+
+# number of bytes fetched when probing a mirror's throughput
+PROBE_BYTES = 256 * 1024
+
+
+def url_host(url):
+    """
+    Return host (netloc) part of @url
+    """
+    return urlsplit(url).netloc.lower()
+
+
+class MirrorManager(object):
+    """
+    Expands download URLs into a ranked list of mirror candidates
+
+    Rewrite rules come from the `mirrors` config section. Each rule is either
+    a `host` rule, which swaps the host of matching URLs for each of its
+    `mirrors`, or a `prefix` rule, which swaps a URL prefix:
+
+        mirrors:
+          rules:
+            - host: zeus.dl.playstation.net
+              mirrors: [mirror1.example.com, mirror2.example.com]
+            - prefix: http://example.com/pkgs/
+              mirrors: [http://backup.example.org/psv/]
+          tsv_urls:
+            PSV: [http://alt.example.com/PSV_GAMES.tsv]
+
+    Hosts are ranked by measured throughput, from a small ranged probe
+    (re-run every `probe_interval` seconds) and from observed downloads.
+    Hosts that failed recently are tried last. Stats persist in
+    cache_dir/mirrors.json between runs
+    """
+    def __init__(self, config):
+        mconf = dict(default_config['mirrors'])
+        mconf.update(config.get('mirrors') or {})
+        self.rules = mconf['rules'] or []
+        self.tsv_urls = mconf['tsv_urls'] or {}
+        self.probe_interval = int(mconf['probe_interval'])
+        self.stall_rate = int(mconf['stall_rate'])
+        self.stall_time = float(mconf['stall_time'])
+        self.statfile = os.path.join(os.path.expanduser(config['cache_dir']), 'mirrors.json')
+        self.stats = self.load_stats()
+
+    def load_stats(self):
+        """
+        Load persisted host stats
+        """
+        try:
+            with open(self.statfile) as f:
+                return json.load(f)
+        except Exception:
+            return {}
+
+    def _update_host(self, host, **kwargs):
+        """
+        Merge @kwargs into persisted stats for @host
+        """
+        try:
+            with FileLock(self.statfile + '.lock'):
+                self.stats = self.load_stats()
+                self.stats.setdefault(host, {}).update(kwargs)
+                with open(self.statfile + '.tmp', 'w') as f:
+                    json.dump(self.stats, f, indent=1)
+                os.replace(self.statfile + '.tmp', self.statfile)
+        except Exception as e:
+            logger.debug("Failed to write mirror stats: %s", str(e))
+
+    def rewrite(self, url):
+        """
+        Return list of all candidate URLs for @url (including @url itself),
+        in rule order
+        """
+        urls = [url]
+        parts = urlsplit(url)
+        for trule in self.rules:
+            if trule.get('host') and parts.netloc.lower() == trule['host'].lower():
+                urls += [urlunsplit(parts._replace(netloc=x)) for x in trule.get('mirrors') or []]
+            elif trule.get('prefix') and url.startswith(trule['prefix']):
+                urls += [x + url[len(trule['prefix']):] for x in trule.get('mirrors') or []]
+        return list(dict.fromkeys(urls))
+
+    def score(self, url):
+        """
+        Ranking score for @url's host; higher is better
+        """
+        hstats = self.stats.get(url_host(url), {})
+        if time() - hstats.get('last_failure', 0) < self.probe_interval:
+            return -1.0
+        return hstats.get('throughput', 0.0)
+
+    def probe(self, url):
+        """
+        Measure time-to-first-byte and throughput of @url with a small ranged request
+        Returns measured throughput (bytes/sec), or None on failure
+        """
+        host = url_host(url)
+        try:
+            stime = time()
+            r = requests.get(url, stream=True, headers={'Range': 'bytes=0-%d' % (PROBE_BYTES - 1)},
+                             timeout=(10, self.stall_time))
+            r.raise_for_status()
+            latency = time() - stime
+            rlen = len(r.raw.read(PROBE_BYTES))
+            r.close()
+            elapsed = max(time() - stime, 0.001)
+        except Exception as e:
+            logger.info("Mirror probe of %s failed: %s", host, str(e))
+            self.record_failure(url, probed=time())
+            return None
+
+        throughput = rlen / elapsed
+        logger.debug("Probed %s: latency %.0fms, throughput %s", host, latency * 1000, fmtsize(throughput, rate=True))
+        self._update_host(host, latency=latency, throughput=throughput, probed=time())
+        return throughput
+
+    def candidates(self, url):
+        """
+        Return ranked list of candidate URLs for @url. Hosts whose stats are
+        older than `probe_interval` are probed first, if there is more than one.
+        Hosts that failed within `probe_interval` are not probed again until then
+        """
+        urls = self.rewrite(url)
+        if len(urls) > 1:
+            for turl in urls:
+                hstats = self.stats.get(url_host(turl), {})
+                if time() - max(hstats.get('probed', 0), hstats.get('last_failure', 0)) >= self.probe_interval:
+                    self.probe(turl)
+        # stable sort, so hosts with no data keep rule order
+        return sorted(urls, key=self.score, reverse=True)
+
+    def tsv_candidates(self, tsvname, url):
+        """
+        Return ranked list of candidate URLs for TSV @tsvname, including
+        configured alternates
+        """
+        alts = self.tsv_urls.get(tsvname.upper()) or []
+        urls = list(dict.fromkeys([url] + list(alts)))
+        return sorted(urls, key=self.score, reverse=True)
+
+    def record_success(self, url, nbytes, elapsed):
+        """
+        Update @url's host throughput from an observed transfer (moving average)
+        """
+        if elapsed <= 0 or nbytes <= 0:
+            return
+        host = url_host(url)
+        observed = nbytes / elapsed
+        prev = self.stats.get(host, {}).get('throughput')
+        self._update_host(host, throughput=observed if prev is None else 0.7 * prev + 0.3 * observed,
+                          last_failure=0)
+
+    def record_failure(self, url, **kwargs):
+        """
+        Mark @url's host as having failed recently, merging in any other @kwargs stats
+        """
+        host = url_host(url)
+        self._update_host(host, last_failure=time(), failures=self.stats.get(host, {}).get('failures', 0) + 1, **kwargs)
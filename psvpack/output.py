@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# vim: set ts=4 sw=4 expandtab syntax=python:
+"""
+
+psvpack.output
+Machine-readable output formats
+
+@author   Jacob Hipps <jacob@ycnrg.org>
+
+Copyright (c) 2018 J. Hipps / Neo-Retro Group, Inc.
+https://ycnrg.org/
+
+"""
+
+import sys
+import csv
+import json
+import threading
+
+
+# `text` is the default, human-readable output
+FORMATS = ['text', 'json', 'ndjson', 'tsv']
+
+
+def parse_fields(fields):
+    """
+    Parse comma-separated field list @fields. Returns None if empty
+    """
+    flist = [x.strip() for x in (fields or '').split(',') if x.strip()]
+    return flist or None
+
+def project(row, fields=None):
+    """
+    Return dict of @fields (all, if None) from @row, in order
+    Fields missing from @row are None
+    """
+    if fields is None:
+        return row
+    return dict([(x, row.get(x)) for x in fields])
+
+def job_row(job):
+    """
+    Return flat result row for pipeline @job (see pipeline.make_job)
+    """
+    return {
+        'content_id': job['tgame']['Content ID'],
+        'title_id': job['tgame']['Title ID'],
+        'glist': job['glist'],
+        'uxroot': job['uxroot'],
+        'status': job['status'],
+        'path': job['path'],
+        'fetch_time': round(job['fetch_time'], 3),
+        'extract_time': round(job['extract_time'], 3),
+    }
+
+def write_results(result, fmt, fields=None, stream=None):
+    """
+    Write each job of pipeline @result (see InstallPipeline.run_jobs) as a row
+    in format @fmt, followed by any `unresolved` IDs (status `notfound`). For
+    ndjson, rows are `result` events, followed by a `summary` event with the
+    success and failure counts
+    """
+    rows = [job_row(x) for x in result['jobs']]
+    for glist, tid in result.get('unresolved') or []:
+        rows.append({'content_id': tid, 'title_id': None, 'glist': glist, 'uxroot': None, 'status': 'notfound',
+                     'path': None, 'fetch_time': 0.0, 'extract_time': 0.0})
+
+    if fmt == 'ndjson':
+        writer = EventWriter(stream)
+        for trow in rows:
+            writer(dict(type='result', **project(trow, fields)))
+        writer({'type': 'summary', 'success': result['success'], 'failed': result['failed']})
+    else:
+        writer = RowWriter(fmt, fields, stream)
+        for trow in rows:
+            writer.write(trow)
+        writer.close()
+
+
+class RowWriter(object):
+    """
+    Writes rows (dicts) to @stream in format @fmt (json, ndjson or tsv) as they
+    are produced, limited to @fields if given. Output is flushed after each row,
+    so consumers can start on the first row immediately. JSON output is a single
+    array, which is completed by close()
+    """
+    def __init__(self, fmt, fields=None, stream=None):
+        if fmt not in FORMATS[1:]:
+            raise ValueError("unsupported output format: %s" % (fmt))
+        self.fmt = fmt
+        self.fields = fields
+        self.stream = stream or sys.stdout
+        self.count = 0
+        self.tsv = None
+
+    def write(self, row):
+        row = project(row, self.fields)
+        if self.fmt == 'ndjson':
+            self.stream.write(json.dumps(row) + '\n')
+        elif self.fmt == 'json':
+            self.stream.write(('[\n' if not self.count else ',\n') + json.dumps(row))
+        else:
+            if self.tsv is None:
+                self.tsv = csv.writer(self.stream, dialect='excel-tab', lineterminator='\n')
+                self.tsv.writerow(self.fields or list(row.keys()))
+            self.tsv.writerow(['' if x is None else x for x in row.values()])
+        self.count += 1
+        self.stream.flush()
+
+    def close(self):
+        if self.fmt == 'json':
+            self.stream.write('\n]\n' if self.count else '[]\n')
+        elif self.fmt == 'tsv' and self.tsv is None and self.fields:
+            # header only, so the output is still a valid (empty) table
+            csv.writer(self.stream, dialect='excel-tab', lineterminator='\n').writerow(self.fields)
+        self.stream.flush()
+
+
+class EventWriter(object):
+    """
+    Writes progress events (see pipeline.make_event) to @stream as NDJSON
+    Safe to call from several threads; download progress is limited to one
+    event per @interval seconds per item
+    """
+    def __init__(self, stream=None, interval=1.0):
+        self.stream = stream or sys.stdout
+        self.interval = interval
+        self.last_progress = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, event):
+        with self.lock:
+            if event['type'] == 'fetch_progress':
+                if event['time'] - self.last_progress.get(event['content_id'], 0) < self.interval:
+                    return
+                self.last_progress[event['content_id']] = event['time']
+            self.stream.write(json.dumps(event) + '\n')
+            self.stream.flush()
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+# vim: set ts=4 sw=4 expandtab syntax=python:
+"""
+
+psvpack.pipeline
+Pipelined download & extraction executor
+
+@author   Jacob Hipps <jacob@ycnrg.org>
+
+Copyright (c) 2018 J. Hipps / Neo-Retro Group, Inc.
+https://ycnrg.org/
+
+"""
+
+import os
+import logging
+import threading
+from queue import Queue
+from time import time
+
+from psvpack import default_config
+from psvpack import metrics
+from psvpack import psfree
+from psvpack.cache import PkgCache
+from psvpack.installdb import InstallDB
+from psvpack.util import LogProgress
+
+
+logger = logging.getLogger('psvpack')
+
+
+class ExtractPool(object):
+    """
+    Bounds the number of concurrent pkg2zip processes. At most @workers
+    extractions run at once overall (0 = one per CPU), and no more than
+    @per_device of them write to the same destination device at once.
+    A single pool can be shared by several pipelines
+    """
+    def __init__(self, workers=None, per_device=None):
+        self.workers = int(workers or default_config['pipeline']['extract_workers']) or os.cpu_count() or 1
+        self.per_device = max(1, int(per_device or default_config['pipeline']['extract_per_device']))
+        self.slots = threading.BoundedSemaphore(self.workers)
+        self.devsems = {}
+        self.devlock = threading.Lock()
+
+    def _device_slot(self, uxroot):
+        """
+        Return the semaphore for the device that @uxroot resides on
+        """
+        try:
+            devid = os.stat(uxroot).st_dev
+        except OSError:
+            devid = os.path.realpath(uxroot)
+        with self.devlock:
+            if devid not in self.devsems:
+                self.devsems[devid] = threading.BoundedSemaphore(self.per_device)
+            return self.devsems[devid]
+
+    def extract(self, tgame, local_path, config, glist="PSV", uxroot="./"):
+        """
+        Extract @local_path into @uxroot, blocking until a slot is
+        available on the destination device
+        """
+        with self._device_slot(uxroot), self.slots:
+            return psfree.extract_game(tgame, local_path, config, glist, uxroot)
+
+
+def make_job(tgame, glist="PSV", uxroot="./"):
+    """
+    Create a pipeline job for installing @tgame from list @glist into @uxroot
+    Once run, `status` is one of installed, skipped (already installed),
+    downloaded (not installed), deferred (not started), cancelled (download
+    aborted by the progress callback) or failed, and `path` is the resulting path
+    """
+    return {'tgame': tgame, 'glist': glist, 'uxroot': uxroot, 'status': 'pending', 'path': None,
+            'fetch_time': 0.0, 'extract_time': 0.0}
+
+
+def make_event(etype, job, **kwargs):
+    """
+    Create a progress event of type @etype for @job. Events are dicts with
+    `type`, `time`, `content_id`, `glist` and `uxroot`, plus @kwargs:
+
+    * fetch_start     - download (or cache lookup) started
+    * fetch_progress  - `bytes` received so far, of `total`
+    * fetch_done      - `path` of the local pkg file
+    * extract_start   - pkg2zip started
+    * extract_done    - `path` of the installed title
+    * skipped         - already installed at `path`
+    * deferred        - not started (eg. prefetch budget exhausted)
+    * cancelled       - download aborted; `reason` is the DownloadCancelled message
+    * failed          - `error` describes the failure
+    """
+    event = {'type': etype, 'time': time(), 'content_id': job['tgame']['Content ID'],
+             'glist': job['glist'], 'uxroot': job['uxroot']}
+    event.update(kwargs)
+    return event
+
+
+class InstallPipeline(object):
+    """
+    Runs the download and extraction stages of a multi-item install
+    concurrently. Downloaded items are handed off to the extract stage through
+    a bounded queue, so that extraction of item N overlaps with the download
+    of item N+1 (and beyond, up to @queue_depth items ahead). Items are started
+    in the order given
+
+    Items already installed in their uxroot with the same package are skipped,
+    unless @force is True. If @verify is True, all files of installed items
+    are checked first (see InstallDB.is_current)
+
+    Stage concurrency defaults to the `pipeline` section of the config.
+    An ExtractPool may be passed as @expool to share extraction limits
+    between pipelines. If @admit is given, it is called as admit(job) before
+    each download starts; jobs for which it returns False are marked `deferred`
+    If @on_event is given, it is called with each progress event (see make_event),
+    from the worker threads. It may raise psfree.DownloadCancelled on a
+    fetch_progress event to abort that download
+    """
+    def __init__(self, config, glist="PSV", uxroot="./", install=True, noverify=False,
+                 download_workers=None, extract_workers=None, queue_depth=None, expool=None, force=False, admit=None,
+                 on_event=None, verify=False):
+        self.config = config
+        self.glist = glist
+        self.uxroot = uxroot
+        self.install = install
+        self.noverify = noverify
+        self.force = force
+        self.verify = verify
+        self.admit = admit
+        self.on_event = on_event
+
+        pconf = dict(default_config['pipeline'])
+        pconf.update(config.get('pipeline') or {})
+        self.download_workers = max(1, int(download_workers or pconf['download_workers']))
+        self.queue_depth = max(1, int(queue_depth or pconf['queue_depth']))
+        self.expool = expool or ExtractPool(extract_workers or pconf['extract_workers'], pconf['extract_per_device'])
+
+        self.idbs = {}
+        self.rlock = threading.Lock()
+
+    def _emit(self, etype, job, **kwargs):
+        if self.on_event is not None:
+            self.on_event(make_event(etype, job, **kwargs))
+
+    def _progress(self, job):
+        """
+        Return download progress callback for @job
+        """
+        if self.on_event is not None:
+            return lambda curbyte, total: self._emit('fetch_progress', job, bytes=curbyte, total=total)
+        # console progressbars would overwrite each other with concurrent downloads
+        return LogProgress(job['tgame']['Content ID']) if self.download_workers > 1 else None
+
+    def _installed_path(self, job):
+        """
+        Return path of @job's title if it is already installed & current
+        """
+        if not self.install or self.force:
+            return None
+        with self.rlock:
+            if job['uxroot'] not in self.idbs:
+                self.idbs[job['uxroot']] = InstallDB(job['uxroot'])
+            idb = self.idbs[job['uxroot']]
+        return idb.is_current(job['tgame'], self.verify)
+
+    def _fail(self, job, error):
+        """
+        Mark @job as failed and emit its failed event. Errors raised by the
+        event callback are logged, so that the calling worker keeps running
+        """
+        job['status'] = 'failed'
+        try:
+            self._emit('failed', job, error=error)
+        except Exception as e:
+            logger.error("Error in event callback for %s: %s", job['tgame']['Content ID'], str(e))
+
+    def _download_worker(self, dlq, exq):
+        while True:
+            job = dlq.get()
+            if job is None:
+                break
+            try:
+                self._download_job(job, exq)
+            except Exception as e:
+                logger.error("Unhandled error while fetching %s: %s", job['tgame']['Content ID'], str(e))
+                self._fail(job, str(e))
+
+    def _download_job(self, job, exq):
+        tgame = job['tgame']
+        logger.info(">>> Installing %s: %s", job['glist'], tgame['Content ID'])
+        title_path = self._installed_path(job)
+        if title_path:
+            logger.info("%s is already installed and up to date --> %s", tgame['Content ID'], title_path)
+            job.update(status='skipped', path=title_path)
+            self._emit('skipped', job, path=title_path)
+            return
+
+        if self.admit is not None and not self.admit(job):
+            job['status'] = 'deferred'
+            self._emit('deferred', job)
+            return
+
+        # keep the package from being evicted from the cache until it has been extracted
+        pin = PkgCache(self.config).pin(tgame) if self.install else None
+        if pin is not None:
+            pin.acquire()
+        try:
+            self._emit('fetch_start', job)
+            stime = time()
+            try:
+                local_path = psfree.fetch_pkg(tgame, self.config, self.noverify, self._progress(job))
+            except psfree.DownloadCancelled as e:
+                job.update(status='cancelled', fetch_time=time() - stime)
+                self._emit('cancelled', job, reason=str(e))
+                return
+            except Exception as e:
+                logger.error("Unhandled error while fetching %s: %s", tgame['Content ID'], str(e))
+                local_path = None
+            job['fetch_time'] = time() - stime
+
+            if local_path is None:
+                self._fail(job, "download failed")
+                return
+            self._emit('fetch_done', job, path=local_path)
+
+            if not self.install:
+                logger.info("Skipping installation step. Run 'install' again to extract pkg")
+                job.update(status='downloaded', path=local_path)
+            else:
+                # blocks when the extract stage is queue_depth items behind
+                exq.put((job, local_path, pin))
+                pin = None
+        finally:
+            if pin is not None:
+                pin.release()
+
+    def _extract_worker(self, exq):
+        while True:
+            qitem = exq.get()
+            if qitem is None:
+                break
+            job, local_path, pin = qitem
+            try:
+                self._extract_job(job, local_path)
+            except Exception as e:
+                logger.error("Unhandled error while extracting %s: %s", job['tgame']['Content ID'], str(e))
+                self._fail(job, str(e))
+            finally:
+                pin.release()
+
+    def _extract_job(self, job, local_path):
+        self._emit('extract_start', job)
+        stime = time()
+        try:
+            title_path = self.expool.extract(job['tgame'], local_path, self.config, job['glist'], job['uxroot'])
+        except Exception as e:
+            logger.error("Unhandled error while extracting %s: %s", job['tgame']['Content ID'], str(e))
+            title_path = None
+        job['extract_time'] = time() - stime
+        if title_path:
+            job.update(status='installed', path=title_path)
+            self._emit('extract_done', job, path=title_path)
+        else:
+            job['path'] = None
+            self._fail(job, "extraction failed")
+
+    def run(self, items):
+        """
+        Download (and optionally extract) all @items into the pipeline's uxroot
+        Returns a dict with `success` and `failed` counts, and `results`
+        mapping each Content ID to its installed path (or None if failed)
+        """
+        return self.run_jobs([make_job(x, self.glist, self.uxroot) for x in items])
+
+    def run_jobs(self, jobs):
+        """
+        Run all @jobs (see make_job), each of which may target a different
+        list and uxroot. Jobs are updated in place with their status & timings.
+        Returns a dict with `success` and `failed` counts, `results` mapping each
+        Content ID to its resulting path (or None if failed), and `jobs`
+        """
+        dlq = Queue()
+        exq = Queue(maxsize=self.queue_depth)
+
+        for job in jobs:
+            dlq.put(job)
+
+        dl_threads = [threading.Thread(target=self._download_worker, args=(dlq, exq), daemon=True)
+                      for _ in range(min(self.download_workers, len(jobs)) or 1)]
+        ex_threads = [threading.Thread(target=self._extract_worker, args=(exq,), daemon=True)
+                      for _ in range(min(self.expool.workers, len(jobs)) if self.install else 0)]
+
+        logger.debug("Starting pipeline: %d items, %d download / %d extract workers, queue depth %d",
+                     len(jobs), len(dl_threads), len(ex_threads), self.queue_depth)
+        for tt in dl_threads + ex_threads:
+            tt.start()
+
+        # shut down each stage once the previous one has drained
+        for _ in dl_threads:
+            dlq.put(None)
+        for tt in dl_threads:
+            tt.join()
+        for _ in ex_threads:
+            exq.put(None)
+        for tt in ex_threads:
+            tt.join()
+
+        for job in jobs:
+            metrics.INSTALLS.inc(result=job['status'])
+
+        success = len([x for x in jobs if x['status'] in ('installed', 'downloaded', 'skipped')])
+        return {'success': success, 'failed': len(jobs) - success, 'jobs': jobs,
+                'results': dict([(x['tgame']['Content ID'], x['path']) for x in jobs])}
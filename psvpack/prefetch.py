@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# vim: set ts=4 sw=4 expandtab syntax=python:
+"""
+
+psvpack.prefetch
+Bulk cache warming for off-peak downloads
+
+@author   Jacob Hipps <jacob@ycnrg.org>
+
+Copyright (c) 2018 J. Hipps / Neo-Retro Group, Inc.
+https://ycnrg.org/
+
+"""
+
+import logging
+import threading
+from time import time
+
+import arrow
+
+from psvpack import psfree
+from psvpack.batch import job_size, print_report
+from psvpack.cache import PkgCache
+from psvpack.pipeline import InstallPipeline, make_job
+from psvpack.util import fmtsize, parse_size, parse_window, in_window
+
+
+logger = logging.getLogger('psvpack')
+
+
+class PrefetchBudget(object):
+    """
+    Admission control for prefetch downloads. Once @max_bytes (0 = unlimited)
+    of downloads have been started, or the current time leaves @window, no
+    further downloads are started. Already-cached packages are always admitted
+    """
+    def __init__(self, pcache, max_bytes=0, window=None):
+        self.pcache = pcache
+        self.max_bytes = max_bytes
+        self.window = window
+        self.used = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, job):
+        if self.pcache.is_cached(job['tgame']):
+            return True
+        if self.window and not in_window(self.window):
+            logger.info("Download window has ended. Deferring %s", job['tgame']['Content ID'])
+            return False
+        size = job_size(job)
+        with self.lock:
+            if self.max_bytes and self.used + size > self.max_bytes:
+                logger.info("Byte budget exhausted. Deferring %s (%s)", job['tgame']['Content ID'], fmtsize(size).strip())
+                return False
+            self.used += size
+        return True
+
+def find_items(tsv, query, regions, since=None):
+    """
+    Return catalog entries in @tsv matching search @query and @regions that
+    have a download link. If @since (days) is given, only entries updated
+    within that many days are returned
+    """
+    results = [x for x in tsv.search(query, regions) if x['PKG direct link'] != "MISSING"]
+    if since:
+        cutoff = arrow.now().shift(days=-since).format('YYYY-MM-DD HH:mm:ss')
+        results = [x for x in results if x.get('Last Modification Date', '') >= cutoff]
+    return results
+
+def prefetch(query, config, glist="PSV", regions=['US', 'JP'], since=None, max_bytes=0, window=None,
+             jobs=None, noverify=False):
+    """
+    Download (without extracting) all packages in @glist matching @query into the
+    pkg cache. Packages that are already cached and verified are skipped, and
+    interrupted downloads are resumed, so an interrupted prefetch can simply be re-run
+    @since = only fetch items updated within this many days
+    @max_bytes = stop starting new downloads after this many bytes (0 = unlimited)
+    @window = only download during this local time window (`HH:MM-HH:MM`)
+    @jobs = number of concurrent downloads (default: pipeline.download_workers)
+    Returns pipeline result dict (see InstallPipeline.run_jobs), or None on error
+    """
+    pwindow = None
+    if window:
+        pwindow = parse_window(window)
+        if pwindow is None:
+            logger.error("Invalid download window '%s'. Expected HH:MM-HH:MM", window)
+            return None
+        if not in_window(pwindow):
+            logger.warning("Current time is outside of the download window (%s). Nothing to do.", window)
+            return None
+
+    tsv = psfree.TSVManager(glist, config)
+    if not tsv.loaded:
+        return None
+
+    items = find_items(tsv, query, regions, since)
+    pcache = PkgCache(config)
+    pjobs = [make_job(x, glist) for x in items]
+    logger.info("%d %s items match. %d already cached.", len(pjobs), glist,
+                len([x for x in pjobs if pcache.is_cached(x['tgame'])]))
+
+    stime = time()
+    pipe = InstallPipeline(config, glist, install=False, noverify=noverify, download_workers=jobs,
+                           admit=PrefetchBudget(pcache, max_bytes, pwindow))
+    pres = pipe.run_jobs(pjobs)
+
+    print_report(pjobs, [], time() - stime)
+    return pres
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# vim: set ts=4 sw=4 expandtab syntax=python:
+"""
+
+psvpack.profiler
+Lightweight hierarchical phase timing (--profile)
+
+@author   Jacob Hipps <jacob@ycnrg.org>
+
+Copyright (c) 2018 J. Hipps / Neo-Retro Group, Inc.
+https://ycnrg.org/
+
+"""
+
+import sys
+import logging
+import threading
+from functools import wraps
+from time import perf_counter
+
+
+logger = logging.getLogger('psvpack')
+
+
+class NullSpan(object):
+    """
+    Span used while profiling is disabled; does nothing
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def add_bytes(self, nbytes):
+        pass
+
+NULL_SPAN = NullSpan()
+
+
+class Span(object):
+    """
+    Times one execution of phase @name, nested under the phase (if any)
+    that is active in the current thread. Use as a context manager
+    """
+    def __init__(self, profiler, name, nbytes=0):
+        self.profiler = profiler
+        self.name = name
+        self.nbytes = nbytes
+        self.path = None
+        self.stime = 0.0
+        self.cprof = False
+
+    def __enter__(self):
+        stack = self.profiler.stack()
+        self.path = (stack[-1].path if stack else ()) + (self.name,)
+        stack.append(self)
+        self.cprof = self.profiler.cprofile_start(self.name)
+        self.stime = perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        elapsed = perf_counter() - self.stime
+        if self.cprof:
+            self.profiler.cprofile_stop()
+        self.profiler.stack().pop()
+        self.profiler.record(self.path, elapsed, self.nbytes)
+        return False
+
+    def add_bytes(self, nbytes):
+        """
+        Add @nbytes to the amount of data moved by this phase
+        """
+        self.nbytes += nbytes
+
+
+class Profiler(object):
+    """
+    Collects wall time, call counts and bytes moved per phase. Phases are
+    aggregated by their path in the phase tree, so repeated calls (eg. one
+    download per item) are summed. Phases started in worker threads appear
+    at the top level of the tree. Spans cost almost nothing while disabled
+
+    If @cprofile_phase is given when enabling, the first thread to enter a
+    phase of that name runs it under cProfile, and the combined profile of
+    every such run is written to @cprofile_path by finish()
+    """
+    def __init__(self):
+        self.enabled = False
+        self.stats = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.cprofile_phase = None
+        self.cprofile_path = None
+        self.cprofiler = None
+        self.cprofile_active = False
+
+    def enable(self, cprofile_phase=None, cprofile_path=None):
+        self.enabled = True
+        if cprofile_phase and cprofile_path:
+            import cProfile
+            self.cprofile_phase = cprofile_phase
+            self.cprofile_path = cprofile_path
+            self.cprofiler = cProfile.Profile()
+
+    def span(self, name, nbytes=0):
+        """
+        Return a Span for phase @name, or a no-op span if disabled
+        """
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, nbytes)
+
+    def stack(self):
+        """
+        Return the stack of active spans for the current thread
+        """
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    def record(self, path, elapsed, nbytes):
+        with self.lock:
+            tstat = self.stats.setdefault(path, [0, 0.0, 0])
+            tstat[0] += 1
+            tstat[1] += elapsed
+            tstat[2] += nbytes
+
+    def cprofile_start(self, name):
+        """
+        Start cProfile if @name is the profiled phase, and it is not already
+        running in another thread. Returns True if started
+        """
+        if self.cprofiler is None or name != self.cprofile_phase:
+            return False
+        with self.lock:
+            if self.cprofile_active:
+                return False
+            self.cprofile_active = True
+        self.cprofiler.enable()
+        return True
+
+    def cprofile_stop(self):
+        self.cprofiler.disable()
+        with self.lock:
+            self.cprofile_active = False
+
+    def report(self, stream=None):
+        """
+        Print phase breakdown tree to @stream (default: stderr)
+        Times of phases that ran concurrently overlap, so may add up to more than their parent
+        """
+        from psvpack.util import fmtsize
+
+        stream = stream or sys.stderr
+        with self.lock:
+            stats = sorted(self.stats.items())
+        stream.write('{:40} {:>6} {:>10} {:>10} {:>14}\n'.format("Phase", "Calls", "Wall", "Bytes", "Throughput"))
+        stream.write('=' * 84 + '\n')
+        for path, (count, wall, nbytes) in stats:
+            name = '  ' * (len(path) - 1) + path[-1]
+            if nbytes:
+                sbytes = fmtsize(nbytes).strip()
+                srate = fmtsize(nbytes / wall, rate=True).strip() if wall > 0 else '-'
+            else:
+                sbytes = srate = ''
+            stream.write('{:40} {:>6} {:>9.3f}s {:>10} {:>14}\n'.format(name, count, wall, sbytes, srate))
+        stream.flush()
+
+    def finish(self):
+        """
+        Print the report and write the cProfile dump, if enabled
+        """
+        if not self.enabled:
+            return
+        self.report()
+        if self.cprofiler is not None:
+            try:
+                self.cprofiler.dump_stats(self.cprofile_path)
+                logger.info("Wrote cProfile data for phase '%s' to %s", self.cprofile_phase, self.cprofile_path)
+            except Exception as e:
+                logger.error("Failed to write cProfile data to %s: %s", self.cprofile_path, str(e))
+
+
+# process-wide profiler
+profiler = Profiler()
+
+
+def span(name, nbytes=0):
+    """
+    Return a span timing phase @name on the process-wide profiler
+    """
+    return profiler.span(name, nbytes)
+
+def current_span():
+    """
+    Return the innermost active span of the current thread, eg. to add bytes
+    to it from within a timed() function. Returns a no-op span if disabled
+    """
+    if not profiler.enabled:
+        return NULL_SPAN
+    stack = profiler.stack()
+    return stack[-1] if stack else NULL_SPAN
+
+def timed(name):
+    """
+    Decorator that times each call of the decorated function as phase @name
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return func(*args, **kwargs)
+            with Span(profiler, name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -16,34 +16,72 @@ import os
 import codecs
 import errno
 import re
+import hashlib
+import json
 import logging
 import csv
+import shutil
 import subprocess
+import tempfile
+from itertools import islice
 from time import time
 
 import arrow
 import requests
-import progressbar
 
+from psvpack import default_config
+from psvpack import stage
+from psvpack import bandwidth
+from psvpack import output
+from psvpack import metrics
+from psvpack.cache import PkgCache
+from psvpack.installdb import InstallDB
+from psvpack.mirrors import MirrorManager, url_host
+from psvpack.profiler import current_span, span, timed
+from psvpack.status import StatusIndex
 from psvpack.util import *
 
 
 logger = logging.getLogger('psvpack')
 
+# adaptive download chunk size bounds (bytes), and target time per read (seconds)
+DL_CHUNK_MIN = 64 * 1024
+DL_CHUNK_MAX = 4 * 1024 * 1024
+DL_CHUNK_TIME = 0.1
+
+# TSV download read size, and number of rows per batch when loading a TSV file in one go
+TSV_CHUNK = 64 * 1024
+TSV_BATCH = 50000
+
+
+class DownloadCancelled(Exception):
+    """
+    Raised by a download progress callback to abort the download. The partial
+    file is kept, so that the download can be resumed later
+    """
+    pass
+
 
 class TSVManager(object):
     """
     Handles downloading, updating, parsing, and searching of TSV files
+    If @load is False, the caller is responsible for calling check_for_update()
+    and load_tsv() or iter_load(). Progress is reported to @pd, which may be any
+    object with QProgressDialog's setLabelText() and setValue() methods
     """
     filename = None
     url = None
     last_update = None
     ttl = None
     glist = []
+    tid_index = {}
+    cid_index = {}
     loaded = False
+    cancelled = False
     pd = None
 
-    def __init__(self, tsvname, config, pd=None):
+    @timed('tsv.load')
+    def __init__(self, tsvname, config, pd=None, load=True):
         try:
             self.ttl = int(config['cache_ttl'])
         except:
@@ -51,11 +89,13 @@ class TSVManager(object):
             self.ttl = 86400
         self.tsvname = tsvname
         self.pd = pd
+        self.mirrors = MirrorManager(config)
         self.url = config['tsv_urls'][tsvname.upper()]
         self.filename = os.path.join(os.path.expanduser(config['cache_dir']), 'tsv', self.url.split('/')[-1])
         logger.debug("Using TSV for %s: URL=%s / Local=%s", tsvname, self.url, self.filename)
-        self.check_for_update()
-        self.load_tsv()
+        if load:
+            self.check_for_update()
+            self.load_tsv()
 
     def set_progress(self, msg=None, value=None):
         """
@@ -67,10 +107,36 @@ class TSVManager(object):
             if value is not None:
                 self.pd.setValue(value)
 
+    def cancel(self):
+        """
+        Abort a download or parse in progress (eg. from another thread)
+        The cached TSV file is left as it was
+        """
+        self.cancelled = True
+
     def check_for_update(self, force=False):
         """
         Check mtime of cache TSV file to see if we should update
         If @force is True, then force an update
+        Refreshes are serialized between processes with a lock file; a process
+        that had to wait re-checks the cache before fetching it again
+        """
+        do_update = self.is_stale(force)
+        if do_update is None:
+            return None
+
+        if do_update:
+            with FileLock(self.filename + '.lock'):
+                if force or self.is_stale():
+                    return self.fetch_update()
+
+        return self.last_update
+
+    @timed('tsv.ttl_check')
+    def is_stale(self, force=False):
+        """
+        Check if the cached TSV file is missing or older than the TTL
+        Returns None if the cached file can't be accessed
         """
         do_update = True if force else False
         nowtime = time()
@@ -92,100 +158,311 @@ class TSVManager(object):
             else:
                 do_update = True
 
-        if do_update:
+        return do_update
+
+    @timed('tsv.fetch')
+    def fetch_update(self):
+        """
+        Download TSV file and replace the cached copy
+        Configured alternate URLs are tried in turn if the primary fails
+        """
+        r = None
+        meta = self.load_meta()
+        self.set_progress("Downloading updated game list (%s)..." % (self.tsvname))
+        for turl in self.mirrors.tsv_candidates(self.tsvname, self.url):
+            # conditional request, so an unchanged list is not downloaded again
+            headers = {}
+            if os.path.exists(self.filename) and meta.get('url') == turl:
+                if meta.get('etag'):
+                    headers['If-None-Match'] = meta['etag']
+                if meta.get('last_modified'):
+                    headers['If-Modified-Since'] = meta['last_modified']
             try:
-                logger.info("Updating cached TSV file from %s", self.url)
-                self.set_progress("Downloading updated game list (%s)..." % (self.tsvname))
-                r = requests.get(self.url)
+                logger.info("Updating cached TSV file from %s", turl)
+                stime = time()
+                r = requests.get(turl, headers=headers, timeout=(10, self.mirrors.stall_time), stream=True)
                 r.raise_for_status()
+                content = self.read_body(r)
+                if content is None:
+                    logger.info("TSV update cancelled")
+                    return None
+                self.mirrors.record_success(turl, len(content), time() - stime)
+                current_span().add_bytes(len(content))
+                break
             except Exception as e:
                 logger.error("Failed to fetch TSV file: %s", str(e))
-                return None
+                self.mirrors.record_failure(turl)
+                r = None
+        if r is None:
+            metrics.TSV_REFRESH.inc(list=self.tsvname, result='failed')
+            return None
 
-            try:
-                self.last_update = arrow.get(r.headers['Last-Modified'], "ddd, DD MMM YYYY HH:mm:ss ZZZ")
-                logger.debug("Remote TSV modification time: %s", self.last_update.format())
-            except Exception as e:
-                logger.warning("Failed to parse modification time of TSV file. Using current time. Error: %s", str(e))
-                self.last_update = arrow.now()
+        if r.status_code == 304:
+            logger.info("Cached TSV file is up to date")
+            metrics.TSV_REFRESH.inc(list=self.tsvname, result='not_modified')
+            os.utime(self.filename)
+            self.last_update = arrow.now()
+            return self.last_update
+        metrics.TSV_REFRESH.inc(list=self.tsvname, result='full')
 
-            cache_dir = os.path.dirname(self.filename)
-            if not os.path.exists(cache_dir):
-                try:
-                    os.makedirs(cache_dir, 0o775, exist_ok=True)
-                except:
-                    logger.error("Failed to create TSV cache directory %s: %s", cache_dir, str(e))
+        try:
+            self.last_update = arrow.get(r.headers['Last-Modified'], "ddd, DD MMM YYYY HH:mm:ss ZZZ")
+            logger.debug("Remote TSV modification time: %s", self.last_update.format())
+        except Exception as e:
+            logger.warning("Failed to parse modification time of TSV file. Using current time. Error: %s", str(e))
+            self.last_update = arrow.now()
 
+        cache_dir = os.path.dirname(self.filename)
+        if not os.path.exists(cache_dir):
             try:
-                with codecs.open(self.filename, 'w', 'utf8') as f:
-                    f.write(r.content.decode('utf8'))
-                logger.info("Wrote TSV file successfully: %s", self.filename)
-                # TODO: need to figure out a better way to track last update
-                #os.utime(self.filename, (nowtime.timestamp, self.last_update.timestamp))
+                os.makedirs(cache_dir, 0o775, exist_ok=True)
             except Exception as e:
-                logger.error("Failed to write updated TSV cache file [%s]: %s", self.filename, str(e))
-                return None
+                logger.error("Failed to create TSV cache directory %s: %s", cache_dir, str(e))
+
+        # written to a temp file first, so other processes never read a partial TSV
+        try:
+            with codecs.open(self.filename + '.tmp', 'w', 'utf8') as f:
+                f.write(content.decode('utf8'))
+            os.replace(self.filename + '.tmp', self.filename)
+            self.save_meta({'url': turl, 'etag': r.headers.get('ETag'), 'last_modified': r.headers.get('Last-Modified')})
+            logger.info("Wrote TSV file successfully: %s", self.filename)
+            # TODO: need to figure out a better way to track last update
+            #os.utime(self.filename, (nowtime.timestamp, self.last_update.timestamp))
+        except Exception as e:
+            logger.error("Failed to write updated TSV cache file [%s]: %s", self.filename, str(e))
+            return None
 
         return self.last_update
 
+    def load_meta(self):
+        """
+        Return validators (URL, ETag & Last-Modified) of the cached TSV file
+        """
+        try:
+            with open(self.filename + '.meta') as f:
+                return json.load(f)
+        except Exception:
+            return {}
+
+    def save_meta(self, meta):
+        try:
+            with open(self.filename + '.meta', 'w') as f:
+                json.dump(meta, f)
+        except Exception as e:
+            logger.debug("Failed to write TSV metadata: %s", str(e))
+
+    def read_body(self, r):
+        """
+        Read the body of streamed response @r, updating progress (0-50%)
+        Returns None if cancelled
+        """
+        total = int(r.headers.get('Content-Length') or 0)
+        body = bytearray()
+        for chunk in r.iter_content(TSV_CHUNK):
+            if self.cancelled:
+                r.close()
+                return None
+            body += chunk
+            if total:
+                self.set_progress(value=min(50, len(body) * 50 // total))
+        return bytes(body)
+
+    @timed('tsv.parse')
     def load_tsv(self):
         """
         Parse TSV file
         """
-        self.set_progress("Parsing game list...", 50)
         try:
-            with codecs.open(self.filename, 'r', 'utf8') as f:
-                self.glist = [x for x in csv.DictReader(f, dialect='excel-tab')]
-            self.loaded = True
-            return True
+            current_span().add_bytes(os.path.getsize(self.filename))
+            for _ in self.iter_load(TSV_BATCH):
+                pass
+            return self.loaded
         except Exception as e:
             logger.error("Failed to parse TSV file: %s", str(e))
             return False
 
+    def iter_load(self, batch=TSV_BATCH):
+        """
+        Parse TSV file, yielding lists of up to @batch rows as they are parsed,
+        and updating progress (50-100%). Rows are added to self.glist as they
+        are yielded; the lookup index is built and `loaded` set once all rows
+        have been parsed. Stops early if cancelled
+        """
+        self.set_progress("Parsing game list...", 50)
+        self.glist = []
+        self.loaded = False
+        fsize = max(1, os.path.getsize(self.filename))
+        fpos = [0]
+
+        def read_lines(f):
+            # track the position, as tell() is not available while iterating over a file
+            for tline in f:
+                fpos[0] += len(tline)
+                yield tline.decode('utf8')
+
+        with open(self.filename, 'rb') as f:
+            reader = csv.DictReader(read_lines(f), dialect='excel-tab')
+            while not self.cancelled:
+                tbatch = list(islice(reader, batch))
+                if not tbatch:
+                    break
+                self.glist += tbatch
+                self.set_progress(value=50 + fpos[0] * 50 // fsize)
+                yield tbatch
+
+        if self.cancelled:
+            logger.info("Parsing of %s list cancelled", self.tsvname)
+            return
+        self.build_index()
+        self.loaded = True
+        self.set_progress(value=100)
+
     def search(self, gtitle, reglist=['US', 'JP', 'EU', 'ASIA']):
         """
         Search for game title in TSV
         """
-        return [x for x in self.glist if (re.search(gtitle, x['Name'], re.I) or re.search(gtitle, x.get('Original Name', ''), re.I) or gtitle == x['Title ID']) and x['Region'] in reglist]
+        return list(self.iter_search(gtitle, reglist))
+
+    def iter_search(self, gtitle, reglist=['US', 'JP', 'EU', 'ASIA']):
+        """
+        Search for game title in TSV, yielding matches as they are found
+        """
+        rx = re.compile(gtitle, re.I)
+        for x in self.glist:
+            if x['Region'] in reglist and (rx.search(x['Name']) or rx.search(x.get('Original Name', '')) or gtitle == x['Title ID']):
+                yield x
 
+    def build_index(self):
+        """
+        Build Title ID & Content ID lookup tables for get_title()
+        """
+        self.tid_index = {}
+        self.cid_index = {}
+        for tgame in self.glist:
+            self.tid_index.setdefault(tgame['Title ID'], []).append(tgame)
+            self.cid_index[tgame['Content ID']] = tgame
+
+    @timed('lookup')
     def get_title(self, tid):
         """
         Return game info by Title ID
         """
         if '-' in tid:
-            rez = [x for x in self.glist if tid.upper() == x['Content ID']]
+            rez = [self.cid_index[tid.upper()]] if tid.upper() in self.cid_index else []
         else:
-            rez = [x for x in self.glist if tid.upper() == x['Title ID']]
+            rez = self.tid_index.get(tid.upper(), [])
 
         if len(rez) == 0:
             return None
         else:
             return rez
 
-def download_pkg(url, dest, cs=1024, filesize=0):
+@timed('download')
+def download_pkg(url, dest, cs=None, filesize=0, progress=None, hasher=None, resume=False, stall_rate=0, stall_time=30,
+                 throttle=None):
     """
     Download package from @url to @dest path via Requests stream
-    @cs = chunk size
+    @cs = fixed chunk size; if None, the chunk size adapts to the transfer rate
+    @progress = callback(curbyte, total); a console progressbar is used if None.
+                It may raise DownloadCancelled to abort the download
+    @hasher = optional hashlib object, updated with the data as it is received
+    @resume = if True and @dest already exists, continue from its current size
+    @stall_rate = abort if the transfer rate stays below this many bytes/sec
+                  for @stall_time seconds (0 = never abort)
+    @throttle = optional bandwidth.HostThrottle, called with the size of each read
     """
-    logger.info("Downloading pkg from %s --> %s", url, dest)
+    offset = os.path.getsize(dest) if resume and os.path.exists(dest) else 0
+    if offset:
+        logger.info("Resuming download of %s at %s --> %s", url, fmtsize(offset).strip(), dest)
+    else:
+        logger.info("Downloading pkg from %s --> %s", url, dest)
 
-    pg = progressbar.ProgressBar(min_value=0, max_value=filesize).start()
+    if progress is None:
+        progress = ProgressBarCallback(filesize)
+    tprog = ThrottledProgress(progress)
+
+    # data is read into a single reused buffer, rather than allocating
+    # a new bytes object for every chunk
+    chunk = cs or DL_CHUNK_MIN
+    buf = memoryview(bytearray(cs or DL_CHUNK_MAX))
     try:
-        r = requests.get(url, stream=True)
-        with open(dest, 'wb') as f:
-            curbyte = 0
-            for chunk in r.iter_content(chunk_size=cs):
-                if chunk:
-                    f.write(chunk)
-                    curbyte += len(chunk)
-                    pg.update(curbyte)
+        timeout = (10, stall_time) if stall_rate else None
+        req_start = time()
+        r = requests.get(url, stream=True, headers={'Range': 'bytes=%d-' % (offset)} if offset else None, timeout=timeout)
+        if offset and r.status_code != 206:
+            # server ignored or rejected the range request, so start over
+            logger.warning("Server does not support resuming downloads. Restarting from the beginning.")
+            offset = 0
+            if r.status_code != 200:
+                r.close()
+                r = requests.get(url, stream=True, timeout=timeout)
+        r.raise_for_status()
+        metrics.DOWNLOAD_TTFB.observe(time() - req_start)
+        r.raw.decode_content = True
+        with open(dest, 'r+b' if offset else 'wb') as f:
+            preallocate(f, filesize)
+            if offset and hasher is not None:
+                while f.tell() < offset:
+                    hasher.update(buf[:f.readinto(buf[:min(len(buf), offset - f.tell())])])
+            f.seek(offset)
+            curbyte = offset
+            dl_start = time()
+            win_start = time()
+            win_byte = curbyte
+            try:
+                while True:
+                    stime = time()
+                    rlen = r.raw.readinto(buf[:chunk])
+                    if not rlen:
+                        break
+                    f.write(buf[:rlen])
+                    if hasher is not None:
+                        hasher.update(buf[:rlen])
+                    curbyte += rlen
+                    tprog(curbyte, filesize)
+
+                    if stall_rate and time() - win_start >= stall_time:
+                        # a transfer held back by the bandwidth limit is not stalled
+                        srate = min(stall_rate, throttle.rate() / 2) if throttle is not None and throttle.rate() else stall_rate
+                        if (curbyte - win_byte) / (time() - win_start) < srate:
+                            raise IOError("transfer stalled below %s" % (fmtsize(srate, rate=True).strip()))
+                        win_start = time()
+                        win_byte = curbyte
+
+                    # grow chunk size on fast links, shrink on slow ones,
+                    # so that each read takes roughly DL_CHUNK_TIME seconds
+                    if cs is None:
+                        rtime = time() - stime
+                        if rtime < DL_CHUNK_TIME / 2 and chunk < DL_CHUNK_MAX:
+                            chunk *= 2
+                        elif rtime > DL_CHUNK_TIME * 2 and chunk > DL_CHUNK_MIN:
+                            chunk //= 2
+
+                    # rate-limited reads are kept small, so that the limit is applied smoothly
+                    if throttle is not None:
+                        throttle(rlen)
+                        if throttle.rate():
+                            chunk = max(min(chunk, int(throttle.rate() * DL_CHUNK_TIME)), 4096)
+            finally:
+                # drop any preallocated space beyond what was actually received (also
+                # when interrupted, so that a resumed download starts at the right offset)
+                f.truncate(curbyte)
 
         fsize = os.stat(dest).st_size
-        pg.finish()
+        current_span().add_bytes(fsize - offset)
+        metrics.DOWNLOADS.inc(result='ok')
+        metrics.DOWNLOAD_BYTES.inc(fsize - offset)
+        metrics.DOWNLOAD_RATE.observe((fsize - offset) / max(time() - dl_start, 0.001))
+        tprog.finish()
         logger.info("Successfully fetched package (%s total size)", fmtsize(fsize))
         return fsize
+    except DownloadCancelled:
+        logger.info("Download of %s cancelled", url)
+        metrics.DOWNLOADS.inc(result='cancelled')
+        raise
     except Exception as e:
         logger.error("Failed to download file %s -> %s: %s", url, dest, str(e))
+        metrics.DOWNLOADS.inc(result='failed')
         return False
 
 def check_cached(pkgpath, chksum, noverify=False):
@@ -205,24 +482,59 @@ def check_cached(pkgpath, chksum, noverify=False):
                 logger.warning("Existing file does NOT match checksum. Overwriting.")
     return False
 
+def get_install_path(glist, title_id, content_id):
+    """
+    Return tuple of (title dir, check file), relative to the install root, where
+    pkg2zip extracts @content_id for game list @glist.
+    Returns (None, None) for lists with an unknown layout
+    """
+    if glist == 'PSV':
+        outpath = os.path.join('app', title_id)
+        return (outpath, os.path.join(outpath, 'eboot.bin'))
+    elif glist == 'PSV_DLC':
+        outpath = os.path.join('addcont', title_id, content_id.split('-')[-1])
+        return (outpath, os.path.join(outpath, '_data', 'addoninfo.dat'))
+    return (None, None)
+
+@timed('pkg2zip')
 def pkg2zip(pkgfile, zrif, title_id, content_id, cwd, glist, binpath='/usr/local/bin/pkg2zip'):
     """
     Use pkg2zip to decrypt and extract pkg file in @cwd
+    Output from pkg2zip is captured and logged per-item, so that
+    concurrent extractions don't interleave on the terminal
+    """
+    pz = subprocess.Popen(pkg2zip_args(pkgfile, zrif, cwd, binpath), cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    pout, _ = pz.communicate()
+    return check_pkg2zip(pz.returncode, pout, title_id, content_id, cwd, glist)
+
+def pkg2zip_args(pkgfile, zrif, cwd, binpath='/usr/local/bin/pkg2zip'):
+    """
+    Return pkg2zip command line for extracting @pkgfile in @cwd
     """
     logger.info("Using basepath: %s", os.path.realpath(cwd))
-    pz = subprocess.Popen([binpath, '-x', pkgfile, zrif], cwd=cwd)
-    pz.communicate()
-    if pz.returncode != 0:
-        logger.error("pkg2zip returned non-zero (%d)", pz.returncode)
+    return [binpath, '-x', pkgfile, zrif]
+
+def check_pkg2zip(returncode, pout, title_id, content_id, cwd, glist):
+    """
+    Log output @pout of a pkg2zip run in @cwd, and check that it succeeded
+    Returns path to the extracted title, or None on failure
+    """
+    pout = pout.decode('utf-8', errors='replace').splitlines()
+    if returncode != 0:
+        logger.error("pkg2zip returned non-zero (%d) for %s", returncode, content_id)
+        for tline in pout:
+            logger.error("[pkg2zip:%s] %s", content_id, tline)
         return None
+    for tline in pout:
+        logger.debug("[pkg2zip:%s] %s", content_id, tline)
 
     # Verify that app title dir exists
-    if glist == 'PSV':
-        outpath = os.path.join(cwd, 'app', title_id)
-        outchk = os.path.join(outpath, 'eboot.bin')
-    elif glist == 'PSV_DLC':
-        outpath = os.path.join(cwd, 'addcont', title_id, content_id.split('-')[-1])
-        outchk = os.path.join(outpath, '_data', 'addoninfo.dat')
+    outpath, outchk = get_install_path(glist, title_id, content_id)
+    if outpath is None:
+        logger.warning("Unable to verify extracted files for %s list. Assuming success.", glist)
+        return cwd
+    outpath = os.path.join(cwd, outpath)
+    outchk = os.path.join(cwd, outchk)
 
     if os.path.exists(outchk):
         logger.info("Title %s extracted successfully --> %s", title_id, outpath)
@@ -231,12 +543,14 @@ def pkg2zip(pkgfile, zrif, title_id, content_id, cwd, glist, binpath='/usr/local
         logger.error("Expected output files missing for %s. Extraction failed?", content_id)
         return None
 
-def install_game(tgame, config, glist="PSV", uxroot="./", install=True, noverify=False):
+@timed('fetch')
+def fetch_pkg(tgame, config, noverify=False, progress=None):
     """
-    Perform game download & optional installation
+    Download package for @tgame to the local pkg cache, unless a valid
+    copy is already cached. Returns path to the local pkg file, or None on failure
+    @progress = download progress callback (see download_pkg). If it raises
+    DownloadCancelled, the exception is passed on to the caller
     """
-    logger.info(">>> Installing %s: %s", glist, tgame['Content ID'])
-
     # Preflight checks
     if tgame['zRIF'] == "MISSING":
         logger.error("Game does not include zRIF! To download anyway, use --force")
@@ -246,56 +560,293 @@ def install_game(tgame, config, glist="PSV", uxroot="./", install=True, noverify
         return None
 
     # Check cache dir
-    cache_dir = os.path.realpath(os.path.join(os.path.expanduser(config['cache_dir']), 'pkg'))
-    if not os.path.exists(cache_dir):
-        try:
-            os.makedirs(cache_dir, 0o775, exist_ok=True)
-            logger.info("Created local pkg cache: %s", cache_dir)
-        except Exception as e:
-            logger.error("Failed to create pkg cache path [%s]: %s", cache_dir, str(e))
-            return None
+    pcache = PkgCache(config)
+    if not pcache.setup():
+        return None
+
+    # Only one process (or thread) downloads a given package at a time. Others
+    # wait for it to finish, then pick up the result from the cache
+    plock = pcache.lock(tgame)
+    if not plock.acquire(blocking=False):
+        logger.info("Package for %s is already being downloaded elsewhere. Waiting for it to finish...", tgame['Content ID'])
+        plock.acquire()
+    try:
+        return _fetch_pkg_locked(tgame, config, pcache, noverify, progress)
+    finally:
+        pcache.release_room(tgame)
+        plock.release()
+
+def _fetch_pkg_locked(tgame, config, pcache, noverify=False, progress=None):
+    """
+    Fetch package for @tgame into @pcache. Caller must hold the package lock
+    """
+    # Packages already in the content-addressed store were verified when added
+    local_path = pcache.lookup(tgame)
+    if local_path is not None:
+        logger.info("Using cached package from store -> %s", local_path)
+        pcache.hit(local_path)
+        return local_path
 
     # Fetch package
-    local_path = os.path.realpath(os.path.join(cache_dir, tgame['Content ID'] + '.pkg'))
-    if not check_cached(local_path, tgame['SHA256'], noverify):
-        try:
-            rp_size = int(tgame['File Size'])
-        except Exception as e:
-            logger.error("Failed to parse expected filesize: %s", str(e))
-            rp_size = -1
+    local_path = pcache.name_path(tgame['Content ID'])
+    if check_cached(local_path, tgame['SHA256'], noverify):
+        pcache.hit(local_path)
+        if not noverify:
+            pcache.ingest(local_path, tgame['SHA256'])
+        return local_path
 
-        dl_size = download_pkg(tgame['PKG direct link'], local_path, filesize=rp_size)
+    try:
+        rp_size = int(tgame['File Size'])
+    except Exception as e:
+        logger.error("Failed to parse expected filesize: %s", str(e))
+        rp_size = -1
+
+    # packages of unknown size are downloaded without making room first
+    if rp_size >= 0 and not pcache.make_room(rp_size, tgame):
+        logger.error("Not enough room in pkg cache for %s (%s). Raise `cache_max_bytes` or unpin packages",
+                     tgame['Content ID'], fmtsize(rp_size).strip())
+        return None
+
+    # downloads go to a .part file, which is kept for resuming if the download is
+    # interrupted, then renamed into place. Renaming (rather than writing to the
+    # existing name) also avoids writing through a link shared with a store object
+    part_path = local_path + '.part'
+    chksum = PkgCache.norm_digest(tgame['SHA256'])
+
+    # try each mirror in turn, fastest first. Since downloads resume, a mirror that
+    # stalls or fails part-way through hands off to the next one without losing data.
+    # With nowhere to hand off to, a slow download is left to finish
+    dl_size = False
+    mirrors = MirrorManager(config)
+    urls = mirrors.candidates(tgame['PKG direct link'])
+    stall_rate = mirrors.stall_rate if len(urls) > 1 else 0
+    for tnum, turl in enumerate(urls):
+        hasher = hashlib.sha256()
+        stime = time()
+        dl_size = download_pkg(turl, part_path, filesize=rp_size, progress=progress, hasher=hasher, resume=True,
+                               stall_rate=stall_rate, stall_time=mirrors.stall_time,
+                               throttle=bandwidth.get_scheduler(config).throttler(url_host(turl)))
         if not dl_size:
-            logger.error("Failed to retrieve package from remote repository :(")
-            return None
-        elif dl_size != rp_size:
-            logger.warning("Downloaded package does not match reported size (%s != %s bytes)", dl_size, rp_size)
+            mirrors.record_failure(turl)
+            if tnum < len(urls) - 1:
+                logger.warning("Download from %s failed. Trying next mirror...", url_host(turl))
+            continue
+
+        mirrors.record_success(turl, dl_size, time() - stime)
+        if chksum is None or hasher.hexdigest() == chksum or tnum == len(urls) - 1:
+            break
+        logger.warning("Package from %s does not match SHA256 checksum. Trying next mirror...", url_host(turl))
+        mirrors.record_failure(turl)
+        os.unlink(part_path)
+
+    pcache.miss(dl_size or 0)
+    if not dl_size:
+        logger.error("Failed to retrieve package from remote repository :(")
+        return None
+    elif dl_size != rp_size:
+        logger.warning("Downloaded package does not match reported size (%s != %s bytes)", dl_size, rp_size)
+    os.replace(part_path, local_path)
+
+    if chksum is None:
+        # not added to the store, which only holds verified packages
+        logger.debug("No valid SHA256 listed for %s. Skipping checksum verification", tgame['Content ID'])
+    elif hasher.hexdigest() == chksum:
+        pcache.ingest(local_path, chksum)
+    else:
+        logger.warning("Downloaded package does not match reported SHA256 checksum (%s)", hasher.hexdigest())
+
+    return local_path
 
-    # Use pkg2zip to extract
-    if install:
+@timed('extract')
+def extract_game(tgame, local_path, config, glist="PSV", uxroot="./"):
+    """
+    Extract downloaded pkg @local_path for @tgame into @uxroot
+    If `stage_dir` is set in @config, pkg2zip extracts into a scratch directory
+    there first, and the finished title is then copied into @uxroot in one pass
+    """
+    stage_dir = get_stage_dir(tgame, config, glist, uxroot)
+    stime = time()
+    if stage_dir:
+        title_path = staged_pkg2zip(local_path, tgame, config, glist, uxroot, stage_dir)
+    else:
         title_path = pkg2zip(local_path, tgame['zRIF'], tgame['Title ID'], tgame['Content ID'], uxroot, glist, config['pkg2zip'])
-        if title_path is not None:
-            logger.info("Title installed successfully ^_^")
+    metrics.EXTRACT_TIME.observe(time() - stime)
+    return finish_extract(tgame, title_path, glist, uxroot)
+
+def finish_extract(tgame, title_path, glist, uxroot):
+    """
+    Log the outcome of extracting @tgame, and record it in the install
+    manifest of @uxroot if successful. Returns @title_path
+    """
+    if title_path is not None:
+        logger.info("Title installed successfully ^_^")
+        if os.path.realpath(title_path) != os.path.realpath(uxroot):
+            try:
+                InstallDB(uxroot).record(tgame, glist, title_path)
+            except Exception as e:
+                logger.warning("Failed to update install manifest: %s", str(e))
+        return title_path
+    else:
+        logger.error("Title installation failed v_v")
+        return None
+
+def get_stage_dir(tgame, config, glist, uxroot):
+    """
+    Return the `stage_dir` from @config to extract @tgame in, or None if
+    staging is disabled or not supported for @glist
+    """
+    stage_dir = config.get('stage_dir')
+    if stage_dir and get_install_path(glist, tgame['Title ID'], tgame['Content ID'])[0] is None:
+        logger.warning("Staged install not supported for %s list. Extracting directly to %s", glist, uxroot)
+        return None
+    return stage_dir
+
+def make_stage_tmpdir(stage_dir):
+    """
+    Create a temporary directory for one extraction under @stage_dir
+    Returns its path, or None on failure
+    """
+    stage_dir = os.path.realpath(os.path.expanduser(stage_dir))
+    try:
+        os.makedirs(stage_dir, 0o775, exist_ok=True)
+        return tempfile.mkdtemp(prefix='psvpack-', dir=stage_dir)
+    except Exception as e:
+        logger.error("Failed to create staging directory in %s: %s", stage_dir, str(e))
+        return None
+
+def install_staged(spath, tmpdir, config, uxroot):
+    """
+    Copy title @spath, extracted under stage tmpdir @tmpdir, to the same
+    relative path in @uxroot (see stage.install_tree)
+    """
+    dest = os.path.join(uxroot, os.path.relpath(spath, tmpdir))
+    return stage.install_tree(spath, dest, int(config.get('stage_inflight', default_config['stage_inflight'])))
+
+def staged_pkg2zip(local_path, tgame, config, glist, uxroot, stage_dir):
+    """
+    Extract @local_path into a temporary directory under @stage_dir (eg. tmpfs or
+    a local SSD), then copy the finished title dir to @uxroot and rename it into place.
+    Nothing is written to @uxroot if extraction fails
+    """
+    tmpdir = make_stage_tmpdir(stage_dir)
+    if tmpdir is None:
+        return None
+
+    try:
+        spath = pkg2zip(local_path, tgame['zRIF'], tgame['Title ID'], tgame['Content ID'], tmpdir, glist, config['pkg2zip'])
+        if spath is None:
+            return None
+        return install_staged(spath, tmpdir, config, uxroot)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+def install_game(tgame, config, glist="PSV", uxroot="./", install=True, noverify=False, progress=None, force=False,
+                 verify=False):
+    """
+    Perform game download & optional installation
+    Items already installed in @uxroot with the same package are skipped, unless @force is True
+    @verify = check all installed files before skipping (see InstallDB.is_current)
+    @progress = download progress callback (see download_pkg)
+    """
+    logger.info(">>> Installing %s: %s", glist, tgame['Content ID'])
+
+    if install and not force:
+        title_path = InstallDB(uxroot).is_current(tgame, verify)
+        if title_path:
+            logger.info("%s is already installed and up to date --> %s", tgame['Content ID'], title_path)
             return title_path
-        else:
-            logger.error("Title installation failed v_v")
+
+    if not install:
+        local_path = fetch_pkg(tgame, config, noverify, progress)
+        if local_path is not None:
+            logger.info("Skipping installation step. Run 'install' again to extract pkg")
+        return local_path
+
+    # keep the package from being evicted from the cache until it has been extracted
+    with PkgCache(config).pin(tgame):
+        local_path = fetch_pkg(tgame, config, noverify, progress)
+        if local_path is None:
             return None
+        # Use pkg2zip to extract
+        return extract_game(tgame, local_path, config, glist, uxroot)
+
+def rescan_installed(config, uxroot="./"):
+    """
+    Rebuild the install manifest for @uxroot by scanning its app/ and addcont/ trees
+    Configured PSV and PSV_DLC lists are used to resolve Content IDs and checksums
+    """
+    catalogs = {}
+    for glist in ('PSV', 'PSV_DLC'):
+        if config['tsv_urls'].get(glist):
+            tsv = TSVManager(glist, config)
+            if tsv.loaded:
+                catalogs[glist] = tsv.glist
+    return InstallDB(uxroot).rebuild(catalogs)
+
+def cache_command(subcmd, config):
+    """
+    Run pkg cache maintenance command @subcmd
+    """
+    pcache = PkgCache(config)
+    if subcmd == 'dedupe':
+        pcache.dedupe()
+    elif subcmd == 'stats':
+        cstats = pcache.stats()
+        print("Cache path:     %s" % (pcache.root))
+        print("Packages:       %d (%d names, %d pinned)" % (cstats['packages'], cstats['names'], cstats['pinned']))
+        if cstats['max_bytes']:
+            print("Occupancy:      %s / %s (%.1f%%)" % (fmtsize(cstats['used_bytes']), fmtsize(cstats['max_bytes']),
+                                                      100.0 * cstats['used_bytes'] / cstats['max_bytes']))
+        else:
+            print("Occupancy:      %s (unbounded)" % (fmtsize(cstats['used_bytes'])))
+        print("Hit ratio:      %.1f%% (%d hits / %d misses)" % (100.0 * cstats['hit_ratio'], cstats['hits'], cstats['misses']))
+        print("Downloaded:     %s" % (fmtsize(cstats['downloaded_bytes'])))
+        print("Evicted:        %s (%d packages)" % (fmtsize(cstats['evicted_bytes']), cstats['evictions']))
     else:
-        logger.info("Skipping installation step. Run 'install' again to extract pkg")
-        return local_path
+        logger.error("Unknown cache command '%s'. Available: dedupe, stats", subcmd)
+        return False
+    return True
 
-def do_search(gtitle, config, glist="PSV", regions=['US', 'JP']):
+def do_search(gtitle, config, glist="PSV", regions=['US', 'JP'], fmt='text', fields=None, limit=None, uxroot="./",
+              statuses=None):
     """
-    Perform a search, then display the results
+    Perform a search, then display the results, marking which are cached,
+    installed in @uxroot, or installed but outdated
+    @fmt = output format (see output.FORMATS); machine-readable formats are
+           written as each match is found, with the marks in a `Status` column
+    @fields = list of columns to output (machine-readable formats only)
+    @limit = stop after this many matches
+    @statuses = only include matches with all of these statuses (see status.STATUSES)
+    Returns list of matching catalog entries
     """
     tsv = TSVManager(glist, config)
-    results = tsv.search(gtitle, regions)
+    # scans the pkg cache & uxroot on first use, ie. only if a match needs its status
+    sindex = StatusIndex(config, uxroot)
+    matches = tsv.iter_search(gtitle, regions)
+    if statuses:
+        matches = (x for x in matches if sindex.matches(x, glist, statuses))
+    if limit:
+        matches = islice(matches, limit)
+
+    if fmt != 'text':
+        results = []
+        with_status = fields is None or 'Status' in fields
+        writer = output.RowWriter(fmt, fields)
+        with span('search'):
+            for tgame in matches:
+                writer.write(dict(tgame, Status=','.join(sindex.status(tgame, glist))) if with_status else tgame)
+                results.append(tgame)
+        writer.close()
+        return results
+
+    with span('search'):
+        results = list(matches)
 
     if len(results):
         print('{:16} {:4} {:8} {}'.format("ID", "Reg", "Size", "Name/Version"))
         print('=' * 60)
         for tgame in results:
-            warn = ""
+            warn = ''.join(['[%s] ' % (x) for x in sindex.status(tgame, glist)])
             if 'PSV' in glist:
                 if tgame['zRIF'] == "MISSING":
                     warn += "<NO zRIF!> "
@@ -310,12 +861,19 @@ def do_search(gtitle, config, glist="PSV", regions=['US', 'JP']):
                 print('{Title ID:16} {Region:4} {fsize:8} {Name} {warn}'.format(fsize=fmtsize(tgame['File Size']), warn=warn, **tgame))
     else:
         print("!! No results.")
-        return False
 
-def get_game(tid, config, glist="PSV", uxroot="./", install=True, noverify=False, getall=False):
+    return results
+
+def get_game(tid, config, glist="PSV", uxroot="./", install=True, noverify=False, getall=False, force=False, on_event=None,
+             verify=False):
     """
     Fetch game by Title ID or Content ID
     Can install multiple titles/items (such as all matching DLC) when @getall is True
+    Items that are already installed are skipped, unless @force is True
+    @verify = check all installed files before skipping (see InstallDB.is_current)
+    @on_event = progress event callback (see pipeline.make_event)
+    Returns pipeline result dict (see InstallPipeline.run_jobs), or None if
+    nothing matching @tid could be installed
     """
     tsv = TSVManager(glist, config)
     gresults = tsv.get_title(tid)
@@ -330,15 +888,16 @@ def get_game(tid, config, glist="PSV", uxroot="./", install=True, noverify=False
     else:
         logger.info("%d results found. Installing all related items...", len(gresults))
 
-    ires = {'success': 0, 'failed': 0}
-    for tgame in gresults:
-        if install_game(tgame, config, glist, uxroot, install, noverify) is None:
-            ires['failed'] += 1
-        else:
-            ires['success'] += 1
+    # downloads and extractions are pipelined, so that extraction of one
+    # item overlaps with the download of the next
+    from psvpack.pipeline import InstallPipeline
+    pipe = InstallPipeline(config, glist, uxroot, install, noverify, force=force, on_event=on_event, verify=verify)
+    ires = pipe.run(gresults)
 
     logger.info("*** Installation report: %d success / %d failed", ires['success'], ires['failed'])
     if ires['failed'] == 0:
         logger.info("All titles/items installed successfully!")
     else:
         logger.warning("Some titles/items failed")
+
+    return ires
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# vim: set ts=4 sw=4 expandtab syntax=python:
+"""
+
+psvpack.stage
+Staged installation helpers: bulk tree copy & rename into uxroot
+
+@author   Jacob Hipps <jacob@ycnrg.org>
+
+Copyright (c) 2018 J. Hipps / Neo-Retro Group, Inc.
+https://ycnrg.org/
+
+"""
+
+import os
+import logging
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+from psvpack.profiler import current_span, timed
+
+
+logger = logging.getLogger('psvpack')
+
+# buffer size used for each file copy
+COPY_BUFSIZE = 8 * 1024 * 1024
+
+
+def copy_file(src, dest, bufsize=COPY_BUFSIZE):
+    """
+    Copy @src to @dest using large sequential reads & writes. @dest is
+    fsynced once written. Returns number of bytes copied
+    """
+    buf = memoryview(bytearray(bufsize))
+    total = 0
+    with open(src, 'rb') as fi, open(dest, 'wb') as fo:
+        while True:
+            rlen = fi.readinto(buf)
+            if not rlen:
+                break
+            fo.write(buf[:rlen])
+            total += rlen
+        fo.flush()
+        os.fsync(fo.fileno())
+    return total
+
+def sync_dir(path):
+    """
+    Flush the entries of directory @path to disk. Not all platforms allow
+    opening directories, in which case this does nothing
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def copy_tree(src, dest, inflight=4):
+    """
+    Copy directory tree @src to @dest (which must not yet exist), with up to
+    @inflight files being copied at once. Each file is synced as its copy
+    finishes, and the directories once all are done
+    Returns total number of bytes copied
+    """
+    jobs = []
+    odirs = []
+    for tdir, _, tfiles in os.walk(src):
+        odir = os.path.join(dest, os.path.relpath(tdir, src))
+        os.makedirs(odir, exist_ok=True)
+        odirs.append(odir)
+        for tfile in tfiles:
+            jobs.append((os.path.join(tdir, tfile), os.path.join(odir, tfile)))
+
+    # largest files first, so a single big file doesn't end up trailing the batch
+    jobs.sort(key=lambda x: os.path.getsize(x[0]), reverse=True)
+    with ThreadPoolExecutor(max_workers=max(1, inflight)) as tpool:
+        total = sum(tpool.map(lambda x: copy_file(*x), jobs))
+
+    for odir in odirs:
+        sync_dir(odir)
+    return total
+
+@timed('stage.copy')
+def install_tree(src, dest, inflight=4):
+    """
+    Copy finished tree @src into its final location @dest on the target device
+    The tree is copied to a temporary sibling of @dest first, then renamed into
+    place, so a partially-copied title is never left at @dest. Any existing
+    @dest is replaced (non-atomically): it is first renamed aside, and removed
+    once the new tree is in place. If interrupted between the two renames, the
+    old tree is restored to @dest by the next call
+    Returns @dest on success, or None on failure
+    """
+    parent, tname = os.path.split(os.path.normpath(dest))
+    tmp_dest = os.path.join(parent, '.psvpack-%s.tmp' % (tname))
+    old_dest = os.path.join(parent, '.psvpack-%s.old' % (tname))
+
+    try:
+        os.makedirs(parent, exist_ok=True)
+        if os.path.exists(old_dest) and not os.path.exists(dest):
+            logger.warning("Restoring %s left behind by an interrupted install", dest)
+            os.rename(old_dest, dest)
+        for tpath in (tmp_dest, old_dest):
+            if os.path.exists(tpath):
+                shutil.rmtree(tpath)
+
+        logger.info("Copying staged files --> %s", dest)
+        total = copy_tree(src, tmp_dest, inflight)
+
+        if os.path.exists(dest):
+            os.rename(dest, old_dest)
+        os.rename(tmp_dest, dest)
+        sync_dir(parent)
+        logger.debug("Copied %d bytes from %s --> %s", total, src, dest)
+        current_span().add_bytes(total)
+    except Exception as e:
+        logger.error("Failed to copy staged files to %s: %s", dest, str(e))
+        shutil.rmtree(tmp_dest, ignore_errors=True)
+        if os.path.exists(old_dest) and not os.path.exists(dest):
+            os.rename(old_dest, dest)
+        return None
+
+    shutil.rmtree(old_dest, ignore_errors=True)
+    return dest
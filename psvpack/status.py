@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# vim: set ts=4 sw=4 expandtab syntax=python:
+"""
+
+psvpack.status
+Index of cached packages and installed titles, for status badges & filters
+
+@author   Jacob Hipps <jacob@ycnrg.org>
+
+Copyright (c) 2018 J. Hipps / Neo-Retro Group, Inc.
+https://ycnrg.org/
+
+"""
+
+import os
+import logging
+
+from psvpack.cache import PkgCache
+from psvpack.installdb import InstallDB, read_sfo
+
+
+logger = logging.getLogger('psvpack')
+
+# statuses that can be filtered on; uncached & missing (not installed) are the
+# negations of cached & installed
+STATUSES = ['cached', 'uncached', 'installed', 'missing', 'outdated']
+
+
+def parse_statuses(text):
+    """
+    Parse comma-separated status filter @text (see STATUSES)
+    Returns list of statuses, or None if any is invalid
+    """
+    slist = [x.strip().lower() for x in (text or '').split(',') if x.strip()]
+    for tstat in slist:
+        if tstat not in STATUSES:
+            logger.error("Invalid status '%s'. Expected one of: %s", tstat, ', '.join(STATUSES))
+            return None
+    return slist
+
+def parse_version(ver):
+    """
+    Return app version @ver (eg. "01.05") as a tuple of ints, or None
+    """
+    try:
+        return tuple([int(x) for x in ver.split('.')])
+    except (AttributeError, ValueError):
+        return None
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+def _listdir(path):
+    return os.listdir(path) if os.path.isdir(path) else []
+
+
+class StatusIndex(object):
+    """
+    Answers whether catalog entries are cached, installed and/or outdated
+    using only set & dict lookups. The pkg cache and the app/ and addcont/
+    trees of @uxroot are scanned on first lookup. refresh() rescans whichever
+    of them has changed since (going by directory mtimes), so that long-running
+    callers can keep the index current by calling it periodically. Each
+    rescan bumps `generation`, so that callers can cache derived values
+
+    Installed versions of apps are read from their param.sfo, and the install
+    manifest (see InstallDB) is used for lists without a known layout and to
+    spot titles installed from a package that has since changed
+    """
+    def __init__(self, config, uxroot="./"):
+        self.pcache = PkgCache(config)
+        self.uxroot = os.path.realpath(os.path.expanduser(uxroot))
+        self.cache_ids = set()
+        self.cache_digests = set()
+        self.apps = {}
+        self.dlc = set()
+        self.dlc_dirs = []
+        self.manifest = {}
+        self.cache_stamp = None
+        self.install_stamp = None
+        self.scanned = False
+        self.generation = 0
+
+    def refresh(self):
+        """
+        Rescan the pkg cache and/or install root if they have changed since
+        the last scan. Returns True if anything was rescanned
+        """
+        self.scanned = True
+        changed = False
+        stamp = (_mtime(self.pcache.root), _mtime(self.pcache.store))
+        if stamp != self.cache_stamp:
+            self.cache_stamp = stamp
+            self.scan_cache()
+            changed = True
+
+        # the manifest in the root of uxroot is rewritten by every install
+        stamp = self.install_dirs_stamp()
+        if stamp + tuple([_mtime(x) for x in self.dlc_dirs]) != self.install_stamp:
+            dlc_stamp = self.scan_installed()
+            self.install_stamp = stamp + dlc_stamp
+            changed = True
+
+        if changed:
+            self.generation += 1
+        return changed
+
+    def install_dirs_stamp(self):
+        return tuple([_mtime(x) for x in (self.uxroot, os.path.join(self.uxroot, 'app'), os.path.join(self.uxroot, 'addcont'))])
+
+    def scan_cache(self):
+        """
+        Scan the Content ID names and SHA256 store objects of the pkg cache
+        """
+        cache_ids = set([x[:-4].upper() for x in _listdir(self.pcache.root) if x.endswith('.pkg')])
+        cache_digests = set()
+        for tdir in _listdir(self.pcache.store):
+            cache_digests.update([x[:-4] for x in _listdir(os.path.join(self.pcache.store, tdir)) if x.endswith('.pkg')])
+        self.cache_ids, self.cache_digests = cache_ids, cache_digests
+        logger.debug("Scanned pkg cache %s: %d packages", self.pcache.root, len(cache_ids))
+
+    def scan_installed(self):
+        """
+        Scan the app/ and addcont/ trees and install manifest of the install root
+        Returns the mtimes of the addcont/ title dirs, as of the scan
+        """
+        apps = {}
+        appdir = os.path.join(self.uxroot, 'app')
+        for title_id in _listdir(appdir):
+            sfo = read_sfo(os.path.join(appdir, title_id, 'sce_sys', 'param.sfo')) or {}
+            apps[title_id.upper()] = parse_version(sfo.get('APP_VER'))
+
+        dlc = set()
+        dlc_dirs = []
+        dlc_stamp = []
+        acdir = os.path.join(self.uxroot, 'addcont')
+        for title_id in _listdir(acdir):
+            tpath = os.path.join(acdir, title_id)
+            if os.path.isdir(tpath):
+                dlc_dirs.append(tpath)
+                dlc_stamp.append(_mtime(tpath))
+                dlc.update([(title_id.upper(), x.upper()) for x in _listdir(tpath)])
+
+        manifest = InstallDB(self.uxroot).items
+        self.apps, self.dlc, self.dlc_dirs, self.manifest = apps, dlc, dlc_dirs, manifest
+        logger.debug("Scanned install root %s: %d apps, %d DLC", self.uxroot, len(apps), len(dlc))
+        return tuple(dlc_stamp)
+
+    def is_cached(self, tgame):
+        if not self.scanned:
+            self.refresh()
+        digest = PkgCache.norm_digest(tgame.get('SHA256'))
+        return (tgame.get('Content ID') or '').upper() in self.cache_ids or (digest is not None and digest in self.cache_digests)
+
+    def installed(self, tgame, glist="PSV"):
+        """
+        Check whether @tgame (from list @glist) is installed
+        Returns tuple of (installed, outdated)
+        """
+        if not self.scanned:
+            self.refresh()
+        tid = (tgame.get('Title ID') or '').upper()
+        cid = tgame.get('Content ID') or ''
+        entry = self.manifest.get(cid)
+
+        # installed from a package other than the one currently listed
+        outdated = False
+        digest = PkgCache.norm_digest(tgame.get('SHA256'))
+        if entry is not None and entry.get('sha256') and digest is not None:
+            outdated = PkgCache.norm_digest(entry['sha256']) != digest
+
+        if glist == 'PSV':
+            if tid not in self.apps:
+                return (False, False)
+            cur = self.apps[tid]
+            new = parse_version(tgame.get('App Version'))
+            return (True, outdated or (cur is not None and new is not None and cur < new))
+        elif glist == 'PSV_DLC':
+            if (tid, cid.split('-')[-1].upper()) not in self.dlc:
+                return (False, False)
+            return (True, outdated)
+        return (entry is not None, outdated)
+
+    def status(self, tgame, glist="PSV"):
+        """
+        Return list of status badges for @tgame from list @glist: cached,
+        installed and/or outdated (installed, but not from the listed package)
+        """
+        badges = ['cached'] if self.is_cached(tgame) else []
+        installed, outdated = self.installed(tgame, glist)
+        if installed:
+            badges.append('installed')
+        if outdated:
+            badges.append('outdated')
+        return badges
+
+    def matches(self, tgame, glist="PSV", statuses=None):
+        """
+        Check that @tgame has every status in @statuses (see STATUSES)
+        """
+        if not statuses:
+            return True
+        badges = self.status(tgame, glist)
+        for tstat in statuses:
+            if tstat == 'uncached':
+                ok = 'cached' not in badges
+            elif tstat == 'missing':
+                ok = 'installed' not in badges
+            else:
+                ok = tstat in badges
+            if not ok:
+                return False
+        return True
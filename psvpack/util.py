@@ -17,15 +17,26 @@ import re
 import platform
 import logging
 import subprocess
+from time import time
 
 import yaml
+import arrow
+import progressbar
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 from psvpack import default_config, conf_header
+from psvpack import metrics
+from psvpack.profiler import timed, current_span
 
 
 logger = logging.getLogger('psvpack')
 
 
+@timed('config')
 def load_config(fpath=None, interactive=True):
     if fpath is None:
         fpath = get_platform_confpath('config.yaml')
@@ -128,17 +139,188 @@ def fmtsize(insize, rate=False, bits=False):
         ostr = "%3.01f %s%s" % (onx, tunit, suffix)
     return ostr
 
+def parse_size(sizestr):
+    """
+    Parse size string such as `500M` or `1.5T` into bytes
+    Returns None if @sizestr is invalid
+    """
+    m = re.match(r'^\s*([0-9.]+)\s*([KMGTP]?)i?B?\s*$', str(sizestr), re.I)
+    if not m:
+        return None
+    try:
+        return int(float(m.group(1)) * 1024 ** ' KMGTP'.index(m.group(2).upper() or ' '))
+    except ValueError:
+        return None
+
+def parse_window(window):
+    """
+    Parse time window `HH:MM-HH:MM` (local time) into a tuple of
+    (start, end) minutes past midnight. Returns None if invalid
+    """
+    m = re.match(r'^\s*(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})\s*$', str(window))
+    if not m:
+        return None
+    hs, ms, he, me = [int(x) for x in m.groups()]
+    if hs > 23 or he > 24 or ms > 59 or me > 59:
+        return None
+    return (hs * 60 + ms, he * 60 + me)
+
+def in_window(window, now=None):
+    """
+    Check if @now (default: current local time) is within parsed time @window
+    Windows that wrap past midnight (eg. 22:00-06:00) are supported
+    """
+    now = now or arrow.now()
+    nmin = now.hour * 60 + now.minute
+    start, end = window
+    if start <= end:
+        return start <= nmin < end
+    return nmin >= start or nmin < end
+
+@timed('hash')
 def sha256sum(fpath):
     """
     Run sha256sum on @fpath
     """
+    stime = time()
     ss = subprocess.Popen(['sha256sum', fpath], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
     so, se = ss.communicate()
+    metrics.HASH_TIME.observe(time() - stime)
     if ss.returncode != 0:
         return None
     else:
+        current_span().add_bytes(os.path.getsize(fpath))
         return so.split()[0].strip().decode('utf-8', errors='ignore')
 
+def preallocate(f, size):
+    """
+    Reserve @size bytes on disk for open file @f, so that large downloads
+    are written into contiguous blocks. Silently skipped on platforms or
+    filesystems that don't support fallocate
+    """
+    if size is None or size <= 0 or not hasattr(os, 'posix_fallocate'):
+        return False
+    try:
+        os.posix_fallocate(f.fileno(), 0, size)
+        return True
+    except OSError as e:
+        logger.debug("Unable to preallocate %d bytes for %s: %s", size, f.name, str(e))
+        return False
+
+class ProgressBarCallback(object):
+    """
+    Progress callback that renders a console progressbar
+    Called as callback(curbyte, total)
+    """
+    def __init__(self, total=0):
+        self.pg = progressbar.ProgressBar(min_value=0, max_value=total if total > 0 else progressbar.UnknownLength)
+        self.pg.start()
+
+    def __call__(self, curbyte, total):
+        if self.pg.max_value is not progressbar.UnknownLength and curbyte > self.pg.max_value:
+            self.pg.max_value = curbyte
+        self.pg.update(curbyte)
+
+    def finish(self):
+        self.pg.finish()
+
+class LogProgress(object):
+    """
+    Progress callback that periodically logs progress & transfer rate of
+    download @name, for use when several downloads share the terminal
+    Called as callback(curbyte, total)
+    """
+    def __init__(self, name, interval=10.0):
+        self.name = name
+        self.interval = interval
+        self.stime = time()
+        self.last_log = self.stime
+
+    def __call__(self, curbyte, total):
+        nowtime = time()
+        if nowtime - self.last_log >= self.interval:
+            self.last_log = nowtime
+            pct = " (%.1f%%)" % (100.0 * curbyte / total) if total > 0 else ""
+            logger.info("%s: %s%s @ %s", self.name, fmtsize(curbyte).strip(), pct,
+                        fmtsize(curbyte / max(nowtime - self.stime, 0.001), rate=True).strip())
+
+class ThrottledProgress(object):
+    """
+    Wraps progress callback @callback so that it is invoked at most once
+    every @interval seconds, rather than once per chunk. The final update
+    is always delivered by finish()
+    """
+    def __init__(self, callback, interval=0.25):
+        self.callback = callback
+        self.interval = interval
+        self.last_call = 0.0
+        self.curbyte = 0
+        self.total = 0
+
+    def __call__(self, curbyte, total):
+        self.curbyte = curbyte
+        self.total = total
+        nowtime = time()
+        if nowtime - self.last_call >= self.interval:
+            self.last_call = nowtime
+            self.callback(curbyte, total)
+
+    def finish(self):
+        self.callback(self.curbyte, self.total)
+        if hasattr(self.callback, 'finish'):
+            self.callback.finish()
+
+class FileLock(object):
+    """
+    Advisory inter-process lock, using flock() on lock file @path
+    Locks are held per open file, so separate threads in the same process
+    also exclude each other. On platforms without fcntl, locking is a no-op
+    Can be used as a context manager, which blocks until the lock is acquired
+    """
+    def __init__(self, path, shared=False):
+        self.path = path
+        self.shared = shared
+        self.fd = None
+
+    def acquire(self, blocking=True):
+        """
+        Acquire the lock. If @blocking is False, returns False immediately
+        if the lock is held elsewhere
+        """
+        if fcntl is None:
+            return True
+        ldir = os.path.dirname(self.path)
+        if ldir and not os.path.exists(ldir):
+            os.makedirs(ldir, 0o775, exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o664)
+        mode = fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX
+        try:
+            fcntl.flock(fd, mode if blocking else mode | fcntl.LOCK_NB)
+        except (BlockingIOError, InterruptedError):
+            os.close(fd)
+            return False
+        except OSError:
+            os.close(fd)
+            raise
+        self.fd = fd
+        return True
+
+    def release(self):
+        """
+        Release the lock
+        """
+        if self.fd is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
 def get_platform_confpath(fname=None):
     """
     Determine the default config path for
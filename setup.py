@@ -16,6 +16,9 @@ setup(
     scripts = [],
 
     install_requires = ['docutils', 'requests', 'arrow>=0.7.0', 'progressbar2', 'pyyaml'],
+    extras_require = {
+        'gui': [ 'PyQt5' ],
+    },
 
     package_data = {
         '': [ '*.md' ],